@@ -1,3 +1,5 @@
+import logging
+import hashlib
 from datetime import datetime,timedelta
 from airflow import DAG 
 from airflow.operators.python import PythonOperator
@@ -6,14 +8,74 @@ from airflow.providers.common.sql.operators.sql import SQLExecuteQueryOperator
 from airflow.operators.empty import EmptyOperator
 from airflow.models.baseoperator import chain
 
-from modules.pipedriveapi import PipedriveDeals
+from modules.file_import import FileLoad
+from modules.journal import LoadJournal
+from modules.keyvault import KeyVaultStorage
+from modules.ratelimit import RateLimiter
+from modules.metrics import Metrics
+from modules.shard import shard_condition
+from modules.sync import FAILED
 
-def publish_data_to_pipedrive(self):
-    with open('/tmp/dbt_dataset/pipedrive_orders.csv') as file_in:
-        deal_api_obj = PipedriveDeals()
-        for line in file_in:
-            title, status, value = line.split(",")
-            deal_api_obj.add_deal({ "title":title, "status":status, "value":value })
+# publish runs as this many parallel tasks, each with own share of orders
+PUBLISH_SHARDS = 4
+# parallel add_deal requests sent by each publish task
+PUBLISH_WORKERS = 4
+# all publish tasks share one rate budget through this file, other clients keep in-process limiter
+PUBLISH_RATE_LIMIT_FILE = '/tmp/pipedrive_rate_limit.json'
+# outside of dataset dir, so Airflow retry of publish task resumes after published rows
+PUBLISH_JOURNAL = '/tmp/pipedrive_publish_journal_{shard}.sqlite'
+# rows are streamed from warehouse, order keeps row offsets stable for journal across retries,
+# shards are split by hash of order_id, so every order is published by exactly one shard
+PUBLISH_QUERY = """SELECT
+                    pipedrive_title as title,
+                    pipedrive_status as status,
+                    pipedrive_value::int as value
+                    FROM dbt.pipedrive_orders
+                    WHERE {shard_condition}
+                    ORDER by order_id ASC"""
+PUBLISH_FETCH_SIZE = 5000
+
+def publish_shard_to_pipedrive(shard, ds = None, **context):
+    query = PUBLISH_QUERY.format(shard_condition = shard_condition('order_id', shard, PUBLISH_SHARDS))
+    # journal input is identified by query and run date instead of checksum of extracted file
+    checksum = hashlib.sha256(f"{query}\n{ds}".encode('utf-8')).hexdigest()
+    connection = PostgresHook(postgres_conn_id = 'postgress_localhost').get_conn()
+    with LoadJournal(PUBLISH_JOURNAL.format(shard = shard)).start(f'dbt.pipedrive_orders shard {shard}', checksum=checksum) as journal:
+        # limiter is process wide, so it is created with shared file before client picks it up
+        RateLimiter.reset_limiter()
+        RateLimiter.get_limiter(dict(KeyVaultStorage().get_config(), rate_limit_shared_file = PUBLISH_RATE_LIMIT_FILE))
+        loader = FileLoad()
+        try:
+            # named cursor is server side, only one fetch batch is held in memory
+            with connection.cursor(name = f'pipedrive_orders_{shard}') as cursor:
+                records = loader.read_cursor(cursor, query, batch_size=PUBLISH_FETCH_SIZE)
+                # every order is published as own deal, sync mode would merge orders of one customer
+                # into one deal as long as title is the only key of order in Pipedrive
+                loaded, failed = loader.load_records(records, workers=PUBLISH_WORKERS, journal=journal)
+                counts = {"loaded": loaded, FAILED: failed}
+        finally:
+            connection.close()
+            # request counts and latencies of this try end up in task log
+            for line in Metrics.get_metrics().summary():
+                logging.info(f"Pipedrive API {line}")
+    # returned to merge task through XCom
+    return {"shard": shard, "counts": counts, "failures": loader.failures}
+
+def merge_publish_results(ti = None, **context):
+    results = [result for result in ti.xcom_pull(task_ids = 'publish_data') if result]
+    totals = {}
+    failures = []
+    for result in sorted(results, key = lambda result: result['shard']):
+        logging.info(f"Shard {result['shard']}: " + ", ".join(f"{action} {count}" for action, count in result['counts'].items()))
+        for action, count in result['counts'].items():
+            totals[action] = totals.get(action, 0) + count
+        failures += [(result['shard'], title, error) for title, error in result['failures']]
+    logging.info(f"Publish of {len(results)} shards finished: " + ", ".join(f"{action} {count}" for action, count in totals.items()))
+    for shard, title, error in failures:
+        logging.error(f"Shard {shard}: {title} failed with {error}")
+    if totals.get(FAILED, 0) > len(failures):
+        logging.error(f"{totals[FAILED] - len(failures)} more failures are not listed")
+    return {"counts": totals, "failures": failures}
 
 #Default arguments
 default_args = {
@@ -41,27 +103,19 @@ with DAG('pipedrive_pipelinee',
     dag = pipedrive_pipeline,
     task_id = run_transformations)
 
-    extract_data = PostgresOperator(
-    task_id = 'extract_data',
-    sql = """COPY ( COPY ( SELECT
-                    pipedrive_title as title,
-                    pipedrive_status as status,
-                    pipedrive_value::int as value
-                    FROM dbt.pipedrive_orders
-                    ORDER by order_id ASC
-            ) TO '/tmp/dbt_dataset/pipedrive_orders.csv' WITH CSV DELIMITER ',';""",
-    postgres_conn_id = 'postgress_localhost',
-    autocommit = True,
-    dag = pipedrive_pipeline)
+    publish_data = PythonOperator.partial(
+    python_callable = publish_shard_to_pipedrive,
+    dag = pipedrive_pipeline,
+    task_id = 'publish_data').expand(op_kwargs = [{"shard": shard} for shard in range(PUBLISH_SHARDS)])
 
-    publish_data = PythonOperator(
-    python_callable = publish_data_to_pipedrive,
+    merge_results = PythonOperator(
+    python_callable = merge_publish_results,
     dag = pipedrive_pipeline,
-    task_id = publish_data)
+    task_id = 'merge_results')
 
     cleanup_env = BashOperator(
     bash_command = "rm -rf /tmp/dbt_dataset",
     dag = pipedrive_pipeline,
     task_id = cleanup_env)
 
-    extract_dataset >> update_models >> run_tranformations >> extract_data >> publish_data >> cleanup_env
\ No newline at end of file
+    extract_dataset >> update_models >> run_tranformations >> publish_data >> merge_results >> cleanup_env
\ No newline at end of file
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+""" Throughput of sync (thread pool) and asyncio clients adding and listing deals, local mock server
+"""
+import time
+import asyncio
+import argparse
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.file_import import FileLoad
+from modules.pipedriveapi import PipedriveDeals
+from modules.pipedriveapi_async import AsyncPipedriveREST, AsyncPipedriveDeals
+
+
+def records(count):
+    return ({"title": f"Order {i}", "status": "open", "value": i} for i in range(count))
+
+
+async def async_add(count, concurrency):
+    async with AsyncPipedriveREST() as restapi:
+        ok = 0
+        async for record, result in AsyncPipedriveDeals(restapi).add_deals(records(count), concurrency=concurrency):
+            ok += not isinstance(result, Exception) and result[0] == 200
+        return ok
+
+
+async def async_list(limit):
+    async with AsyncPipedriveREST() as restapi:
+        return len([deal async for deal in AsyncPipedriveDeals(restapi).iter_deals(limit=limit)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--deals', type=int, default=5000)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('-l', '--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    with MockPipedriveServer() as server, client_workdir(server, http_pool_size=args.concurrency):
+        start = time.perf_counter()
+        loaded, failed = FileLoad().load_records(records(args.deals), workers=args.concurrency)
+        report(f"sync add_deal, {args.concurrency} threads", loaded, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        loaded = asyncio.run(async_add(args.deals, args.concurrency))
+        report(f"async add_deals, concurrency {args.concurrency}", loaded, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        listed = sum(1 for _ in PipedriveDeals().iter_deals(limit=args.limit))
+        report(f"sync iter_deals, limit {args.limit}", listed, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        listed = asyncio.run(async_list(args.limit))
+        report(f"async iter_deals, limit {args.limit}", listed, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
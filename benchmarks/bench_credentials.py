@@ -0,0 +1,32 @@
+#!/usr/bin/python3
+""" Credential file reads per loaded rows for FileLoad.load_records, local mock server
+"""
+import time
+import argparse
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.keyvault import KeyVaultStorage
+from modules.file_import import FileLoad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--rows', type=int, default=10000)
+    parser.add_argument('-w', '--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with MockPipedriveServer() as server, client_workdir(server, http_pool_size=args.workers):
+        records = ({"title": f"Order {i}", "status": "open", "value": i} for i in range(args.rows))
+        before = KeyVaultStorage.cache_stats()
+        start = time.perf_counter()
+        loaded, failed = FileLoad().load_records(records, workers=args.workers)
+        elapsed = time.perf_counter() - start
+        after = KeyVaultStorage.cache_stats()
+        reads = after['reads'] - before['reads']
+        report("FileLoad.load_records", loaded, elapsed, failed=failed, file_reads=reads,
+            cache_hits=after['hits'] - before['hits'], reads_per_10k_rows=round(reads * 10000 / max(1, args.rows), 2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+""" Enriching deals with person, organization, owner, stage and pipeline through DealEnricher against mock server
+
+One request per related entity would send deals x 5 requests, enricher sends batched ids
+and lists small resources once. Request counts are taken from mock server.
+"""
+import time
+import argparse
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveDeals
+from modules.enrich import DealEnricher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--deals', type=int, default=50000)
+    parser.add_argument('--persons', type=int, default=20000)
+    parser.add_argument('--organizations', type=int, default=2000)
+    parser.add_argument('--cache-size', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server latency per request')
+    args = parser.parse_args()
+
+    with MockPipedriveServer(latency=args.latency) as server:
+        server.seed_deals(args.deals)
+        server.seed_entities('persons', args.persons)
+        server.seed_entities('organizations', args.organizations)
+        for deal in server.deals:
+            deal.update(person_id=deal['id'] % args.persons + 1, org_id=deal['id'] % args.organizations + 1)
+        with client_workdir(server):
+            enricher = DealEnricher(cache_size=args.cache_size)
+            requests_before = server.stats['requests']
+            start = time.perf_counter()
+            count = sum(1 for deal in enricher.enrich(PipedriveDeals().iter_deal_models(limit=500)))
+            elapsed = time.perf_counter() - start
+            report("DealEnricher.enrich", count, elapsed, requests=server.stats['requests'] - requests_before,
+                one_per_entity=count * 5 + count // 500 + 1, **enricher.stats)
+
+
+if __name__ == "__main__":
+    main()
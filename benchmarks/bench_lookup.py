@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+""" Deal lookups by title: search request per lookup against DealLookupIndex loaded once from mock server
+
+Index time includes loading all deals, lookups after it send no requests.
+"""
+import time
+import random
+import argparse
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveDeals
+from modules.lookup import DealLookupIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-d', '--deals', type=int, default=20000, help='deals in mock account')
+    parser.add_argument('-n', '--lookups', type=int, default=1000000, help='lookups answered by index')
+    parser.add_argument('-s', '--searches', type=int, default=200, help='lookups answered by search requests')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server latency per request')
+    args = parser.parse_args()
+
+    titles = [f"Deal {random.randint(1, args.deals)}" for _ in range(args.lookups)]
+    with MockPipedriveServer(latency=args.latency) as server:
+        server.seed_deals(args.deals)
+        # deals changed at different times, so refresh has recent changes only
+        for deal in server.deals:
+            deal['update_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1725000000 + deal['id']))
+        with client_workdir(server):
+            deals = PipedriveDeals()
+            start = time.perf_counter()
+            for title in titles[:args.searches]:
+                deals.find_deal({"term": title, "fields": "title", "exact_match": "true"})
+            report("find_deal per lookup", args.searches, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            index = DealLookupIndex(deals).load()
+            report("DealLookupIndex.load", len(index), time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for title in titles:
+                index.find_one('title', title)
+            elapsed = time.perf_counter() - start
+            report("DealLookupIndex.find_one", args.lookups, elapsed, us_per_lookup=round(elapsed / args.lookups * 1e6, 3))
+
+            server.deals[0]['update_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1725000000 + args.deals + 1))
+            start = time.perf_counter()
+            merged = index.refresh()
+            report("DealLookupIndex.refresh", merged, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
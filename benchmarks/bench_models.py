@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+""" Memory and time of holding 100k deals parsed from API pages: decoded str + json.loads dicts against Deal records
+
+Pages are encoded before measurement, so only parsing and kept records are traced.
+Deals carry the full set of v2 fields, most of which loader never reads.
+"""
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+
+from common import report
+from modules import models
+from modules.models import Deal, JsonPage
+
+
+def fixture_deal(deal_id):
+    return {"id": deal_id, "title": f"Order {deal_id}", "creator_user_id": 1, "owner_id": 1, "person_id": deal_id,
+        "org_id": deal_id % 100, "stage_id": 1, "pipeline_id": 1, "value": deal_id * 10, "currency": "EUR",
+        "add_time": "2024-08-29T00:00:00Z", "update_time": "2024-08-29T00:00:00Z", "stage_change_time": None,
+        "is_deleted": False, "status": "open", "probability": None, "lost_reason": None, "visible_to": 3,
+        "close_time": None, "won_time": None, "lost_time": None, "local_won_date": None, "local_lost_date": None,
+        "local_close_date": None, "expected_close_date": "2024-09-30", "label_ids": [], "origin": "API",
+        "origin_id": None, "channel": None, "channel_id": None, "acv": None, "arr": None, "mrr": None,
+        "custom_fields": {"6b7e4c1e0f": f"order-{deal_id}"}}
+
+
+def fixture_pages(deals, page_size):
+    pages = []
+    for start in range(1, deals + 1, page_size):
+        data = [fixture_deal(deal_id) for deal_id in range(start, min(deals + 1, start + page_size))]
+        next_cursor = str(start + page_size) if start + page_size <= deals else None
+        pages.append(json.dumps({"success": True, "data": data, "additional_data": {"next_cursor": next_cursor}}).encode('utf-8'))
+    return pages
+
+
+def parse_dicts(pages):
+    # former way: content.decode, then json.loads of whole page
+    deals = []
+    for body in pages:
+        deals.extend(json.loads(body.decode('utf-8'))['data'])
+    return deals
+
+
+def parse_models(backend):
+    def parse(pages):
+        deals = []
+        for body in pages:
+            deals.extend(JsonPage(body, Deal.from_dict, backend))
+        return deals
+    return parse
+
+
+def measure(name, parse, pages):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    deals = parse(pages)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report(name, len(deals), elapsed, kept_mib=round(current / 2 ** 20, 1), peak_mib=round(peak / 2 ** 20, 1))
+    del deals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--deals', type=int, default=100000)
+    parser.add_argument('-p', '--page-size', type=int, default=500)
+    args = parser.parse_args()
+
+    pages = fixture_pages(args.deals, args.page_size)
+    measure("before: json.loads dicts", parse_dicts, pages)
+    measure("after: Deal records, json stream", parse_models('json'), pages)
+    if models.orjson is not None:
+        measure("after: Deal records, orjson", parse_models('orjson'), pages)
+
+
+if __name__ == "__main__":
+    main()
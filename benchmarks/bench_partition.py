@@ -0,0 +1,44 @@
+#!/usr/bin/python3
+""" Full deal listing as one cursor chain against partitions listed concurrently, mock server adds latency per page
+
+Mock server runs in the same process, its JSON encoding competes with client for GIL.
+"""
+import time
+import argparse
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveDeals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--deals', type=int, default=50000)
+    parser.add_argument('-l', '--limit', type=int, default=500)
+    parser.add_argument('-w', '--workers', type=int, default=8)
+    parser.add_argument('-p', '--partitions', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.05, help='mock server latency per request')
+    args = parser.parse_args()
+
+    with MockPipedriveServer(latency=args.latency) as server:
+        server.seed_deals(args.deals)
+        # deals changed evenly over a year
+        for deal in server.deals:
+            deal['update_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1693526400 + deal['id'] * 31536000 // args.deals))
+            deal['status'] = ('open', 'won', 'lost')[deal['id'] % 3]
+        with client_workdir(server, http_pool_size=args.workers):
+            deals = PipedriveDeals()
+            start = time.perf_counter()
+            count = sum(1 for deal in deals.iter_deals(limit=args.limit))
+            report("iter_deals", count, time.perf_counter() - start, requests=server.stats['requests'])
+
+            for by in ('update_time', 'status'):
+                requests_before = server.stats['requests']
+                start = time.perf_counter()
+                count = sum(1 for deal in deals.iter_deals_partitioned(by=by, workers=args.workers, limit=args.limit, count=args.partitions))
+                report(f"iter_deals_partitioned by {by}", count, time.perf_counter() - start,
+                    requests=server.stats['requests'] - requests_before)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+""" Wall time of pipedrive.py invocations not calling API, against eager import of all modules
+
+Then whoami against mock server, run in own process and forwarded to pipedrive.py daemon.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+from common import BENCH_CONFIG, percentile, report
+from modules.mockserver import MockPipedriveServer
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(REPO_DIR, 'pipedrive.py')
+
+COMMANDS = {
+    "pipedrive.py commands": [sys.executable, CLI, 'commands'],
+    "pipedrive.py show_auth code": [sys.executable, CLI, 'show_auth', 'code'],
+    # what every invocation paid when handlers were imported at top of pipedrive.py
+    "eager import of all modules": [sys.executable, '-c', 'from modules import *'],
+    "python startup only": [sys.executable, '-c', 'pass'],
+}
+
+
+def run(command, runs, workdir, **env):
+    env = dict(os.environ, HOME=workdir, PYTHONPATH=REPO_DIR, **env)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'config.json'), 'w') as config_file:
+            json.dump(dict(BENCH_CONFIG, client_id='client', client_secret='secret'), config_file)
+        with open(os.path.join(workdir, 'token.json'), 'w') as token_file:
+            json.dump({"access_token": "access", "refresh_token": "refresh"}, token_file)
+        for name, command in COMMANDS.items():
+            timings = run(command, args.runs, workdir)
+            report(name, args.runs, sum(timings), p50_ms=round(percentile(timings, 50) * 1000, 1),
+                p99_ms=round(percentile(timings, 99) * 1000, 1))
+
+    with MockPipedriveServer() as server, tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, 'config.json'), 'w') as config_file:
+            json.dump(dict(BENCH_CONFIG, **server.client_config()), config_file)
+        with open(os.path.join(workdir, 'token.json'), 'w') as token_file:
+            json.dump(server.client_token(), token_file)
+        whoami = [sys.executable, CLI, 'whoami']
+        timings = run(whoami, args.runs, workdir, PIPEDRIVE_NO_DAEMON='1')
+        report("pipedrive.py whoami", args.runs, sum(timings), p50_ms=round(percentile(timings, 50) * 1000, 1),
+            p99_ms=round(percentile(timings, 99) * 1000, 1))
+        daemon = subprocess.Popen([sys.executable, CLI, 'daemon'], cwd=workdir, env=dict(os.environ, HOME=workdir, PYTHONPATH=REPO_DIR),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            # first forwarded command waits until daemon listens
+            run([sys.executable, CLI, 'whoami'], 1, workdir)
+            timings = run(whoami, args.runs, workdir)
+            report("pipedrive.py whoami via daemon", args.runs, sum(timings), p50_ms=round(percentile(timings, 50) * 1000, 1),
+                p99_ms=round(percentile(timings, 99) * 1000, 1), connections=server.stats['connections'])
+        finally:
+            subprocess.run([sys.executable, CLI, 'daemon', '--stop'], cwd=workdir, env=dict(os.environ, HOME=workdir, PYTHONPATH=REPO_DIR),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            daemon.wait(10)
+
+
+if __name__ == "__main__":
+    main()
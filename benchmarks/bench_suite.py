@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+""" Throughput, latency and memory of load_file, deals pagination and token refresh storm, local mock server
+
+Every scenario prints rows/sec, p50/p99 latency of API calls and peak traced memory,
+--json stores the same numbers to compare runs before and after a change.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import threading
+import contextlib
+
+from common import client_workdir, percentile, report
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveDeals
+from modules.file_import import FileLoad
+
+
+def timed(func, latencies):
+    """ Wrap API call, its duration is appended to latencies
+    """
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+
+@contextlib.contextmanager
+def measure(name, results, trace_memory):
+    """ Time block and record its peak traced memory, block fills rows and latencies of returned dict
+    """
+    result = {"rows": 0, "latencies": []}
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        if trace_memory:
+            tracemalloc.stop()
+        latencies = result.pop("latencies")
+        rows = result.pop("rows")
+        stats = dict(p50_ms=round(percentile(latencies, 50) * 1000, 2), p99_ms=round(percentile(latencies, 99) * 1000, 2),
+            peak_kib=round(peak / 1024, 1), **result)
+        report(name, rows, elapsed, **stats)
+        results[name] = dict(stats, rows=rows, seconds=round(elapsed, 3), rows_per_sec=round(rows / elapsed if elapsed else 0, 1))
+
+
+def write_csv(file_name, rows):
+    with open(file_name, 'w', newline='') as csv_file:
+        for i in range(rows):
+            csv_file.write(f"Order {i},open,{i}\n")
+
+
+def bench_load_file(server, args, results):
+    with client_workdir(server, http_pool_size=args.workers) as workdir:
+        file_name = os.path.join(workdir, 'orders.csv')
+        write_csv(file_name, args.rows)
+        loader = FileLoad()
+        with measure("FileLoad.load_file", results, args.memory) as result:
+            loader._deal_api.add_deal = timed(loader._deal_api.add_deal, result["latencies"])
+            created = server.stats['deals_created']
+            argv = sys.argv
+            sys.argv = ['pipedrive.py', 'load_file', '--workers', str(args.workers), file_name]
+            try:
+                loader.load_file()
+            finally:
+                sys.argv = argv
+            result["rows"] = server.stats['deals_created'] - created
+
+
+def bench_pagination(server, args, results):
+    server.seed_deals(max(0, args.deals - len(server.deals)))
+    with client_workdir(server):
+        deals = PipedriveDeals()
+        with measure("PipedriveDeals.iter_deals", results, args.memory) as result:
+            deals._restapi.get_request = timed(deals._restapi.get_request, result["latencies"])
+            result["rows"] = sum(1 for _ in deals.iter_deals(limit=args.page_limit))
+
+
+def bench_refresh_storm(server, args, results):
+    with client_workdir(server, http_pool_size=args.workers):
+        records = ({"title": f"Storm {i}", "status": "open", "value": i} for i in range(args.rows))
+        loader = FileLoad()
+        stop = threading.Event()
+
+        def rotate():
+            # every rotation invalidates token of all requests in flight at once
+            while not stop.wait(args.rotate_every):
+                server.rotate_access_token()
+
+        refreshes = server.stats['token_refreshes']
+        unauthorized = server.stats['unauthorized']
+        rotator = threading.Thread(target=rotate, daemon=True)
+        with measure("token refresh storm", results, args.memory) as result:
+            loader._deal_api.add_deal = timed(loader._deal_api.add_deal, result["latencies"])
+            rotator.start()
+            try:
+                loaded, failed = loader.load_records(records, workers=args.workers)
+            finally:
+                stop.set()
+                rotator.join()
+            result.update(rows=loaded, failed=failed,
+                refreshes=server.stats['token_refreshes'] - refreshes,
+                unauthorized=server.stats['unauthorized'] - unauthorized)
+
+
+SCENARIOS = {
+    "load_file": bench_load_file,
+    "pagination": bench_pagination,
+    "refresh_storm": bench_refresh_storm,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', choices=[[]] + list(SCENARIOS), default=[], help='scenarios to run, all by default')
+    parser.add_argument('-n', '--rows', type=int, default=5000, help='rows loaded by load_file and refresh_storm')
+    parser.add_argument('-d', '--deals', type=int, default=20000, help='deals listed by pagination')
+    parser.add_argument('-w', '--workers', type=int, default=8)
+    parser.add_argument('--page-limit', type=int, default=500)
+    parser.add_argument('--rotate-every', type=float, default=0.5, help='seconds between access token rotations in refresh_storm')
+    parser.add_argument('--latency', type=float, default=0.0, help='mock server latency of every answer, seconds')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='part of API requests answered with 503')
+    parser.add_argument('--rate-limit', type=int, default=None, help='requests per 2s window accepted by mock server')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip tracemalloc, it slows down all scenarios')
+    parser.add_argument('--json', help='store results to json file')
+    args = parser.parse_args()
+
+    results = {}
+    with MockPipedriveServer(latency=args.latency, latency_jitter=args.latency_jitter,
+            error_rate=args.error_rate, rate_limit=args.rate_limit) as server:
+        for name in args.scenarios or SCENARIOS:
+            SCENARIOS[name](server, args, results)
+        results["server"] = dict(server.stats)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
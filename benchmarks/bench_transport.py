@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+""" Requests per second of bare requests.get against shared pooled transport, local mock server
+"""
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from common import client_workdir, report
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveREST
+
+
+def run(func, requests_count, threads):
+    start = time.perf_counter()
+    if threads == 1:
+        for _ in range(requests_count):
+            func()
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda _: func(), range(requests_count)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--requests', type=int, default=2000)
+    parser.add_argument('-t', '--threads', type=int, default=1)
+    args = parser.parse_args()
+
+    with MockPipedriveServer() as server, client_workdir(server, http_pool_size=max(10, args.threads)):
+        uri = server.base_uri + "api/v1/users/me"
+        headers = {"Authorization": f"Bearer {server.access_token}"}
+
+        connections = server.stats['connections']
+        elapsed = run(lambda: requests.get(uri, headers=headers), args.requests, args.threads)
+        report("before: requests.get per call", args.requests, elapsed, connections=server.stats['connections'] - connections)
+
+        restapi = PipedriveREST()
+        connections = server.stats['connections']
+        elapsed = run(lambda: restapi.get_request(uri), args.requests, args.threads)
+        report("after: shared PipedriveTransport", args.requests, elapsed, connections=server.stats['connections'] - connections)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+""" Webhook deliveries accepted per second by WebhookReceiver and events read back by consumer
+
+Part of deliveries are repeated, as Pipedrive does when answer is late, they have to be stored once.
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from common import report
+from modules.webhooks import WebhookReceiver, WebhookStore
+
+
+def payload(event_id):
+    return {"meta": {"action": "change", "entity": "deal", "entity_id": str(event_id), "id": f"event-{event_id}",
+        "version": "2.0", "timestamp": "2024-09-01T00:00:00Z"}, "data": {"id": event_id, "title": f"Deal {event_id}"}, "previous": None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--events', type=int, default=20000)
+    parser.add_argument('-t', '--threads', type=int, default=8)
+    parser.add_argument('--duplicates', type=float, default=0.1, help='part of events delivered twice')
+    args = parser.parse_args()
+
+    deliveries = list(range(args.events)) + list(range(int(args.events * args.duplicates)))
+    with tempfile.TemporaryDirectory() as workdir:
+        with WebhookStore(os.path.join(workdir, 'webhooks.sqlite')) as store:
+            receiver = WebhookReceiver(store, port=0).start()
+            host, port = receiver._server.server_address[:2]
+
+            def deliver(chunk):
+                connection = http.client.HTTPConnection(host, port)
+                for event_id in chunk:
+                    connection.request('POST', receiver.path, body=json.dumps(payload(event_id)), headers={'Content-Type': 'application/json'})
+                    connection.getresponse().read()
+                connection.close()
+
+            chunks = [deliveries[i::args.threads] for i in range(args.threads)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.threads) as executor:
+                list(executor.map(deliver, chunks))
+            receiver.stop()
+            report("WebhookReceiver deliveries", len(deliveries), time.perf_counter() - start, **receiver.stats)
+
+            start = time.perf_counter()
+            count = sum(1 for event in store.consume(batch_size=1000))
+            report("WebhookStore.consume", count, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import json
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import keyvault
+from modules.transport import PipedriveTransport
+from modules.ratelimit import RateLimiter
+from modules.retry import RetryPolicy
+from modules.metrics import Metrics
+from modules.cache import ResponseCache
+
+# benchmarks measure client overhead, limiter is configured out of the way
+BENCH_CONFIG = {
+    "code": "",
+    "redirect_uri": "",
+    "token_autorefresh": 1,
+    "rate_limit_per_second": 1000000,
+    "rate_limit_burst": 1000000,
+}
+
+
+def reset_process_state():
+    keyvault._file_cache.clear()
+    PipedriveTransport.reset_transport()
+    RateLimiter.reset_limiter()
+    RetryPolicy.reset_policy()
+    Metrics.reset_metrics()
+    ResponseCache.reset_cache()
+
+
+@contextlib.contextmanager
+def client_workdir(server, **config):
+    """ Temporary working directory with config.json and token.json pointing to mock server
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        client_config = dict(BENCH_CONFIG, **server.client_config())
+        client_config.update(config)
+        with open(os.path.join(workdir, 'config.json'), 'w') as config_file:
+            json.dump(client_config, config_file)
+        with open(os.path.join(workdir, 'token.json'), 'w') as token_file:
+            json.dump(server.client_token(), token_file)
+        os.chdir(workdir)
+        reset_process_state()
+        try:
+            yield workdir
+        finally:
+            reset_process_state()
+            os.chdir(cwd)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(name, count, elapsed, **extra):
+    line = f"{name:<40} {count:>8} in {elapsed:8.3f}s {count / elapsed if elapsed else 0:10.1f}/s"
+    for key, value in extra.items():
+        line += f"  {key}={value}"
+    print(line)
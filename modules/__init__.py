@@ -1,8 +1,44 @@
-from .keyvault import *
-from .pipedriveapi import *
-from .file_import import *
-
-__all__ = (
-    keyvault.__all__+
-    pipedriveapi.__all__+
-    file_import.__all__)
\ No newline at end of file
+import importlib
+
+# public names of each submodule, submodule is imported on first access of one of its names,
+# so "from modules.keyvault import KeyVaultStorage" does not pull requests and aiohttp in
+_submodules = {
+    'keyvault': ['KeyVaultStorage'],
+    'transport': ['PipedriveTransport'],
+    'ratelimit': ['RateLimiter','SharedRateLimiter'],
+    'retry': ['RetryPolicy'],
+    'metrics': ['Metrics'],
+    'cache': ['ResponseCache'],
+    'models': ['Deal','JsonPage'],
+    'pipedriveapi': ['PipedriveCLI','PipedriveREST','PipedriveUser','PipedriveDeals','PipedriveResource','PipedriveAPIError'],
+    'pipedriveapi_async': ['AsyncPipedriveREST','AsyncPipedriveUser','AsyncPipedriveDeals'],
+    'bulk_load': ['BulkLoader'],
+    'mockserver': ['MockPipedriveServer'],
+    'sync': ['DealIndex','DealSync'],
+    'journal': ['LoadJournal'],
+    'export': ['DealExport'],
+    'lookup': ['DealLookupIndex'],
+    'enrich': ['DealEnricher'],
+    'webhooks': ['WebhookCLI','WebhookReceiver','WebhookStore'],
+    'daemon': ['CommandDaemon'],
+    'ingest': ['CsvSource','CursorSource','DealSchema','DealIngest'],
+    'shard': ['ShardSource'],
+    'file_import': ['FileLoad'],
+}
+
+_exports = {name: submodule for submodule, names in _submodules.items() for name in names}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    submodule = _exports.get(name)
+    if submodule is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module('.' + submodule, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
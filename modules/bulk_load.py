@@ -0,0 +1,44 @@
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ['BulkLoader']
+
+DEFAULT_WORKERS = 1
+
+
+class BulkLoader:
+    """ Runs load function over records with bounded worker pool, results are returned in input order
+    """
+
+    def __init__(self, load_func, workers = DEFAULT_WORKERS, queue_size = None):
+        self._load_func = load_func
+        self._workers = max(1, int(workers))
+        # number of submitted but not yet consumed records, keeps memory flat on big inputs
+        self._queue_size = max(self._workers, int(queue_size or self._workers * 4))
+
+    def _call(self, record):
+        try:
+            return self._load_func(record)
+        except Exception as e:
+            logging.debug(f"Load function raised {e!r}", exc_info=True)
+            return e
+
+    def run(self, records):
+        """ Yield (record, result) pairs in input order, exceptions raised by load function are returned as result
+        """
+        if self._workers == 1:
+            for record in records:
+                yield record, self._call(record)
+            return
+
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='pipedrive-load') as executor:
+            for record in records:
+                in_flight.append((record, executor.submit(self._call, record)))
+                if len(in_flight) >= self._queue_size:
+                    done_record, future = in_flight.popleft()
+                    yield done_record, future.result()
+            while in_flight:
+                done_record, future = in_flight.popleft()
+                yield done_record, future.result()
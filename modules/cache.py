@@ -0,0 +1,179 @@
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import urllib.parse
+from collections import OrderedDict
+
+__all__ = ['ResponseCache']
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 60
+# trailing id of written resource, POST deals and PATCH deals/5 both invalidate cached deals
+_TRAILING_ID = re.compile(r'(/\d+)+/?$')
+
+
+def resource_path(uri):
+    """ Collection path of uri, cached answers under it are dropped when it is written
+    """
+    return _TRAILING_ID.sub('', urllib.parse.urlsplit(uri).path)
+
+
+class ResponseCache:
+    """ LRU cache of successful GET answers with optional SQLite tier, shared by clients of the process
+
+    Entries are keyed by full request uri and hash of access token, so accounts never see
+    answers of each other. Fresh entries are served without request, stale ones are
+    revalidated with If-None-Match/If-Modified-Since when server sent ETag/Last-Modified.
+    Every write through client drops entries under written collection.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_entries = DEFAULT_MAX_ENTRIES, default_ttl = DEFAULT_TTL, ttls = None, file_name = None):
+        self._max_entries = max_entries
+        self._default_ttl = float(default_ttl)
+        # longest matching path suffix wins, e.g. {"users/me": 300, "deals": 30}
+        self._ttls = sorted(((str(name).strip('/'), float(ttl)) for name, ttl in (ttls or {}).items()), key=lambda item: -len(item[0]))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if file_name:
+            self._db = sqlite3.connect(file_name, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                content TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                expires_at REAL NOT NULL)""")
+            self._db.commit()
+        self.stats = {"hits": 0, "revalidated": 0, "misses": 0, "invalidated": 0}
+
+    @classmethod
+    def get_cache(cls, config = None):
+        """ Return process wide cache, None unless response_cache is enabled in config
+        """
+        config = config or {}
+        if not config.get('response_cache'):
+            return None
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls(
+                        max_entries = int(config.get('response_cache_max_entries', DEFAULT_MAX_ENTRIES)),
+                        default_ttl = float(config.get('response_cache_ttl', DEFAULT_TTL)),
+                        ttls = config.get('response_cache_ttls'),
+                        file_name = config.get('response_cache_file'))
+        return cls._instance
+
+    @classmethod
+    def reset_cache(cls):
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def key(uri, access_token):
+        token_id = hashlib.sha256((access_token or '').encode('utf-8')).hexdigest()[:16]
+        return hashlib.sha256(f"{token_id} {uri}".encode('utf-8')).hexdigest()
+
+    def ttl(self, uri):
+        path = urllib.parse.urlsplit(uri).path.strip('/')
+        for name, ttl in self._ttls:
+            if path == name or path.endswith('/' + name):
+                return ttl
+        return self._default_ttl
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def lookup(self, key):
+        """ Return (entry, fresh), entry is None on miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT path, content, etag, last_modified, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = dict(zip(("path", "content", "etag", "last_modified", "expires_at"), row))
+                    self._remember(key, entry)
+        if entry is None:
+            self._count("misses")
+            return None, False
+        return entry, entry["expires_at"] > now
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def store(self, key, uri, content, headers):
+        if 'no-store' in (headers.get('Cache-Control') or ''):
+            return
+        entry = {"path": urllib.parse.urlsplit(uri).path, "content": content, "etag": headers.get('ETag'),
+            "last_modified": headers.get('Last-Modified'), "expires_at": time.time() + self.ttl(uri)}
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO responses (key, path, content, etag, last_modified, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry["path"], content, entry["etag"], entry["last_modified"], entry["expires_at"]))
+                self._db.commit()
+
+    def answer(self, key, uri, entry, code, content, headers):
+        """ Cache answer of GET sent for key, returns (code, content) for caller
+
+        304 answer renews entry and returns its cached content as 200.
+        """
+        if int(code) == 304 and entry is not None:
+            self._count("revalidated")
+            self.store(key, uri, entry["content"], {"ETag": headers.get('ETag') or entry.get("etag"),
+                "Last-Modified": headers.get('Last-Modified') or entry.get("last_modified")})
+            return 200, entry["content"]
+        if int(code) == 200:
+            self.store(key, uri, content, headers)
+        return code, content
+
+    def hit(self, entry):
+        self._count("hits")
+        return 200, entry["content"]
+
+    def invalidate(self, uri):
+        """ Drop cached answers under collection written by request to uri
+        """
+        prefix = resource_path(uri)
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry["path"].startswith(prefix)]
+            for key in keys:
+                del self._entries[key]
+            self.stats["invalidated"] += len(keys)
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+                self._db.commit()
+        if keys:
+            logging.debug(f"Dropped {len(keys)} cached answers under {prefix}")
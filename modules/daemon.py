@@ -0,0 +1,270 @@
+import os
+import sys
+import json
+import socket
+import hashlib
+import logging
+import threading
+import contextlib
+import socketserver
+
+__all__ = ['CommandDaemon']
+
+# buffered output of command is sent to client in chunks of this size
+OUTPUT_CHUNK = 65536
+# seconds client waits for daemon to accept connection before running command in own process
+CONNECT_TIMEOUT = 2.0
+
+
+def socket_dir():
+    """ Per-user directory of daemon sockets, in $XDG_RUNTIME_DIR or ~/.cache
+    """
+    base = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pipedrive')
+
+
+def default_socket_path(workdir = None):
+    """ Socket of daemon serving working directory, PIPEDRIVE_DAEMON_SOCKET overrides it
+
+    config.json and token.json are read from working directory, so every directory has own daemon.
+    """
+    if os.environ.get('PIPEDRIVE_DAEMON_SOCKET'):
+        return os.environ['PIPEDRIVE_DAEMON_SOCKET']
+    digest = hashlib.sha1(os.path.abspath(workdir or os.getcwd()).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(socket_dir(), f"daemon-{digest}.sock")
+
+
+def _make_private_dir(directory):
+    """ Create directory accessible only to current user, refuse one owned by other user
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    stat = os.lstat(directory)
+    if stat.st_uid != os.getuid() or not os.path.isdir(directory) or os.path.islink(directory):
+        raise RuntimeError(f"Socket directory {directory} is not owned by current user")
+    if stat.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+
+
+def _owned_socket(path):
+    """ True when socket exists and belongs to current user, other user could serve commands with own credentials
+    """
+    try:
+        owner = os.stat(path).st_uid
+    except FileNotFoundError:
+        return False
+    if owner != os.getuid():
+        logging.warning(f"Socket {path} is not owned by current user, it is not used")
+        return False
+    return True
+
+
+def _send(wfile, message):
+    wfile.write((json.dumps(message) + "\n").encode('utf-8'))
+    wfile.flush()
+
+
+def forward(argv, socket_path = None, stdout = None, stderr = None):
+    """ Run command in daemon, returns its exit code or None when no daemon serves this directory
+    """
+    path = socket_path or default_socket_path()
+    if not _owned_socket(path):
+        return None
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CONNECT_TIMEOUT)
+    try:
+        client.connect(path)
+    except OSError:
+        # socket left behind by daemon that is gone, or daemon that does not accept connections
+        client.close()
+        return None
+    # commands may run long without output, only connect is bounded
+    client.settimeout(None)
+    with client, client.makefile('rb') as rfile, client.makefile('wb') as wfile:
+        _send(wfile, {"argv": list(argv), "cwd": os.getcwd()})
+        for line in rfile:
+            message = json.loads(line)
+            if 'out' in message:
+                stdout.write(message['out'])
+            elif 'err' in message:
+                stderr.write(message['err'])
+            elif 'fallback' in message:
+                logging.debug(f"Daemon on {path} refused command: {message['fallback']}")
+                return None
+            elif 'exit' in message:
+                stdout.flush()
+                return message['exit']
+    # command may have reached Pipedrive already, so it is not repeated in process
+    stderr.write(f"Daemon on {path} closed connection before command finished\n")
+    return 1
+
+
+class _ClientStream:
+    """ File-like object sending text written by command to client as out or err messages
+    """
+
+    def __init__(self, wfile, kind):
+        self._wfile = wfile
+        self._kind = kind
+        self._buffer = []
+        self._size = 0
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._size += len(text)
+        if self._size >= OUTPUT_CHUNK or (self._kind == 'err' and text.endswith("\n")):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            _send(self._wfile, {self._kind: "".join(self._buffer)})
+            self._buffer = []
+            self._size = 0
+
+    def isatty(self):
+        return False
+
+
+class _CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # every connection is answered right away, busy daemon sends client back to own process
+    daemon_threads = True
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        line = self.rfile.readline()
+        if line:
+            self.server.command_daemon.serve_request(json.loads(line), self.wfile)
+
+
+class CommandDaemon:
+    """ Runs pipedrive.py commands sent over Unix socket in one long-living process
+
+    Transport pool, cached credentials, rate limiter and imported modules stay warm between
+    commands. Commands run one at a time, with stdout, stderr and log of command sent to client,
+    clients connecting while command runs are answered with busy fallback.
+    """
+
+    def __init__(self, run_command, socket_path = None, workdir = None):
+        self._run_command = run_command
+        self.workdir = os.path.abspath(workdir or os.getcwd())
+        self.socket_path = socket_path or default_socket_path(self.workdir)
+        self._server = None
+        self._explicit_path = socket_path is not None or bool(os.environ.get('PIPEDRIVE_DAEMON_SOCKET'))
+        self._command_lock = threading.Lock()
+        self.commands = 0
+
+    def serve_request(self, request, wfile):
+        if request.get('stop'):
+            _send(wfile, {"exit": 0})
+            threading.Thread(target=self._shutdown_after_command, daemon=True).start()
+            return
+        if os.path.abspath(request.get('cwd') or '') != self.workdir:
+            _send(wfile, {"fallback": f"daemon serves {self.workdir}"})
+            return
+        # stdout, stderr and log handlers are process wide, so commands can not overlap
+        if not self._command_lock.acquire(blocking=False):
+            _send(wfile, {"fallback": "busy"})
+            return
+        try:
+            try:
+                code = self._run_request(request, wfile)
+                self.commands += 1
+            finally:
+                self._command_lock.release()
+            # sent after lock is released, so next command of the same client is not refused as busy
+            _send(wfile, {"exit": code})
+        except BrokenPipeError:
+            logging.warning("Client disconnected before command finished")
+
+    def _shutdown_after_command(self):
+        with self._command_lock:
+            self._server.shutdown()
+
+    def _run_request(self, request, wfile):
+        """ Run command with output sent to client, returns its exit code
+        """
+        # metrics stored after command cover only this command
+        if 'modules.metrics' in sys.modules:
+            sys.modules['modules.metrics'].Metrics.reset_metrics()
+        out = _ClientStream(wfile, 'out')
+        err = _ClientStream(wfile, 'err')
+        code = 0
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                code = self._run_command(request['argv']) or 0
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            except Exception:
+                logging.exception(f"Command {' '.join(request['argv'][1:2])} failed")
+                code = 1
+        out.flush()
+        err.flush()
+        return code
+
+    def _bind(self):
+        if not self._explicit_path:
+            _make_private_dir(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError(f"Daemon already listens on {self.socket_path}")
+            finally:
+                probe.close()
+        # socket is created accessible only to owner, daemon acts with stored tokens
+        old_umask = os.umask(0o177)
+        try:
+            self._server = _CommandServer(self.socket_path, _CommandHandler)
+        finally:
+            os.umask(old_umask)
+        self._server.command_daemon = self
+
+    def _serve(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            logging.info(f"Daemon stopped after {self.commands} commands")
+
+    def serve_forever(self):
+        self._bind()
+        logging.info(f"Daemon for {self.workdir} listens on {self.socket_path}")
+        self._serve()
+
+    def start(self):
+        """ Serve in background thread, for tests and embedding
+        """
+        self._bind()
+        threading.Thread(target=self._serve, name='pipedrive-daemon', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+
+def stop_daemon(socket_path = None):
+    """ Ask daemon to stop, returns False when none was running
+    """
+    path = socket_path or default_socket_path()
+    if not _owned_socket(path):
+        return False
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(CONNECT_TIMEOUT)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return False
+    with client, client.makefile('rb') as rfile, client.makefile('wb') as wfile:
+        _send(wfile, {"stop": True})
+        rfile.readline()
+    return True
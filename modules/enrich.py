@@ -0,0 +1,96 @@
+import logging
+from collections import OrderedDict
+
+from modules.models import Deal
+from modules.pipedriveapi import PipedriveREST, PipedriveResource
+
+__all__ = ['DealEnricher']
+
+# deal field holding id of related entity -> (resource, key of joined entity in enriched deal)
+DEFAULT_RELATIONS = {
+    'person_id': ('persons', 'person'),
+    'org_id': ('organizations', 'organization'),
+    'owner_id': ('users', 'owner'),
+    'stage_id': ('stages', 'stage'),
+    'pipeline_id': ('pipelines', 'pipeline'),
+}
+DEFAULT_CACHE_SIZE = 10000
+# deals buffered before ids of their entities are fetched together
+DEFAULT_BATCH_SIZE = 1000
+ENTITY_PAGE_LIMIT = 500
+
+
+class DealEnricher:
+    """ Joins persons, organizations, owners, stages and pipelines to stream of deals
+
+    Ids referenced by a batch of deals are collected first, entities missing in cache are
+    fetched with ids filter, MAX_IDS_PER_REQUEST at a time, and kept in LRU bounded by
+    cache_size per resource. Resources without ids filter (users, stages, pipelines) are
+    small, they are listed completely once.
+    """
+
+    def __init__(self, restapi = None, relations = None, cache_size = DEFAULT_CACHE_SIZE,
+            batch_size = DEFAULT_BATCH_SIZE, fields = None):
+        self._relations = dict(relations or DEFAULT_RELATIONS)
+        restapi = restapi or PipedriveREST()
+        self._resources = {name: PipedriveResource(name, restapi) for name, key in self._relations.values()}
+        self._cache_size = cache_size
+        self._batch_size = batch_size
+        # entity fields kept in cache and joined to deals, all by default
+        self._factory = dict
+        if fields:
+            fields = tuple(fields)
+            self._factory = lambda item: {field: item.get(field) for field in fields}
+        self._cache = {name: OrderedDict() for name in self._resources}
+        self._listed = set()
+        self.stats = {"hits": 0, "misses": 0}
+
+    def enrich(self, deals):
+        """ Yield deal dicts with related entities joined under person, organization, owner, stage and pipeline
+        """
+        batch = []
+        for deal in deals:
+            batch.append(deal.to_dict() if isinstance(deal, Deal) else dict(deal))
+            if len(batch) >= self._batch_size:
+                yield from self._enrich_batch(batch)
+                batch = []
+        if batch:
+            yield from self._enrich_batch(batch)
+
+    def _enrich_batch(self, batch):
+        for field, (name, key) in self._relations.items():
+            entities = self._entities(name, {deal.get(field) for deal in batch} - {None})
+            for deal in batch:
+                deal[key] = entities.get(deal.get(field))
+        return batch
+
+    def _entities(self, name, ids):
+        """ Mapping of id to entity for ids of one batch, from cache or requested together
+        """
+        cache = self._cache[name]
+        resource = self._resources[name]
+        if not resource.ids_filter:
+            if name not in self._listed:
+                for entity in resource.iter_items(limit=ENTITY_PAGE_LIMIT, factory=self._factory):
+                    cache[entity['id']] = entity
+                self._listed.add(name)
+                logging.debug(f"Listed {len(cache)} {name}")
+            return cache
+        entities = {}
+        missing = []
+        for entity_id in ids:
+            if entity_id in cache:
+                cache.move_to_end(entity_id)
+                entities[entity_id] = cache[entity_id]
+            else:
+                missing.append(entity_id)
+        self.stats["hits"] += len(entities)
+        if missing:
+            self.stats["misses"] += len(missing)
+            found = {entity['id']: entity for entity in resource.iter_by_ids(missing, self._factory)}
+            # ids not found are cached too, so they are not asked again
+            for entity_id in missing:
+                entities[entity_id] = cache[entity_id] = found.get(entity_id)
+                if len(cache) > self._cache_size:
+                    cache.popitem(last=False)
+        return entities
@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import logging
+import datetime
+
+from modules.pipedriveapi import DEAL_STATUSES
+
+__all__ = ['DealExport']
+
+DEFAULT_EXPORT_FILE = 'deals_export.sqlite'
+EXPORT_PAGE_LIMIT = 500
+COMMIT_EVERY = 1000
+
+
+class DealExport:
+    """ Local SQLite snapshot of deals refreshed incrementally with updated_since
+
+    Watermark of every account is the latest update_time seen by finished run, next run asks
+    only for deals updated since then. Deals are upserted by id, so overlap of runs and
+    interrupted runs repeated from old watermark never duplicate rows.
+    """
+
+    def __init__(self, deal_api, file_name = DEFAULT_EXPORT_FILE, account = 'default'):
+        self._deal_api = deal_api
+        self._file_name = file_name
+        self._account = account
+        self._db = sqlite3.connect(file_name)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS deals (
+            account TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            update_time TEXT,
+            status TEXT,
+            data TEXT NOT NULL,
+            PRIMARY KEY (account, id))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS export_watermarks (
+            account TEXT PRIMARY KEY,
+            updated_since TEXT,
+            exported_at TEXT NOT NULL)""")
+        self._db.commit()
+
+    @property
+    def watermark(self):
+        row = self._db.execute("SELECT updated_since FROM export_watermarks WHERE account = ?", (self._account,)).fetchone()
+        return row[0] if row else None
+
+    def run(self, full = False):
+        """ Merge deals changed since watermark into store, returns counts of fetched, new and changed deals
+        """
+        since = None if full else self.watermark
+        # deleted deals are requested too, so deletions reach the snapshot
+        params = self._deal_api.query(status=DEAL_STATUSES, updated_since=since, sort_by='update_time', sort_direction='asc')
+        logging.info(f"Exporting deals of {self._account} " + (f"updated since {since}" if since else "from scratch"))
+        counts = {"fetched": 0, "new": 0, "changed": 0}
+        latest = since
+        for deal in self._deal_api.iter_deals(params, limit=EXPORT_PAGE_LIMIT):
+            counts["fetched"] += 1
+            update_time = deal.get('update_time')
+            row = self._db.execute("SELECT update_time FROM deals WHERE account = ? AND id = ?", (self._account, deal['id'])).fetchone()
+            if row is None:
+                counts["new"] += 1
+            elif row[0] != update_time:
+                counts["changed"] += 1
+            self._db.execute("INSERT OR REPLACE INTO deals (account, id, update_time, status, data) VALUES (?, ?, ?, ?, ?)",
+                (self._account, deal['id'], update_time, deal.get('status'), json.dumps(deal)))
+            if update_time and (latest is None or update_time > latest):
+                latest = update_time
+            if counts["fetched"] % COMMIT_EVERY == 0:
+                self._db.commit()
+        # watermark moves only after complete run, failed run is repeated from previous one
+        exported_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self._db.execute("INSERT OR REPLACE INTO export_watermarks (account, updated_since, exported_at) VALUES (?, ?, ?)",
+            (self._account, latest, exported_at))
+        self._db.commit()
+        logging.info(f"Export finished: {counts['fetched']} fetched, {counts['new']} new, {counts['changed']} changed, watermark {latest}")
+        return counts
+
+    def deals(self, include_deleted = False):
+        """ Yield stored deals of account ordered by id
+        """
+        query = "SELECT data FROM deals WHERE account = ?" + ("" if include_deleted else " AND status IS NOT 'deleted'") + " ORDER BY id"
+        for (data,) in self._db.execute(query, (self._account,)):
+            yield json.loads(data)
+
+    def count(self):
+        return self._db.execute("SELECT count(*) FROM deals WHERE account = ?", (self._account,)).fetchone()[0]
+
+    def compact(self, purge_deleted = False):
+        """ Optionally drop deleted deals and rewrite store file without free pages
+        """
+        purged = 0
+        if purge_deleted:
+            purged = self._db.execute("DELETE FROM deals WHERE account = ? AND status = 'deleted'", (self._account,)).rowcount
+            self._db.commit()
+        self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self._db.execute("VACUUM")
+        logging.info(f"Export store {self._file_name} compacted, {purged} deleted deals purged")
+        return purged
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
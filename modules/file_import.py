@@ -6,39 +6,180 @@ import sys
 import datetime
 import os
 import csv
-import argparse
+import functools
 from argparse import RawTextHelpFormatter
 
 from modules.pipedriveapi import PipedriveREST, PipedriveCLI, PipedriveDeals
 from modules.keyvault import KeyVaultStorage
+from modules.bulk_load import BulkLoader, DEFAULT_WORKERS
+from modules.sync import DealSync, DEFAULT_SYNC_KEY, DEFAULT_SYNC_FIELDS, CREATED, UPDATED, UNCHANGED, DUPLICATE, FAILED
+from modules.journal import LoadJournal, file_checksum
+from modules.ingest import CsvSource, CursorSource, DealIngest
+from modules.shard import ShardSource, parse_shard
 __all__ = ['FileLoad']
 
+# failed rows kept with their errors for report, the rest is only counted
+MAX_KEPT_FAILURES = 1000
+
 class FileLoad:
     def __init__(self):
         self._file_name = 'data.csv'
-        self._deal_api = PipedriveDeals()
-    
+        # (title, error) of rows Pipedrive did not accept, for reports of parallel runs
+        self.failures = []
+
+    @functools.cached_property
+    def _deal_api(self):
+        return PipedriveDeals()
+
     def load_file(self):
         """ Load data after transformation to pipedrive backend
         """
         example = '''Example:
         pipedrive.py load_file path_to_csv_extracted_after_transformation
+        pipedrive.py load_file --sync --sync-key title path_to_csv_extracted_after_transformation
+        pipedrive.py load_file --journal load_journal.sqlite path_to_csv_extracted_after_transformation
+        pipedrive.py load_file --sync --shard 0/4 --journal shard_0.sqlite path_to_csv_extracted_after_transformation
                  '''
         # command arguments
         parser = argparse.ArgumentParser(description="Load data to Pipedrive", epilog=example, formatter_class=RawTextHelpFormatter)
         parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+        parser.add_argument('-w', '--workers', help='Number of parallel load requests', type=int, default=DEFAULT_WORKERS)
+        parser.add_argument('-q', '--queue-size', help='Max rows read ahead of finished requests, 4*workers by default', type=int, default=None)
+        parser.add_argument('-s', '--sync', help='Create only new deals, update changed and skip unchanged ones', action='store_true', default=False)
+        parser.add_argument('-k', '--sync-key', help='Deal field identifying order in sync mode, sync_key from config or title by default', default=None)
+        parser.add_argument('-j', '--journal', help='SQLite journal of published rows, rerun of same file skips them', default=None)
+        parser.add_argument('--shard', help='Load only rows of shard index/count chosen by hash of sync key, e.g. 0/4', default=None)
         parser.add_argument('filename', help='path to csv file to load to Pipedrive')
         args = parser.parse_args(sys.argv[2:])
 
         self._file_name = args.filename
 
-        with open(self._file_name) as file_in:
-            for line in file_in:
-                title, status, value = line.split(",")
-                code, text = self._deal_api.add_deal({  "title":title, "status":status, "value":value })
-                logging.debug(f"Loading request result code {code} Text {text}")
-                if code == 200:
-                    logging.info(f'{title} order is loaded to Pipedrive')
-                else:
-                    logging.error(f'Load of {title} failed with {text}')
+        journal = None
+        if args.journal:
+            # rows of one shard are numbered within the shard, so journal of each shard is separate input
+            checksum = file_checksum(self._file_name) + (f"/{args.shard}" if args.shard else '')
+            journal = LoadJournal(args.journal).start(self._file_name, checksum=checksum)
+        try:
+            if args.shard:
+                shard, shards = parse_shard(args.shard)
+                key = args.sync_key or (KeyVaultStorage().get_config() or {}).get('sync_key', DEFAULT_SYNC_KEY)
+                records = self.read_source(ShardSource(CsvSource(self._file_name), shard, shards, key))
+            else:
+                records = self.read_file(self._file_name)
+            if args.sync:
+                self.sync_records(records, workers=args.workers, queue_size=args.queue_size, key=args.sync_key, journal=journal)
+            else:
+                loaded, failed = self.load_records(records, workers=args.workers, queue_size=args.queue_size, journal=journal)
+                logging.info(f'Loaded {loaded} orders, {failed} failed')
+        finally:
+            if journal:
+                journal.close()
+
+    def read_source(self, source):
+        """ Typed deal records of any source yielding (row number, row dict), rows failing deal schema are logged and dropped
+        """
+        return DealIngest().records(source)
+
+    def read_file(self, file_name):
+        return self.read_source(CsvSource(file_name))
+
+    def read_records(self, file_in):
+        """ Same as read_file for already opened file, it has to be opened with newline=''
+        """
+        return self.read_source(CsvSource(file_in=file_in))
+
+    def read_cursor(self, cursor, query = None, params = None, batch_size = None):
+        """ Typed deal records streamed from DB-API cursor, columns are matched by name
+        """
+        if batch_size is None:
+            return self.read_source(CursorSource(cursor, query, params))
+        return self.read_source(CursorSource(cursor, query, params, batch_size=batch_size))
+
+    def _pending_records(self, records, journal):
+        # rows acknowledged in journal by earlier run are not sent again
+        skipped = 0
+        for offset, record in enumerate(records):
+            if journal is not None and journal.is_acknowledged(offset):
+                skipped += 1
+                continue
+            if skipped:
+                logging.info(f'Skipped {skipped} rows already published according to journal')
+                skipped = 0
+            yield offset, record
+        if skipped:
+            logging.info(f'Skipped {skipped} rows already published according to journal')
+
+    def _failed(self, title, error):
+        if len(self.failures) < MAX_KEPT_FAILURES:
+            self.failures.append((title, error))
+
+    @staticmethod
+    def _deal_id(text):
+        try:
+            return json.loads(text)['data']['id']
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def load_records(self, records, workers = DEFAULT_WORKERS, queue_size = None, journal = None):
+        """ Load deal records with bounded pool of workers sharing one client, returns (loaded, failed) counts
+
+        With journal rows are identified by their offset in records, published ones are acknowledged
+        in it and skipped when same input is loaded again.
+        """
+        loaded = 0
+        failed = 0
+        loader = BulkLoader(lambda item: self._deal_api.add_deal(item[1]), workers=workers, queue_size=queue_size)
+        for (offset, record), result in loader.run(self._pending_records(records, journal)):
+            title = record['title']
+            if isinstance(result, Exception):
+                failed += 1
+                self._failed(title, repr(result))
+                logging.error(f'Load of {title} failed with {result!r}')
+                continue
+            code, text = result
+            logging.debug(f"Loading request result code {code} Text {text}")
+            if code == 200:
+                loaded += 1
+                if journal is not None:
+                    journal.acknowledge(offset, self._deal_id(text))
+                logging.info(f'{title} order is loaded to Pipedrive')
+            else:
+                failed += 1
+                self._failed(title, text)
+                logging.error(f'Load of {title} failed with {text}')
+        return loaded, failed
+
+    def sync_records(self, records, workers = DEFAULT_WORKERS, queue_size = None, key = None, journal = None):
+        """ Sync deal records against index of existing deals, returns counts of created, updated, unchanged, duplicate and failed rows
+        """
+        config = KeyVaultStorage().get_config() or {}
+        key = key or config.get('sync_key', DEFAULT_SYNC_KEY)
+        fields = config.get('sync_fields', DEFAULT_SYNC_FIELDS)
+        sync = DealSync(self._deal_api, key=key, fields=fields).build_index()
+        counts = {CREATED: 0, UPDATED: 0, UNCHANGED: 0, DUPLICATE: 0, FAILED: 0}
+        loader = BulkLoader(lambda item: sync.sync_record(item[1]), workers=workers, queue_size=queue_size)
+        for (offset, record), result in loader.run(self._pending_records(records, journal)):
+            title = record['title']
+            if isinstance(result, Exception):
+                counts[FAILED] += 1
+                self._failed(title, repr(result))
+                logging.error(f'Sync of {title} failed with {result!r}')
+                continue
+            action, code, text = result
+            counts[action] += 1
+            if action == FAILED:
+                self._failed(title, text)
+                logging.error(f'Sync of {title} failed with {text}')
+            elif action == DUPLICATE:
+                logging.warning(f'{title} has {key} already seen in this run, skipped')
+                # skipped row is done as well, otherwise journal watermark stops at first repeated key
+                if journal is not None:
+                    journal.acknowledge(offset, None)
+            else:
+                if journal is not None:
+                    existing = sync.index.get(sync.index.key_of(record))
+                    journal.acknowledge(offset, existing[0] if existing else None)
+                logging.debug(f'{title} order is {action}')
+        logging.info("Sync finished: " + ", ".join(f"{action} {count}" for action, count in counts.items()))
+        return counts
 
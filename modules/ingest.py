@@ -0,0 +1,167 @@
+import csv
+import logging
+import itertools
+
+__all__ = ['CsvSource','CursorSource','DealSchema','DealIngest']
+
+# columns of pipedrive_orders extract, in file order
+DEAL_COLUMNS = ('title', 'status', 'value')
+DEAL_STATUSES = ('open', 'won', 'lost', 'deleted')
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 1000
+# rows fetched from database per round trip
+DEFAULT_FETCH_SIZE = 5000
+# rejected rows kept with their errors for report, the rest is only counted
+MAX_KEPT_REJECTS = 1000
+
+
+class CsvSource:
+    """ Streams rows of CSV file as dicts of raw strings, file is read through large buffer
+
+    Rows are (line number, row dict) pairs, line number counts physical rows from 1.
+    """
+
+    def __init__(self, file_name = None, file_in = None, columns = DEAL_COLUMNS, dialect = 'excel', header = False, buffer_size = DEFAULT_BUFFER_SIZE):
+        self._file_name = file_name
+        self._file_in = file_in
+        self._columns = tuple(columns)
+        self._dialect = dialect
+        self._header = header
+        self._buffer_size = buffer_size
+
+    def _rows(self, file_in):
+        reader = csv.reader(file_in, dialect=self._dialect)
+        columns = self._columns
+        if self._header:
+            columns = tuple(column.strip() for column in next(reader, ()))
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(columns):
+                # wrong number of fields is reported by schema as missing or unexpected values
+                yield reader.line_num, {"_fields": row}
+                continue
+            yield reader.line_num, dict(zip(columns, row))
+
+    def __iter__(self):
+        if self._file_in is not None:
+            yield from self._rows(self._file_in)
+            return
+        with open(self._file_name, newline='', buffering=self._buffer_size) as file_in:
+            yield from self._rows(file_in)
+
+
+class CursorSource:
+    """ Streams rows of DB-API cursor as dicts, rows are fetched with fetchmany in batches
+
+    Rows are (row number, row dict) pairs, row number counts fetched rows from 1. Query is
+    executed when given, otherwise cursor has to be executed already. With server side
+    cursor (e.g. psycopg2 named cursor) memory stays bounded by one batch.
+    """
+
+    def __init__(self, cursor, query = None, params = None, columns = None, batch_size = DEFAULT_FETCH_SIZE):
+        self._cursor = cursor
+        self._query = query
+        self._params = params
+        self._columns = tuple(columns) if columns else None
+        self._batch_size = batch_size
+
+    def __iter__(self):
+        if self._query is not None:
+            if self._params is None:
+                self._cursor.execute(self._query)
+            else:
+                self._cursor.execute(self._query, self._params)
+        columns = self._columns
+        row_number = 0
+        while True:
+            rows = self._cursor.fetchmany(self._batch_size)
+            if not rows:
+                break
+            if columns is None:
+                # description of named cursors is known only after first fetch
+                columns = tuple(column[0] for column in self._cursor.description)
+            for row in rows:
+                row_number += 1
+                if len(row) != len(columns):
+                    yield row_number, {"_fields": list(row)}
+                    continue
+                yield row_number, dict(zip(columns, row))
+
+
+class DealSchema:
+    """ Declared deal fields, coerces raw values to types sent to API and reports what is invalid
+    """
+
+    def __init__(self, statuses = DEAL_STATUSES):
+        self._statuses = tuple(statuses)
+
+    def validate(self, row):
+        """ Return (record, errors), record is None when row is rejected
+        """
+        if "_fields" in row:
+            return None, [f"expected {len(DEAL_COLUMNS)} fields, got {len(row['_fields'])}"]
+        errors = []
+        # csv rows hold strings, database rows typed values
+        title = str(row.get('title') or '').strip()
+        if not title:
+            errors.append("title is empty")
+        status = str(row.get('status') or '').strip().lower()
+        if status not in self._statuses:
+            errors.append(f"status '{status}' is not one of {', '.join(self._statuses)}")
+        value = self._coerce_number(row.get('value'), errors)
+        if errors:
+            return None, errors
+        return {"title": title, "status": status, "value": value}, errors
+
+    @staticmethod
+    def _coerce_number(raw, errors):
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if raw is None or raw == '':
+            return None
+        try:
+            number = float(raw)
+        except (TypeError, ValueError):
+            errors.append(f"value '{raw}' is not a number")
+            return None
+        return int(number) if number.is_integer() else number
+
+
+class DealIngest:
+    """ Validates rows of source in batches before any of them is handed to loader
+
+    Valid records are yielded with bounded memory of one batch, rejected rows are
+    logged and counted and never reach the API.
+    """
+
+    def __init__(self, schema = None, batch_size = DEFAULT_BATCH_SIZE):
+        self._schema = schema or DealSchema()
+        self._batch_size = batch_size
+        self.accepted = 0
+        self.rejected = 0
+        self.rejects = []
+
+    def records(self, source):
+        rows = iter(source)
+        while True:
+            batch = list(itertools.islice(rows, self._batch_size))
+            if not batch:
+                break
+            valid = []
+            for line_number, row in batch:
+                record, errors = self._schema.validate(row)
+                if record is None:
+                    self._reject(line_number, row, errors)
+                else:
+                    valid.append(record)
+            self.accepted += len(valid)
+            yield from valid
+        if self.rejected:
+            logging.warning(f"{self.rejected} rows rejected by deal schema, {self.accepted} accepted")
+
+    def _reject(self, line_number, row, errors):
+        self.rejected += 1
+        if len(self.rejects) < MAX_KEPT_REJECTS:
+            self.rejects.append((line_number, row, errors))
+        logging.error(f"Row {line_number} rejected: {'; '.join(errors)}")
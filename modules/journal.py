@@ -0,0 +1,102 @@
+import sqlite3
+import hashlib
+import logging
+import datetime
+
+__all__ = ['LoadJournal']
+
+DEFAULT_JOURNAL_FILE = 'load_journal.sqlite'
+
+
+def file_checksum(file_name, chunk_size = 1024 * 1024):
+    """ sha256 of file content, identifies input of load across reruns
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as file_in:
+        for chunk in iter(lambda: file_in.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class LoadJournal:
+    """ Append-only SQLite journal of rows acknowledged by Pipedrive
+
+    Rows are identified by checksum of input and row offset. Watermark keeps offset of
+    first unacknowledged row, so rerun skips published prefix of file with one comparison
+    per row and looks up only rows after it.
+    """
+
+    def __init__(self, file_name = DEFAULT_JOURNAL_FILE):
+        self._file_name = file_name
+        self._db = sqlite3.connect(file_name)
+        # WAL keeps every commit durable against process crash without fsync per row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS acked_rows (
+            checksum TEXT NOT NULL,
+            row_offset INTEGER NOT NULL,
+            deal_id INTEGER,
+            acked_at TEXT NOT NULL,
+            PRIMARY KEY (checksum, row_offset))""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS watermarks (
+            checksum TEXT PRIMARY KEY,
+            source TEXT,
+            next_offset INTEGER NOT NULL)""")
+        self._db.commit()
+        self._checksum = None
+        self._watermark = 0
+
+    def start(self, source, checksum = None):
+        """ Select input for following calls, checksum is computed from source file when not given
+        """
+        self._checksum = checksum or file_checksum(source)
+        row = self._db.execute("SELECT next_offset FROM watermarks WHERE checksum = ?", (self._checksum,)).fetchone()
+        if row is None:
+            self._db.execute("INSERT INTO watermarks (checksum, source, next_offset) VALUES (?, ?, 0)", (self._checksum, str(source)))
+            self._db.commit()
+            self._watermark = 0
+        else:
+            self._watermark = row[0]
+            logging.info(f"Resuming load of {source} from row {self._watermark}")
+        return self
+
+    @property
+    def watermark(self):
+        return self._watermark
+
+    def is_acknowledged(self, offset):
+        if offset < self._watermark:
+            return True
+        row = self._db.execute("SELECT 1 FROM acked_rows WHERE checksum = ? AND row_offset = ?", (self._checksum, offset)).fetchone()
+        return row is not None
+
+    def deal_id(self, offset):
+        row = self._db.execute("SELECT deal_id FROM acked_rows WHERE checksum = ? AND row_offset = ?", (self._checksum, offset)).fetchone()
+        return row[0] if row else None
+
+    def acknowledge(self, offset, deal_id = None):
+        """ Record row as published, committed before returning
+        """
+        acked_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self._db.execute("INSERT OR REPLACE INTO acked_rows (checksum, row_offset, deal_id, acked_at) VALUES (?, ?, ?, ?)",
+            (self._checksum, offset, deal_id, acked_at))
+        if offset == self._watermark:
+            self._advance_watermark()
+        self._db.commit()
+
+    def _advance_watermark(self):
+        # rows acknowledged in earlier runs after failed one can extend watermark further
+        next_offset = self._watermark + 1
+        while self._db.execute("SELECT 1 FROM acked_rows WHERE checksum = ? AND row_offset = ?", (self._checksum, next_offset)).fetchone():
+            next_offset += 1
+        self._watermark = next_offset
+        self._db.execute("UPDATE watermarks SET next_offset = ? WHERE checksum = ?", (next_offset, self._checksum))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
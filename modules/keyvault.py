@@ -7,19 +7,102 @@ from argparse import RawTextHelpFormatter
 import getpass
 import json
 import sys
+import threading
+import types
+import time
+import tempfile
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 #from modules.pipedriveapi import PipedriveREST
 
 __all__ = ['KeyVaultStorage']
 
+# process wide cache of parsed json files: absolute file name -> (file signature, parsed content)
+# cached content is shared by all clients, so it is stored as read-only mapping
+_file_cache = {}
+_file_cache_lock = threading.Lock()
+_file_cache_stats = {"reads": 0, "hits": 0}
+
+
+def _file_signature(file_name):
+    stat = os.stat(file_name)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _load_json_cached(file_name):
+    """ Return parsed json file, file is read again only when its inode, mtime or size changes
+    """
+    file_name = os.path.abspath(file_name)
+    signature = _file_signature(file_name)
+    with _file_cache_lock:
+        cached = _file_cache.get(file_name)
+        if cached is not None and cached[0] == signature:
+            _file_cache_stats["hits"] += 1
+            return cached[1]
+        with open(file_name, 'r') as json_file:
+            output = types.MappingProxyType(json.load(json_file))
+        _file_cache_stats["reads"] += 1
+        _file_cache[file_name] = (signature, output)
+    return output
+
+
+def _invalidate_cached(file_name):
+    with _file_cache_lock:
+        _file_cache.pop(os.path.abspath(file_name), None)
+
+
+def _write_json_atomic(file_name, json_dict):
+    """ Replace file in one step, readers see either old or new content, never partial one
+    """
+    directory = os.path.dirname(os.path.abspath(file_name))
+    fd, temp_name = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_name) + '.')
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(json_dict, temp_file, sort_keys=True, indent=4)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.unlink(temp_name)
+        raise
+
 
 class KeyVaultStorage:
 
     def __init__(self):
         self._token_file_name = 'token.json'
         self._config_file_name = 'config.json'
-        self._token = self._get_token_data()
-        self._config = self._get_config_data()
+
+    @property
+    def _token(self):
+        return self._get_token_data()
+
+    @property
+    def _config(self):
+        return self._get_config_data()
+
+    @staticmethod
+    def cache_stats():
+        """ Return counters of credential file reads and cache hits in this process
+        """
+        with _file_cache_lock:
+            return dict(_file_cache_stats)
+
+    def invalidate(self):
+        """ Drop cached token and config, next access reads files again
+        """
+        _invalidate_cached(self._token_file_name)
+        _invalidate_cached(self._config_file_name)
+
+    def get_config(self):
+        """ Return copy of config, cached content itself is read-only
+        """
+        return dict(self._config)
 
     def get_access_token(self):
         return self._get_token_param('access_token')
@@ -57,24 +140,62 @@ class KeyVaultStorage:
         return output
     
     def _set_config_param(self, param_name, param_value):
-        self._config[param_name] = param_value
-        self.update_config(self._config)
+        config = dict(self._config)
+        config[param_name] = param_value
+        self.update_config(config)
 
     def _set_token_param(self, param_name, param_value):
-        self._token[param_name] = param_value
-        self.update_token(self._token)
+        token = dict(self._token)
+        token[param_name] = param_value
+        self.update_token(token)
 
     def update_token(self, token_json_dict):
-        with open(self._token_file_name, 'w') as token_file:
-            json.dump(token_json_dict, token_file, sort_keys=True, indent=4)
-            token_file.close()
-        self._token = self._get_token_data()
+        token_json_dict = dict(token_json_dict)
+        # absolute expiry time is needed to refresh token before it runs out
+        if 'expires_in' in token_json_dict and 'expires_at' not in token_json_dict:
+            token_json_dict['expires_at'] = time.time() + float(token_json_dict['expires_in'])
+        _write_json_atomic(self._token_file_name, token_json_dict)
+        _invalidate_cached(self._token_file_name)
 
     def update_config(self, config_json_dict):
-        with open(self._config_file_name, 'w') as config_file:
-            json.dump(config_json_dict, config_file, sort_keys=True, indent=4)
-            config_file.close()
-        self._config = self._get_config_data()
+        _write_json_atomic(self._config_file_name, config_json_dict)
+        _invalidate_cached(self._config_file_name)
+
+    def get_token_expiry(self):
+        """ Return (expires_at, expires_in) of stored token, expires_at falls back to token file mtime
+        """
+        token = self._token
+        if not token or not token.get('expires_in'):
+            return None, None
+        expires_in = float(token['expires_in'])
+        expires_at = token.get('expires_at')
+        if expires_at is None:
+            try:
+                expires_at = os.stat(self._token_file_name).st_mtime + expires_in
+            except FileNotFoundError:
+                return None, None
+        return float(expires_at), expires_in
+
+    def acquire_token_lock(self):
+        """ Take exclusive lock of token file shared by all threads and processes, returns handle for release_token_lock
+        """
+        lock_file = open(self._token_file_name + '.lock', 'a+')
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        return lock_file
+
+    def release_token_lock(self, lock_file):
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        lock_file.close()
+
+    @contextlib.contextmanager
+    def token_lock(self):
+        lock_file = self.acquire_token_lock()
+        try:
+            yield
+        finally:
+            self.release_token_lock(lock_file)
 
  
     def show_auth(self):
@@ -156,8 +277,7 @@ class KeyVaultStorage:
     def _get_token_data(self):
         output = None
         try:
-            with open(self._token_file_name, 'r') as token_file:
-                output = json.load(token_file)
+            output = _load_json_cached(self._token_file_name)
         except FileNotFoundError:
             logging.error(f"Token File {self._token_file_name} does not exist.")
             pass
@@ -166,8 +286,7 @@ class KeyVaultStorage:
     def _get_config_data(self):
         output = None
         try:
-            with open(self._config_file_name, 'r') as config_file:
-                output = json.load(config_file)
+            output = _load_json_cached(self._config_file_name)
         except FileNotFoundError:
             logging.error(f"Token File {self._config_file_name} does not exist.")
             pass
@@ -0,0 +1,109 @@
+import logging
+import threading
+
+from modules.models import Deal
+from modules.pipedriveapi import DEAL_STATUSES
+
+__all__ = ['DealLookupIndex']
+
+DEFAULT_LOOKUP_KEYS = ('title',)
+LOOKUP_PAGE_LIMIT = 500
+
+
+class DealLookupIndex:
+    """ In-memory hash index of all deals, answers lookups by id, title or custom field keys without requests
+
+    Deals are loaded once as compact Deal records, refresh() merges only deals updated since
+    latest update_time seen, deleted deals are dropped from index. Keys are matched by exact
+    value, one value can point to several deals.
+    """
+
+    def __init__(self, deal_api, keys = DEFAULT_LOOKUP_KEYS):
+        self._deal_api = deal_api
+        # deals are always found by id, other keys get own hash table
+        self.keys = tuple(key for key in keys if key != 'id')
+        # custom field keys have to be requested, other keys are Deal fields
+        self._custom_fields = [key for key in self.keys if key not in Deal.__slots__]
+        self._deals = {}
+        self._by_key = {key: {} for key in self.keys}
+        self._lock = threading.Lock()
+        self.updated_since = None
+
+    def __len__(self):
+        return len(self._deals)
+
+    def __contains__(self, deal_id):
+        return deal_id in self._deals
+
+    def load(self):
+        """ Index all deals, replaces current content
+        """
+        with self._lock:
+            self._deals = {}
+            self._by_key = {key: {} for key in self.keys}
+            self.updated_since = None
+        count = self._merge(self._deal_api.query(custom_fields=self._custom_fields or None))
+        logging.info(f"Indexed {count} deals by {', '.join(self.keys)}")
+        return self
+
+    def refresh(self):
+        """ Merge deals updated since last load or refresh, returns number of merged deals
+        """
+        if self.updated_since is None:
+            return len(self.load())
+        # boundary second is requested again, upsert makes repeated deals harmless
+        params = self._deal_api.query(status=DEAL_STATUSES, updated_since=self.updated_since, sort_by='update_time',
+            sort_direction='asc', custom_fields=self._custom_fields or None)
+        count = self._merge(params)
+        logging.debug(f"Merged {count} deals updated since {params['updated_since']}")
+        return count
+
+    def _merge(self, params):
+        count = 0
+        for deal in self._deal_api.iter_deal_models(params, limit=LOOKUP_PAGE_LIMIT):
+            with self._lock:
+                self._drop(deal.id)
+                if deal.status != 'deleted':
+                    self._add(deal)
+                if deal.update_time and (self.updated_since is None or deal.update_time > self.updated_since):
+                    self.updated_since = deal.update_time
+            count += 1
+        return count
+
+    def _add(self, deal):
+        self._deals[deal.id] = deal
+        for key, index in self._by_key.items():
+            value = deal.get(key)
+            if value is not None:
+                index.setdefault(value, []).append(deal.id)
+
+    def _drop(self, deal_id):
+        deal = self._deals.pop(deal_id, None)
+        if deal is None:
+            return
+        for key, index in self._by_key.items():
+            ids = index.get(deal.get(key))
+            if ids and deal_id in ids:
+                ids.remove(deal_id)
+                if not ids:
+                    del index[deal.get(key)]
+
+    def get(self, deal_id):
+        """ Deal with id or None
+        """
+        return self._deals.get(deal_id)
+
+    def find(self, key, value):
+        """ List of deals having value in key, key has to be one of indexed keys
+        """
+        if key == 'id':
+            deal = self._deals.get(value)
+            return [deal] if deal is not None else []
+        deals = self._deals
+        return [deals[deal_id] for deal_id in self._by_key[key].get(value, ())]
+
+    def find_one(self, key, value):
+        """ First deal having value in key or None
+        """
+        found = self.find(key, value)
+        return found[0] if found else None
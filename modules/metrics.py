@@ -0,0 +1,180 @@
+import re
+import json
+import bisect
+import threading
+import urllib.parse
+
+__all__ = ['Metrics']
+
+# upper bounds of latency histogram buckets in seconds, last bucket is +Inf
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# ids in paths are folded, so deals/1 and deals/2 are one endpoint
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_name(method, uri):
+    """ Metrics label of request, e.g. 'PATCH /api/v2/deals/{id}'
+    """
+    path = urllib.parse.urlsplit(uri).path or '/'
+    return f"{method} {_ID_SEGMENT.sub('/{id}', path)}"
+
+
+def body_size(data):
+    """ Bytes of request body given as str, bytes or form dict
+    """
+    if not data:
+        return 0
+    if isinstance(data, dict):
+        data = urllib.parse.urlencode(data)
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return len(data)
+
+
+def status_class(code):
+    return f"{int(code) // 100}xx" if code is not None else 'error'
+
+
+class _EndpointStats:
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = {}
+        self.retries = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def quantile(self, q):
+        """ Upper bound of bucket holding q-th quantile, precise enough to compare runs
+        """
+        if not self.requests:
+            return 0.0
+        rank = q * self.requests
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + (float('inf'),), self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def as_dict(self):
+        return {"requests": self.requests, "statuses": dict(self.statuses), "retries": dict(self.retries),
+            "bytes_sent": self.bytes_sent, "bytes_received": self.bytes_received,
+            "latency_sum": round(self.latency_sum, 6), "latency_buckets": list(self.buckets),
+            "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """ Process wide counters and latency histograms of API requests, grouped by endpoint
+
+    Every attempt sent by REST clients is recorded, including retried and throttled ones,
+    so requests of an endpoint are never less than answers seen by caller.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._refreshes = {"ok": 0, "failed": 0}
+
+    @classmethod
+    def get_metrics(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def reset_metrics(cls):
+        with cls._instance_lock:
+            cls._instance = None
+
+    def _endpoint(self, endpoint):
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = _EndpointStats()
+        return stats
+
+    def record_request(self, endpoint, code, seconds, bytes_sent = 0, bytes_received = 0):
+        """ Record one attempt, code is None when no answer was received
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.requests += 1
+            key = status_class(code)
+            stats.statuses[key] = stats.statuses.get(key, 0) + 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency_sum += seconds
+            stats.buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def record_retry(self, endpoint, reason):
+        """ Record attempt sent again, reason is throttled, status or exception
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats.retries[reason] = stats.retries.get(reason, 0) + 1
+
+    def record_refresh(self, ok):
+        with self._lock:
+            self._refreshes["ok" if ok else "failed"] += 1
+
+    def snapshot(self):
+        """ Copy of all counters as plain dict
+        """
+        with self._lock:
+            return {"endpoints": {endpoint: stats.as_dict() for endpoint, stats in sorted(self._endpoints.items())},
+                "token_refreshes": dict(self._refreshes)}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus(self):
+        """ Counters and histograms in Prometheus text exposition format
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE pipedrive_requests_total counter"]
+        for endpoint, stats in snapshot["endpoints"].items():
+            for status, count in sorted(stats["statuses"].items()):
+                lines.append(f'pipedrive_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+        lines.append("# TYPE pipedrive_retries_total counter")
+        for endpoint, stats in snapshot["endpoints"].items():
+            for reason, count in sorted(stats["retries"].items()):
+                lines.append(f'pipedrive_retries_total{{endpoint="{endpoint}",reason="{reason}"}} {count}')
+        lines.append("# TYPE pipedrive_bytes_total counter")
+        for endpoint, stats in snapshot["endpoints"].items():
+            lines.append(f'pipedrive_bytes_total{{endpoint="{endpoint}",direction="sent"}} {stats["bytes_sent"]}')
+            lines.append(f'pipedrive_bytes_total{{endpoint="{endpoint}",direction="received"}} {stats["bytes_received"]}')
+        lines.append("# TYPE pipedrive_token_refreshes_total counter")
+        for result, count in snapshot["token_refreshes"].items():
+            lines.append(f'pipedrive_token_refreshes_total{{result="{result}"}} {count}')
+        lines.append("# TYPE pipedrive_request_duration_seconds histogram")
+        for endpoint, stats in snapshot["endpoints"].items():
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats["latency_buckets"]):
+                cumulative += count
+                lines.append(f'pipedrive_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}')
+            lines.append(f'pipedrive_request_duration_seconds_sum{{endpoint="{endpoint}"}} {stats["latency_sum"]}')
+            lines.append(f'pipedrive_request_duration_seconds_count{{endpoint="{endpoint}"}} {stats["requests"]}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """ One human readable line per endpoint, for logs
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for endpoint, stats in snapshot["endpoints"].items():
+            statuses = " ".join(f"{status}={count}" for status, count in sorted(stats["statuses"].items()))
+            retries = sum(stats["retries"].values())
+            average = stats["latency_sum"] / stats["requests"] if stats["requests"] else 0.0
+            lines.append(f"{endpoint}: {stats['requests']} requests ({statuses}), {retries} retries, "
+                f"avg {average * 1000:.1f}ms p50<={stats['p50'] * 1000:.0f}ms p99<={stats['p99'] * 1000:.0f}ms, "
+                f"{stats['bytes_sent']}B sent {stats['bytes_received']}B received")
+        refreshes = snapshot["token_refreshes"]
+        lines.append(f"token refreshes: {refreshes['ok']} ok, {refreshes['failed']} failed")
+        return lines
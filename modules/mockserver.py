@@ -0,0 +1,395 @@
+import json
+import time
+import base64
+import hashlib
+import random
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+__all__ = ['MockPipedriveServer']
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send small responses right away, otherwise delayed ACK dominates local latency
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.mock._count('connections')
+
+    def log_message(self, format, *args):
+        logging.debug("Mock server: " + format % args)
+
+    def _send_json(self, code, body, headers = None):
+        # 304 answer has no body
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _dispatch(self, method):
+        url = urlparse(self.path)
+        body = self._read_body()
+        code, answer, headers = self.server.mock.handle(method, url.path, parse_qs(url.query), self.headers, body)
+        self._send_json(code, answer, headers)
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+
+class MockPipedriveServer:
+    """ Local stand-in of Pipedrive endpoints used by this package
+
+    Serves oauth/token, v1 users/me and v2 deals listing with cursors and creation,
+    v2 persons, organizations, stages, pipelines and v1 users listings for entities of deals.
+    Access token can be rotated to make clients go through 401 and token refresh.
+
+    Faults of real API can be switched on for API endpoints:
+      latency      - seconds every answer is delayed, plus random part up to latency_jitter
+      token_ttl    - seconds access token is accepted after it was issued, 401 afterwards
+      rate_limit   - requests accepted per rate_window seconds, 429 with Retry-After above it
+      error_rate   - part of requests answered with error_code, chosen with seeded random
+    """
+
+    def __init__(self, host = '127.0.0.1', port = 0, deals_count = 0, client_id = 'client', client_secret = 'secret',
+            latency = 0.0, latency_jitter = 0.0, token_ttl = None, rate_limit = None, rate_window = 2.0,
+            error_rate = 0.0, error_code = 503, seed = 0):
+        self._client_id = client_id
+        self._client_secret = client_secret
+        self._lock = threading.Lock()
+        self._token_serial = 1
+        self.access_token = 'access-1'
+        self.refresh_token = 'refresh-1'
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.token_ttl = token_ttl
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._random = random.Random(seed)
+        self._token_issued = time.monotonic()
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+        self.deals = []
+        self.seed_deals(deals_count)
+        self.entities = {"persons": [], "organizations": [],
+            "users": [{"id": 1, "name": "Mock User", "email": "mock@example.com"}],
+            "stages": [{"id": stage_id, "name": f"Stage {stage_id}", "pipeline_id": 1} for stage_id in (1, 2, 3)],
+            "pipelines": [{"id": 1, "name": "Pipeline 1"}]}
+        self.stats = {"connections": 0, "requests": 0, "token_refreshes": 0, "unauthorized": 0, "deals_created": 0, "deals_updated": 0,
+            "throttled": 0, "errors": 0, "not_modified": 0}
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_uri(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def client_config(self):
+        """ config.json entries pointing clients to this server
+        """
+        return {"client_id": self._client_id,
+            "client_secret": self._client_secret,
+            "oauth_uri": self.base_uri + "oauth/token",
+            "api_uri_v1": self.base_uri + "api/v1/",
+            "api_uri_v2": self.base_uri + "api/v2/"}
+
+    def client_token(self):
+        """ token.json content currently accepted by this server
+        """
+        return {"access_token": self.access_token, "refresh_token": self.refresh_token,
+            "expires_in": self.token_ttl or 3600, "token_type": "Bearer", "scope": "", "api_domain": self.base_uri}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='pipedrive-mock', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def seed_deals(self, count):
+        """ Add count generated deals
+        """
+        with self._lock:
+            first = len(self.deals) + 1
+            self.deals.extend(self._new_deal(i, {"title": f"Deal {i}", "status": "open", "value": i}) for i in range(first, first + count))
+
+    def seed_entities(self, name, count, **fields):
+        """ Add count generated entities to persons, organizations, users, stages or pipelines listing
+        """
+        with self._lock:
+            entities = self.entities[name]
+            first = len(entities) + 1
+            entities.extend(dict(fields, id=i, name=f"{name[:-1].capitalize()} {i}") for i in range(first, first + count))
+
+    def rotate_access_token(self):
+        """ Expire current access token, clients get 401 until they refresh
+        """
+        with self._lock:
+            self._token_serial += 1
+            self.access_token = f'access-{self._token_serial}'
+            self._token_issued = time.monotonic()
+
+    def _count(self, name, value = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _new_deal(self, deal_id, fields):
+        deal = {"id": deal_id, "title": None, "status": "open", "value": None, "currency": "EUR",
+            "owner_id": 1, "stage_id": 1, "pipeline_id": 1, "add_time": "2024-08-29T00:00:00Z",
+            "update_time": "2024-08-29T00:00:00Z"}
+        deal.update(fields)
+        deal["id"] = deal_id
+        return deal
+
+    def _delay(self):
+        delay = self.latency
+        if self.latency_jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.latency_jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _token_expired(self):
+        return self.token_ttl is not None and time.monotonic() - self._token_issued > self.token_ttl
+
+    def _rate_limit_headers(self):
+        """ Count request in fixed window, returns (throttled, headers) like Pipedrive x-ratelimit headers
+        """
+        if self.rate_limit is None:
+            return False, {}
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_requests = 0
+            self._window_requests += 1
+            reset = max(0.0, self.rate_window - (now - self._window_start))
+            remaining = max(0, self.rate_limit - self._window_requests)
+            throttled = self._window_requests > self.rate_limit
+            if throttled:
+                self.stats['throttled'] += 1
+        headers = {"x-ratelimit-limit": self.rate_limit, "x-ratelimit-remaining": remaining, "x-ratelimit-reset": f"{reset:.3f}"}
+        if throttled:
+            headers["Retry-After"] = f"{reset:.3f}"
+        return throttled, headers
+
+    def _inject_error(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.stats['errors'] += 1
+        return failed
+
+    def handle(self, method, path, query, headers, body):
+        """ Return (code, json body, extra headers) for request
+        """
+        self._count('requests')
+        self._delay()
+        if method == 'POST' and path == '/oauth/token':
+            return self._handle_token(headers, body)
+        throttled, limit_headers = self._rate_limit_headers()
+        if throttled:
+            return 429, {"success": False, "error": "Request over limit", "errorCode": 429}, limit_headers
+        if headers.get('Authorization') != f"Bearer {self.access_token}" or self._token_expired():
+            self._count('unauthorized')
+            return 401, {"success": False, "error": "unauthorized access", "errorCode": 401}, limit_headers
+        if self._inject_error():
+            return self.error_code, {"success": False, "error": "Service unavailable", "errorCode": self.error_code}, limit_headers
+        code, answer, answer_headers = self._route(method, path, query, body)
+        if method == 'GET' and code == 200:
+            # conditional GET, unchanged answer is not sent again
+            etag = '"' + hashlib.sha1(json.dumps(answer, sort_keys=True).encode('utf-8')).hexdigest() + '"'
+            answer_headers = dict(answer_headers, ETag=etag)
+            if headers.get('If-None-Match') == etag:
+                self._count('not_modified')
+                return 304, None, dict(limit_headers, **answer_headers)
+        return code, answer, dict(limit_headers, **answer_headers)
+
+    def _route(self, method, path, query, body):
+        if method == 'GET' and path == '/api/v1/users/me':
+            return 200, {"success": True, "data": {"id": 1, "name": "Mock User", "company_id": 1, "company_domain": "mock"}}, {}
+        if method == 'GET' and path == '/api/v2/deals':
+            return self._handle_list_deals(query)
+        if method == 'GET' and path == '/api/v2/deals/search':
+            return self._handle_search_deals(query)
+        if method == 'GET' and path.startswith('/api/v2/') and path[len('/api/v2/'):] in ('persons', 'organizations', 'stages', 'pipelines'):
+            return self._handle_list_entities(path[len('/api/v2/'):], query)
+        if method == 'GET' and path == '/api/v1/users':
+            return self._handle_list_users(query)
+        if method == 'POST' and path == '/api/v2/deals':
+            return self._handle_add_deal(body)
+        if method == 'PATCH' and path.startswith('/api/v2/deals/'):
+            return self._handle_update_deal(path.rsplit('/', 1)[1], body)
+        return 404, {"success": False, "error": f"Unknown endpoint {method} {path}"}, {}
+
+    def _handle_token(self, headers, body):
+        expected = base64.b64encode(f"{self._client_id}:{self._client_secret}".encode()).decode()
+        if headers.get('Authorization') != f"Basic {expected}":
+            return 401, {"success": False, "error": "invalid client"}, {}
+        form = parse_qs(body.decode('utf-8'))
+        grant_type = form.get('grant_type', [None])[0]
+        with self._lock:
+            if grant_type == 'refresh_token' and form.get('refresh_token', [None])[0] != self.refresh_token:
+                return 400, {"success": False, "error": "invalid_grant"}, {}
+            if grant_type not in ('refresh_token', 'authorization_code'):
+                return 400, {"success": False, "error": "unsupported_grant_type"}, {}
+            self._token_serial += 1
+            self.access_token = f'access-{self._token_serial}'
+            self.refresh_token = f'refresh-{self._token_serial}'
+            self._token_issued = time.monotonic()
+            self.stats['token_refreshes'] += 1
+            token = self.client_token()
+        return 200, token, {}
+
+    def _handle_list_deals(self, query):
+        limit = min(int(query.get('limit', ['100'])[0]), 500)
+        start = int(query.get('cursor', ['0'])[0])
+        param = lambda name: query.get(name, [None])[0]
+        with self._lock:
+            deals = self.deals
+            if param('status'):
+                statuses = param('status').split(',')
+                deals = [deal for deal in deals if deal['status'] in statuses]
+            else:
+                # like v2 API, deleted deals are listed only when asked for by status
+                deals = [deal for deal in deals if deal['status'] != 'deleted']
+            for name in ('owner_id', 'stage_id', 'pipeline_id'):
+                if param(name) is not None:
+                    deals = [deal for deal in deals if str(deal.get(name)) == param(name)]
+            # timestamps share one format, so they compare as strings
+            if param('updated_since'):
+                deals = [deal for deal in deals if deal['update_time'] >= param('updated_since')]
+            if param('updated_until'):
+                deals = [deal for deal in deals if deal['update_time'] < param('updated_until')]
+            sort_by = param('sort_by') or 'id'
+            if sort_by != 'id' or param('sort_direction') == 'desc':
+                deals = sorted(deals, key=lambda deal: (deal.get(sort_by) or '', deal['id']), reverse=param('sort_direction') == 'desc')
+            page = deals[start:start + limit]
+            next_cursor = str(start + limit) if start + limit < len(deals) else None
+        if param('custom_fields') is not None:
+            keys = param('custom_fields').split(',')
+            page = [dict(deal, custom_fields={key: value for key, value in (deal.get('custom_fields') or {}).items() if key in keys})
+                for deal in page]
+        return 200, {"success": True, "data": page, "additional_data": {"next_cursor": next_cursor}}, {}
+
+    def _handle_list_entities(self, name, query):
+        limit = min(int(query.get('limit', ['100'])[0]), 500)
+        start = int(query.get('cursor', ['0'])[0])
+        with self._lock:
+            entities = self.entities[name]
+            if query.get('ids'):
+                ids = query['ids'][0].split(',')
+                if len(ids) > 100:
+                    return 400, {"success": False, "error": "ids takes up to 100 ids"}, {}
+                ids = set(ids)
+                entities = [entity for entity in entities if str(entity['id']) in ids]
+            page = entities[start:start + limit]
+            next_cursor = str(start + limit) if start + limit < len(entities) else None
+        return 200, {"success": True, "data": page, "additional_data": {"next_cursor": next_cursor}}, {}
+
+    def _handle_list_users(self, query):
+        # v1 listing, paginated with start and limit
+        limit = min(int(query.get('limit', ['100'])[0]), 500)
+        start = int(query.get('start', ['0'])[0])
+        with self._lock:
+            users = self.entities['users']
+            page = users[start:start + limit]
+            more = start + limit < len(users)
+        pagination = {"start": start, "limit": limit, "more_items_in_collection": more}
+        if more:
+            pagination["next_start"] = start + limit
+        return 200, {"success": True, "data": page, "additional_data": {"pagination": pagination}}, {}
+
+    def _handle_search_deals(self, query):
+        param = lambda name: query.get(name, [None])[0]
+        term = (param('term') or '').lower()
+        exact_match = param('exact_match') == 'true'
+        if len(term) < 2 and not exact_match:
+            return 400, {"success": False, "error": "term has to be at least 2 characters long"}, {}
+        fields = (param('fields') or 'title,custom_fields').split(',')
+        limit = min(int(param('limit') or 100), 500)
+        start = int(param('cursor') or 0)
+
+        def values(deal):
+            if 'title' in fields:
+                yield deal.get('title')
+            if 'custom_fields' in fields:
+                yield from (deal.get('custom_fields') or {}).values()
+
+        def matches(value):
+            value = str(value).lower() if value is not None else None
+            return value == term if exact_match else value is not None and term in value
+
+        with self._lock:
+            found = [deal for deal in self.deals if (not param('status') or deal['status'] == param('status'))
+                and any(matches(value) for value in values(deal))]
+            page = found[start:start + limit]
+            next_cursor = str(start + limit) if start + limit < len(found) else None
+        items = [{"result_score": 1.0, "item": dict(deal, type="deal")} for deal in page]
+        return 200, {"success": True, "data": {"items": items}, "additional_data": {"next_cursor": next_cursor}}, {}
+
+    @staticmethod
+    def _now():
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+    def _handle_add_deal(self, body):
+        try:
+            fields = json.loads(body or b'{}')
+        except ValueError:
+            return 400, {"success": False, "error": "invalid json"}, {}
+        if not fields.get('title'):
+            return 400, {"success": False, "error": "title is required"}, {}
+        with self._lock:
+            now = self._now()
+            deal = self._new_deal(len(self.deals) + 1, dict({"add_time": now, "update_time": now}, **fields))
+            self.deals.append(deal)
+            self.stats['deals_created'] += 1
+        return 200, {"success": True, "data": deal}, {}
+
+    def _handle_update_deal(self, deal_id, body):
+        try:
+            fields = json.loads(body or b'{}')
+            index = int(deal_id) - 1
+        except ValueError:
+            return 400, {"success": False, "error": "invalid request"}, {}
+        with self._lock:
+            if not 0 <= index < len(self.deals):
+                return 404, {"success": False, "error": "Deal not found"}, {}
+            deal = self.deals[index]
+            deal.update(fields)
+            deal["id"] = index + 1
+            deal["update_time"] = self._now()
+            self.stats['deals_updated'] += 1
+        return 200, {"success": True, "data": deal}, {}
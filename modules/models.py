@@ -0,0 +1,143 @@
+import re
+import json
+from collections.abc import Mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['Deal','JsonPage']
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class Deal(Mapping):
+    """ Compact deal record, only fields listed in slots are kept from API answer
+
+    Read-only mapping for code written against deal dicts, slot fields are always present
+    (None when API answer had no value), other keys are looked up in custom_fields.
+    """
+
+    __slots__ = ('id', 'title', 'status', 'value', 'currency', 'owner_id', 'person_id', 'org_id',
+        'stage_id', 'pipeline_id', 'add_time', 'update_time', 'custom_fields')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, data):
+        deal = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(deal, name, data.get(name))
+        return deal
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __getitem__(self, name):
+        if name in self.__slots__:
+            return getattr(self, name)
+        if self.custom_fields and name in self.custom_fields:
+            return self.custom_fields[name]
+        raise KeyError(name)
+
+    def get(self, name, default = None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __contains__(self, name):
+        return name in self.__slots__ or bool(self.custom_fields) and name in self.custom_fields
+
+    def __iter__(self):
+        yield from self.__slots__
+        if self.custom_fields:
+            yield from (name for name in self.custom_fields if name not in self.__slots__)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        return isinstance(other, Deal) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"Deal(id={self.id!r}, title={self.title!r}, status={self.status!r}, value={self.value!r})"
+
+
+def _skip(text, pos):
+    return _whitespace.match(text, pos).end()
+
+
+def _expect(text, pos, chars):
+    if pos >= len(text) or text[pos] not in chars:
+        raise json.JSONDecodeError(f"Expecting one of {chars!r}", text, pos)
+    return text[pos]
+
+
+class JsonPage:
+    """ API list answer, items of its data array are decoded one at a time while iterating
+
+    Other top level members (success, additional_data) are in fields once iteration is
+    finished. Default stdlib backend keeps only one item dict at a time. orjson backend is
+    opt-in ("json_backend": "orjson" in config.json), it parses whole answer at once, which is
+    faster but holds all item dicts of the page.
+    """
+
+    def __init__(self, body, factory = dict, backend = None):
+        self._body = body
+        self._factory = factory
+        self._backend = backend or 'json'
+        if self._backend == 'orjson' and orjson is None:
+            raise ImportError("orjson is required for json_backend orjson, install it with 'pip install orjson'")
+        self.fields = {}
+
+    def __iter__(self):
+        body, self._body = self._body, None
+        if body is None:
+            return
+        if self._backend == 'orjson':
+            yield from self._iter_orjson(body)
+        else:
+            yield from self._iter_stream(body.decode('utf-8') if isinstance(body, (bytes, bytearray)) else body)
+
+    def _iter_orjson(self, body):
+        page = orjson.loads(body)
+        items = page.pop('data', None) or []
+        self.fields = page
+        for position in range(len(items)):
+            item, items[position] = items[position], None
+            yield self._factory(item)
+
+    def _iter_stream(self, text):
+        pos = _skip(text, 0)
+        _expect(text, pos, '{')
+        pos = _skip(text, pos + 1)
+        if text.startswith('}', pos):
+            return
+        while True:
+            _expect(text, pos, '"')
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            _expect(text, pos, ':')
+            pos = _skip(text, pos + 1)
+            if key == 'data' and text.startswith('[', pos):
+                pos = _skip(text, pos + 1)
+                if not text.startswith(']', pos):
+                    while True:
+                        item, pos = _decoder.raw_decode(text, pos)
+                        yield self._factory(item)
+                        pos = _skip(text, pos)
+                        if _expect(text, pos, ',]') == ']':
+                            break
+                        pos = _skip(text, pos + 1)
+                pos += 1
+            else:
+                self.fields[key], pos = _decoder.raw_decode(text, pos)
+            pos = _skip(text, pos)
+            if _expect(text, pos, ',}') == '}':
+                break
+            pos = _skip(text, pos + 1)
@@ -1,26 +1,100 @@
 import os
 import json
 import logging
+import time
 import requests
 from requests.auth import HTTPBasicAuth
-import urllib
+import urllib.parse
 import argparse
 from argparse import RawTextHelpFormatter
 import sys
+import datetime
+import threading
+import functools
+import queue
 
 from modules.keyvault import KeyVaultStorage
+from modules.transport import PipedriveTransport
+from modules.ratelimit import RateLimiter
+from modules.retry import RetryPolicy
+from modules.metrics import Metrics, endpoint_name, body_size
+from modules.cache import ResponseCache
+from modules.models import Deal, JsonPage
 
-__all__ = ['PipedriveCLI','PipedriveREST','PipedriveUser','PipedriveDeals']
+__all__ = ['PipedriveCLI','PipedriveREST','PipedriveUser','PipedriveDeals','PipedriveResource','PipedriveAPIError']
 
 OAUTH_URI = "https://oauth.pipedrive.com/oauth/token"
 
 API_URI_V1 = "https://api-proxy.pipedrive.com/api/v1/"
 API_URI_V2 = "https://api-proxy.pipedrive.com/api/v2/"
 
+# times request answered with 429 is queued again before it is returned to caller
+DEFAULT_THROTTLED_RETRIES = 10
+# access token is refreshed this many seconds before it expires
+DEFAULT_TOKEN_REFRESH_MARGIN = 300
+
+# v2 list endpoints accept up to 500 items per page
+DEFAULT_PAGE_LIMIT = 100
+
+DEAL_STATUSES = ('open', 'won', 'lost', 'deleted')
+DEAL_SORT_FIELDS = ('id', 'update_time', 'add_time')
+SORT_DIRECTIONS = ('asc', 'desc')
+
+# list endpoints read by PipedriveResource: API version, whether list takes ids filter
+RESOURCES = {
+    'deals': ('v2', True),
+    'persons': ('v2', True),
+    'organizations': ('v2', True),
+    'stages': ('v2', False),
+    'pipelines': ('v2', False),
+    'users': ('v1', False),
+}
+# ids filter of v2 list endpoints takes up to 100 ids
+MAX_IDS_PER_REQUEST = 100
+
+# deals listing can be split by these, update_time splits to ranges of updated_since/updated_until
+PARTITION_FIELDS = ('status', 'pipeline_id', 'stage_id', 'owner_id', 'update_time')
+# resources listing possible values of partition field
+PARTITION_RESOURCES = {'pipeline_id': 'pipelines', 'stage_id': 'stages', 'owner_id': 'users'}
+DEFAULT_PARTITIONS = 8
+DEFAULT_PARTITION_WORKERS = 4
+
+
+def _rfc3339(value):
+    """ Timestamp as expected by updated_since/updated_until, naive datetimes are taken as UTC
+    """
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+    return str(value)
+
+
+def _csv_param(value):
+    if isinstance(value, str):
+        return value
+    return ",".join(str(item) for item in value)
+
+
+class PipedriveAPIError(Exception):
+    """ Raised by streaming methods when API answers with non 200 code
+    """
+    def __init__(self, code, content):
+        super().__init__(f"Pipedrive API request failed with code {code}: {content}")
+        self.code = code
+        self.content = content
+
+
 class PipedriveCLI:
     def __init__(self):
         self._kv = KeyVaultStorage()
-        self._restapi = PipedriveREST()
+
+    @functools.cached_property
+    def _restapi(self):
+        # client reads token and config files, so it is created only by commands calling API
+        return PipedriveREST()
 
     def fetch_token(self):
         """ Fetch new token
@@ -34,11 +108,10 @@ class PipedriveCLI:
         parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
         args = parser.parse_args(sys.argv[2:])
 
-        code, content = self._restapi._get_token()
+        code, content = self._restapi._fetch_token_locked()
         logging.debug(f"Answer for token request: {code}, {content}")
 
         if code == 200:
-            self._kv.update_token(json.loads(content))
             logging.debug(f"New token value: {content}")
             logging.info(f"Token request successfully finished")
         else:
@@ -57,12 +130,14 @@ class PipedriveCLI:
         parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
         args = parser.parse_args(sys.argv[2:])
 
-
-        code, content = self._restapi._do_token_refresh()
+        response = self._restapi._refresh_token_locked(self._kv.get_access_token())
+        if response is None:
+            logging.info(f"Token was refreshed by other client meanwhile, nothing to do")
+            return
+        code, content = response
         logging.debug(f"Answer for token refresh: {code}, {content}")
 
         if code == 200:
-            self._kv.update_token(json.loads(content))
             logging.debug(f"New token value: {content}")
             logging.info(f"Token refresh successfully finished")
         else:
@@ -81,7 +156,7 @@ class PipedriveCLI:
         parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
         args = parser.parse_args(sys.argv[2:])
 
-        userapi = PipedriveUser()
+        userapi = PipedriveUser(self._restapi)
         code, content = userapi.whoami()
         logging.debug(f"Answer for user query: {code}, {content}")
 
@@ -98,20 +173,101 @@ class PipedriveCLI:
 
         example = '''Example:
         pipedrive.py deals
+        pipedrive.py deals --limit 500 --output deals.ndjson
+        pipedrive.py deals --status open,won --updated-since 2024-08-29T00:00:00Z --fields id,title,value
+        pipedrive.py deals --owner-id 1 --sort-by update_time --sort-direction desc
+        pipedrive.py deals --enrich --fields id,title,person,organization,owner
+        pipedrive.py deals --partition-by update_time --partitions 16 --workers 8 --limit 500
                  '''
         # command arguments
-        parser = argparse.ArgumentParser(description="List all deals", epilog=example, formatter_class=RawTextHelpFormatter)
+        parser = argparse.ArgumentParser(description="List all deals as NDJSON", epilog=example, formatter_class=RawTextHelpFormatter)
         parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+        parser.add_argument('-l', '--limit', help='Deals requested per page', type=int, default=DEFAULT_PAGE_LIMIT)
+        parser.add_argument('-o', '--output', help='File to write deals to, stdout by default', default=None)
+        parser.add_argument('--status', help='Comma separated statuses: ' + ', '.join(DEAL_STATUSES), default=None)
+        parser.add_argument('--owner-id', help='Only deals of owner', type=int, default=None)
+        parser.add_argument('--stage-id', help='Only deals in stage', type=int, default=None)
+        parser.add_argument('--pipeline-id', help='Only deals in pipeline', type=int, default=None)
+        parser.add_argument('--updated-since', help='Only deals updated at or after RFC 3339 time', default=None)
+        parser.add_argument('--updated-until', help='Only deals updated before RFC 3339 time', default=None)
+        parser.add_argument('--sort-by', help='Sort field: ' + ', '.join(DEAL_SORT_FIELDS), choices=DEAL_SORT_FIELDS, default=None)
+        parser.add_argument('--sort-direction', help='asc or desc', choices=SORT_DIRECTIONS, default=None)
+        parser.add_argument('--fields', help='Comma separated deal fields written to output, all by default', default=None)
+        parser.add_argument('--custom-fields', help='Comma separated custom field keys requested with deals', default=None)
+        parser.add_argument('--enrich', help='Join person, organization, owner, stage and pipeline to deals', action='store_true', default=False)
+        parser.add_argument('--partition-by', help='List partitions concurrently: ' + ', '.join(PARTITION_FIELDS), choices=PARTITION_FIELDS, default=None)
+        parser.add_argument('--partitions', help='Number of update_time ranges', type=int, default=DEFAULT_PARTITIONS)
+        parser.add_argument('--workers', help='Partitions listed at once', type=int, default=DEFAULT_PARTITION_WORKERS)
         args = parser.parse_args(sys.argv[2:])
 
-        dealsapi = PipedriveDeals()
-        code, content = dealsapi.get_all_deals()
-        logging.debug(f"Answer for deals query: {code}, {content}")
-
-        if code == 200:
-            logging.info(f"Deals available: {content}")
+        dealsapi = PipedriveDeals(self._restapi)
+        params = dealsapi.query(status=args.status.split(',') if args.status else None, owner_id=args.owner_id,
+            stage_id=args.stage_id, pipeline_id=args.pipeline_id, updated_since=args.updated_since,
+            updated_until=args.updated_until, sort_by=args.sort_by, sort_direction=args.sort_direction,
+            custom_fields=args.custom_fields)
+        fields = args.fields.split(',') if args.fields else None
+        if args.enrich:
+            from modules.enrich import DealEnricher
+            # ids of related entities are needed for join, deals are projected after it
+            deals = DealEnricher(self._restapi).enrich(dealsapi.iter_deal_models(params, limit=args.limit))
+            if fields:
+                deals = ({field: deal.get(field) for field in fields} for deal in deals)
+        elif args.partition_by:
+            # sort order does not hold across partitions
+            deals = dealsapi.iter_deals_partitioned(params, by=args.partition_by, workers=args.workers, limit=args.limit,
+                fields=fields, count=args.partitions)
         else:
-            logging.error(f"Deals query failed: {code} Error: {content}")
+            deals = dealsapi.iter_deals(params, limit=args.limit, fields=fields)
+        out = open(args.output, 'w') if args.output else sys.stdout
+        count = 0
+        try:
+            for deal in deals:
+                out.write(json.dumps(deal) + "\n")
+                count += 1
+            logging.info(f"Deals listed: {count}")
+        except PipedriveAPIError as e:
+            logging.error(f"Deals query failed after {count} deals: {e.code} Error: {e.content}")
+        finally:
+            if args.output:
+                out.close()
+
+    def export(self):
+        """ refresh local deals snapshot
+        """
+
+        example = '''Example:
+        pipedrive.py export
+        pipedrive.py export --store deals.sqlite --output deals.ndjson
+        pipedrive.py export --full --compact --purge-deleted
+                 '''
+        # command arguments
+        parser = argparse.ArgumentParser(description="Merge deals changed since last export into local SQLite store", epilog=example, formatter_class=RawTextHelpFormatter)
+        parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+        parser.add_argument('-s', '--store', help='SQLite file of snapshot, export_file of config.json by default', default=None)
+        parser.add_argument('-a', '--account', help='Account of watermark, export_account of config.json by default', default=None)
+        parser.add_argument('--full', help='Ignore watermark and fetch all deals', action='store_true', default=False)
+        parser.add_argument('--compact', help='Compact store after export', action='store_true', default=False)
+        parser.add_argument('--purge-deleted', help='Drop deleted deals from store while compacting', action='store_true', default=False)
+        parser.add_argument('-o', '--output', help='File to write all stored deals to as NDJSON', default=None)
+        args = parser.parse_args(sys.argv[2:])
+
+        from modules.export import DealExport, DEFAULT_EXPORT_FILE
+        config = self._restapi._config
+        store = args.store or config.get('export_file', DEFAULT_EXPORT_FILE)
+        account = args.account or config.get('export_account', 'default')
+        with DealExport(PipedriveDeals(self._restapi), store, account) as export:
+            try:
+                export.run(full=args.full)
+            except PipedriveAPIError as e:
+                logging.error(f"Export failed, watermark {export.watermark} kept: {e.code} Error: {e.content}")
+                return
+            if args.compact:
+                export.compact(purge_deleted=args.purge_deleted)
+            if args.output:
+                with open(args.output, 'w') as out:
+                    for deal in export.deals():
+                        out.write(json.dumps(deal) + "\n")
+            logging.info(f"Deals in {store} for {account}: {export.count()}")
 
 class PipedriveREST:
 
@@ -119,23 +275,36 @@ class PipedriveREST:
         self._token_file_name = 'token.json'
         self._config_file_name = 'config.json'
         self._kv = KeyVaultStorage()
-        self._access_token = self._kv.get_access_token()
-        self._refresh_token = self._kv.get_refresh_token()
         self._redirect_uri = self._kv.get_redirect_uri()
         self._code = self._kv.get_code()
-        self._config = self._get_config_data()
         self._failed_auth_counter = 0
+        self._refresh_lock = threading.Lock()
         self._token_autorefresh = ( self._config['token_autorefresh'] == 1 )
-    
-    def _get_config_data(self):
-        output = None
-        try:
-            with open(self._config_file_name, 'r') as config_file:
-                output = json.load(config_file)
-        except FileNotFoundError:
-            logging.error(f"Config File {self._config_file_name} does not exist.")
-            pass
-        return output
+        self._transport = PipedriveTransport.get_transport(self._config)
+        self._limiter = RateLimiter.get_limiter(self._config)
+        self._retry_policy = RetryPolicy.get_policy(self._config)
+        self._metrics = Metrics.get_metrics()
+        # None unless response_cache is enabled in config
+        self._cache = ResponseCache.get_cache(self._config)
+        self._token_refresh_margin = float(self._config.get('token_refresh_margin', DEFAULT_TOKEN_REFRESH_MARGIN))
+        self._throttled_retries = int(self._config.get('rate_limit_max_retries', DEFAULT_THROTTLED_RETRIES))
+        # endpoints can be pointed to local stand-in server from config
+        self.oauth_uri = self._config.get('oauth_uri', OAUTH_URI)
+        self.api_uri_v1 = self._config.get('api_uri_v1', API_URI_V1)
+        self.api_uri_v2 = self._config.get('api_uri_v2', API_URI_V2)
+
+    # credentials are served from KeyVaultStorage cache, so token rotated by other client is picked up
+    @property
+    def _config(self):
+        return self._kv.get_config()
+
+    @property
+    def _access_token(self):
+        return self._kv.get_access_token()
+
+    @property
+    def _refresh_token(self):
+        return self._kv.get_refresh_token()
 
     def _get_token(self, code = None):
         if code == None:
@@ -143,60 +312,193 @@ class PipedriveREST:
         request = {"grant_type": "authorization_code",
             "redirect_uri": self._redirect_uri,
             "code": code}
-        response = self.post_request(OAUTH_URI, request, 'basic')
+        response = self.post_request(self.oauth_uri, request, 'basic')
         return response
     
     def _do_token_refresh(self):
         request = {"grant_type": "refresh_token",
             "refresh_token": self._refresh_token}
-        response = self.post_request(OAUTH_URI, request, 'basic')
+        response = self.post_request(self.oauth_uri, request, 'basic')
         return response
     
     def _auto_refresh_token(self):
-        self._failed_auth_counter = None
-        #request = {"grant_type": "refresh_token",
-        #    "refresh_token": self._refresh_token}
-        #response = self.post_request(OAUTH_URI, request, 'basic')
         response = self._do_token_refresh()
         code = response[0]
         content = response[1]
         if code == 200:
             self._kv.update_token(json.loads(content))
-            self._access_token = self._kv.get_access_token()
             self._failed_auth_counter = 0
+        else:
+            # client stops refreshing after failed refresh, requests get 401 back
+            logging.error(f"Token autorefresh failed with code: {code} Error: {content}")
+            self._failed_auth_counter = None
+        self._metrics.record_refresh(self._failed_auth_counter == 0)
         return self._failed_auth_counter == 0
 
-    def post_request(self, uri, data, auth):
+    def _refresh_after_unauthorized(self, used_access_token):
+        """ Refresh token once for all threads and processes sharing token file, returns True when request should be sent again
+        """
+        with self._refresh_lock, self._kv.token_lock():
+            # token file is replaced atomically, so token read under lock is the latest one
+            if self._access_token != used_access_token:
+                # refreshed by other thread or process while this request was in flight
+                return True
+            if not self._autorefresh_is_enabled():
+                return False
+            return self._auto_refresh_token()
+
+    def _refresh_token_locked(self, used_access_token):
+        """ Refresh token on user request and store it, returns (code, content) or None when other client rotated token meanwhile
+        """
+        with self._refresh_lock, self._kv.token_lock():
+            # refresh token read under lock is the latest one, stale one would be rejected by server
+            if self._access_token != used_access_token:
+                return None
+            code, content = self._do_token_refresh()
+            if code == 200:
+                self._kv.update_token(json.loads(content))
+                self._failed_auth_counter = 0
+            return (code, content)
+
+    def _fetch_token_locked(self):
+        """ Exchange authorization code for token and store it, returns (code, content)
+        """
+        with self._refresh_lock, self._kv.token_lock():
+            code, content = self._get_token()
+            if code == 200:
+                self._kv.update_token(json.loads(content))
+                self._failed_auth_counter = 0
+            return (code, content)
+
+    def _token_expires_soon(self):
+        expires_at, expires_in = self._kv.get_token_expiry()
+        if expires_at is None:
+            return False
+        # short lived tokens are refreshed in second half of their life
+        return time.time() >= expires_at - min(self._token_refresh_margin, expires_in / 2)
+
+    def _current_access_token(self):
+        """ Access token for next request, refreshed ahead of expiry so hot loops never get 401
+        """
+        access_token = self._access_token
+        if self._token_autorefresh and self._autorefresh_is_enabled() and self._token_expires_soon():
+            logging.debug('Access token is about to expire, refreshing it')
+            self._refresh_after_unauthorized(access_token)
+            access_token = self._access_token
+        return access_token
+
+    def post_request(self, uri, data, auth, retry_unauthorized = True):
+        access_token = self._current_access_token() if auth != 'basic' else None
         if auth == 'basic':
-            response = requests.post(uri, auth=HTTPBasicAuth(self._config['client_id'], self._config['client_secret']), data = data)
+            response = self._send('POST', uri, auth=HTTPBasicAuth(self._config['client_id'], self._config['client_secret']), data = data)
         else:
-            headers = {"Authorization": f"Bearer {self._access_token}", "Content-type": "application/json"}
-            response = requests.post(uri, headers=headers, data = data)
+            headers = {"Authorization": f"Bearer {access_token}", "Content-type": "application/json"}
+            response = self._send('POST', uri, headers=headers, data = data)
+
+        code = response.status_code
+        content = response.content.decode('utf-8')
+        # 401 of token endpoint itself is not a token expiry
+        if int(code) == 401 and auth != 'basic' and retry_unauthorized and self._token_autorefresh:
+            logging.debug(f'Possible token expiry, triggering  autorefresh')
+            if self._refresh_after_unauthorized(access_token):
+                code, content = self.post_request(uri, data, auth, retry_unauthorized = False)
+        if self._cache is not None and auth != 'basic':
+            self._cache.invalidate(uri)
+        return (code, content)
+
+    def patch_request(self, uri, data, retry_unauthorized = True):
+        access_token = self._current_access_token()
+        headers = {"Authorization": f"Bearer {access_token}", "Content-type": "application/json"}
+        response = self._send('PATCH', uri, headers=headers, data = data)
 
         code = response.status_code
         content = response.content.decode('utf-8')
-        if int(code) == 401 and self._autorefresh_is_enabled():
+        if int(code) == 401 and retry_unauthorized and self._token_autorefresh:
             logging.debug(f'Possible token expiry, triggering  autorefresh')
-            self._auto_refresh_token()
-            code, content = self.post_request(self, uri, data, auth)
+            if self._refresh_after_unauthorized(access_token):
+                code, content = self.patch_request(uri, data, retry_unauthorized = False)
+        if self._cache is not None:
+            self._cache.invalidate(uri)
         return (code, content)
 
-    def get_request(self, uri, get_params_dict = None):
-        headers = {"Authorization": f"Bearer {self._access_token}"}
+    def get_request(self, uri, get_params_dict = None, retry_unauthorized = True):
+        code, body = self.get_request_bytes(uri, get_params_dict, retry_unauthorized)
+        return (code, body.decode('utf-8'))
+
+    def get_request_bytes(self, uri, get_params_dict = None, retry_unauthorized = True):
+        """ Same as get_request, answer body is returned undecoded for incremental parsing
+        """
+        access_token = self._current_access_token()
+        headers = {"Authorization": f"Bearer {access_token}"}
         if get_params_dict:
             uri = uri + "?" + self._build_get_params(get_params_dict)
-        response = requests.get(uri, headers=headers)
-        
+        cache_key = entry = None
+        if self._cache is not None:
+            cache_key = self._cache.key(uri, access_token)
+            entry, fresh = self._cache.lookup(cache_key)
+            if fresh:
+                return self._bytes(*self._cache.hit(entry))
+            headers.update(self._cache.conditional_headers(entry))
+        response = self._send('GET', uri, headers=headers)
+
         code = response.status_code
-        content = response.content.decode('utf-8')
-        if int(code) == 401 and self._autorefresh_is_enabled():
+        content = response.content
+        if self._cache is not None:
+            code, content = self._bytes(*self._cache.answer(cache_key, uri, entry, code, content, response.headers))
+        if int(code) == 401 and retry_unauthorized and self._token_autorefresh:
             logging.debug(f'Possible token expiry, triggering  autorefresh')
-            self._auto_refresh_token()
-            code, content = self.get_request(uri)
+            if self._refresh_after_unauthorized(access_token):
+                code, content = self.get_request_bytes(uri, retry_unauthorized = False)
         return (code, content)
+
+    @staticmethod
+    def _bytes(code, content):
+        # answers cached by async client are kept decoded
+        return (code, content.encode('utf-8') if isinstance(content, str) else content)
     
+    def _send(self, method, uri, **kwargs):
+        # every request waits for slot in process wide rate budget, throttled ones are queued again
+        # and transient failures are repeated with backoff as retry policy allows
+        throttled = 0
+        attempt = 0
+        endpoint = endpoint_name(method, uri)
+        sent = body_size(kwargs.get('data'))
+        while True:
+            self._limiter.acquire()
+            self._retry_policy.on_request()
+            start = time.perf_counter()
+            try:
+                response = self._transport.request(method, uri, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._metrics.record_request(endpoint, None, time.perf_counter() - start, sent)
+                if not self._retry_policy.should_retry_exception(method, e, attempt):
+                    raise
+                delay = self._retry_policy.backoff(attempt)
+                attempt += 1
+                self._metrics.record_retry(endpoint, 'exception')
+                logging.warning(f'{method} {uri} failed with {e!r}, retry {attempt} in {delay:.2f}s')
+                time.sleep(delay)
+                continue
+            self._metrics.record_request(endpoint, response.status_code, time.perf_counter() - start, sent, len(response.content))
+            if self._limiter.on_response(response.status_code, response.headers):
+                throttled += 1
+                if throttled > self._throttled_retries:
+                    logging.warning(f'Request to {uri} still throttled after {throttled} attempts')
+                    return response
+                self._metrics.record_retry(endpoint, 'throttled')
+                logging.debug(f'Request to {uri} throttled, queued again')
+                continue
+            if self._retry_policy.should_retry_status(method, response.status_code, attempt):
+                delay = self._retry_policy.backoff(attempt)
+                attempt += 1
+                self._metrics.record_retry(endpoint, 'status')
+                logging.warning(f'{method} {uri} answered {response.status_code}, retry {attempt} in {delay:.2f}s')
+                time.sleep(delay)
+                continue
+            return response
+
     def _build_get_params(self, get_params_dict):
-        out = urllib.urlencode(get_params_dict)
+        out = urllib.parse.urlencode(get_params_dict)
         return out
 
     def _autorefresh_is_enabled(self):
@@ -232,16 +534,16 @@ class PipedriveREST:
         #new_token = self._do_token_refresh()
         #logging.debug(f"New Token: {new_token}")
 
-        response = self._do_token_refresh()
+        response = self._refresh_token_locked(self._access_token)
+        if response is None:
+            logging.info(f"Token was refreshed by other client meanwhile, nothing to do")
+            return
         logging.debug(f"Answer for token refresh: {response}")
         code = response[0]
         content = response[1]
         #content = response.content.decode('utf-8')
 
         if code == 200:
-            self._kv.update_token(json.loads(content))
-            self._access_token = self._kv.get_access_token()
-            self._failed_auth_counter = 0
             logging.debug(f"New token value: {content}")
             logging.info(f"Token refresh successfully finished")
         else:
@@ -249,34 +551,283 @@ class PipedriveREST:
 
 class PipedriveUser:
 
-    def __init__(self):
+    def __init__(self, restapi = None):
         self._username = None
+        self._restapi = restapi or PipedriveREST()
 
     def whoami(self):
         output = None
-        request = API_URI_V1 + "users/me"
-        request_code, request_content = PipedriveREST().get_request(request)
+        request = self._restapi.api_uri_v1 + "users/me"
+        request_code, request_content = self._restapi.get_request(request)
         #if request_code == 200:
         #    output = json.loads(request_content)
         return request_code, request_content
 
+class PipedriveResource:
+    """ Paginated listing of one Pipedrive entity type: deals, persons, organizations, stages, pipelines or users
+
+    Follows v2 cursor and v1 start pagination, only one page is kept in memory. Entities of
+    types with ids filter can be fetched by id in batches instead of one request per entity.
+    """
+
+    def __init__(self, name, restapi = None):
+        if name not in RESOURCES:
+            raise ValueError(f"Unknown resource {name}, expected one of {', '.join(RESOURCES)}")
+        self.name = name
+        self.api_version, self.ids_filter = RESOURCES[name]
+        self._restapi = restapi or PipedriveREST()
+
+    @property
+    def uri(self):
+        base = self._restapi.api_uri_v1 if self.api_version == 'v1' else self._restapi.api_uri_v2
+        return base + self.name
+
+    def iter_items(self, params_dict = None, limit = DEFAULT_PAGE_LIMIT, factory = dict):
+        """ Yield items of listing one by one, factory turns item dict to returned record
+        """
+        request = self.uri
+        params = dict(params_dict or {})
+        params['limit'] = limit
+        backend = self._restapi._config.get('json_backend')
+        while True:
+            request_code, request_body = self._restapi.get_request_bytes(request, params)
+            if request_code != 200:
+                raise PipedriveAPIError(request_code, request_body.decode('utf-8'))
+            # items are decoded one at a time straight from answer bytes
+            page = JsonPage(request_body, factory, backend)
+            del request_body
+            yield from page
+            additional_data = page.fields.get('additional_data') or {}
+            pagination = additional_data.get('pagination') or {}
+            if additional_data.get('next_cursor'):
+                params['cursor'] = additional_data['next_cursor']
+            elif pagination.get('more_items_in_collection'):
+                params['start'] = pagination['next_start']
+            else:
+                break
+
+    def iter_by_ids(self, ids, factory = dict):
+        """ Yield existing items with given ids, MAX_IDS_PER_REQUEST ids are asked by one request
+        """
+        if not self.ids_filter:
+            raise ValueError(f"{self.name} can not be filtered by ids, list all of them with iter_items")
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), MAX_IDS_PER_REQUEST):
+            chunk = ids[start:start + MAX_IDS_PER_REQUEST]
+            yield from self.iter_items({"ids": _csv_param(chunk)}, len(chunk), factory)
+
 class PipedriveDeals:
-    def __init__(self):
-        pass
+    def __init__(self, restapi = None):
+        self._restapi = restapi or PipedriveREST()
+
+    @staticmethod
+    def query(status = None, owner_id = None, stage_id = None, pipeline_id = None, updated_since = None,
+            updated_until = None, sort_by = None, sort_direction = None, custom_fields = None):
+        """ Params of deals list filtered on server side, for get_all_deals and iter_deals
+
+        status can be one status or list of them, updated_since/updated_until take datetime or
+        RFC 3339 string, custom_fields lists custom field keys returned with deals, others are omitted.
+        """
+        params = {}
+        if status is not None:
+            statuses = [status] if isinstance(status, str) else list(status)
+            unknown = [item for item in statuses if item not in DEAL_STATUSES]
+            if unknown:
+                raise ValueError(f"Unknown deal status {', '.join(unknown)}, expected one of {', '.join(DEAL_STATUSES)}")
+            params['status'] = ",".join(statuses)
+        for name, value in (('owner_id', owner_id), ('stage_id', stage_id), ('pipeline_id', pipeline_id)):
+            if value is not None:
+                params[name] = int(value)
+        if updated_since is not None:
+            params['updated_since'] = _rfc3339(updated_since)
+        if updated_until is not None:
+            params['updated_until'] = _rfc3339(updated_until)
+        if sort_by is not None:
+            if sort_by not in DEAL_SORT_FIELDS:
+                raise ValueError(f"Deals can not be sorted by {sort_by}, expected one of {', '.join(DEAL_SORT_FIELDS)}")
+            params['sort_by'] = sort_by
+        if sort_direction is not None:
+            if sort_direction not in SORT_DIRECTIONS:
+                raise ValueError(f"Unknown sort direction {sort_direction}, expected asc or desc")
+            params['sort_direction'] = sort_direction
+        if custom_fields:
+            params['custom_fields'] = _csv_param(custom_fields)
+        return params
 
     def get_all_deals(self, params_dict = None):
-        request = API_URI_V2 + "deals"
-        request_code, request_content = PipedriveREST().get_request(request)
+        request = self._restapi.api_uri_v2 + "deals"
+        request_code, request_content = self._restapi.get_request(request, params_dict)
         return request_code, request_content
 
+    def iter_deals(self, params_dict = None, limit = DEFAULT_PAGE_LIMIT, fields = None):
+        """ Yield deal dicts one by one following v2 cursor pagination, only one page is kept in memory
+
+        With fields deals are projected to listed fields while parsing, the rest is never kept.
+        """
+        if fields:
+            fields = tuple(fields)
+            return self._iter_pages(params_dict, limit, lambda item: {field: item.get(field) for field in fields})
+        return self._iter_pages(params_dict, limit, dict)
+
+    def iter_deal_models(self, params_dict = None, limit = DEFAULT_PAGE_LIMIT):
+        """ Same as iter_deals yielding compact Deal records, fields not in Deal are dropped while parsing
+        """
+        return self._iter_pages(params_dict, limit, Deal.from_dict)
+
+    def _iter_pages(self, params_dict, limit, factory):
+        return PipedriveResource('deals', self._restapi).iter_items(params_dict, limit, factory)
+
+    def partitions(self, by, params_dict = None, count = DEFAULT_PARTITIONS, since = None, until = None):
+        """ Params of disjoint deal listings covering params_dict together
+
+        status, pipeline_id, stage_id and owner_id give one listing per value, values other than
+        statuses are listed from pipelines, stages and users. update_time gives count ranges between
+        since (oldest update_time by default) and until (now by default), first and last are open.
+        """
+        if by not in PARTITION_FIELDS:
+            raise ValueError(f"Deals can not be partitioned by {by}, expected one of {', '.join(PARTITION_FIELDS)}")
+        params = dict(params_dict or {})
+        if by == 'update_time':
+            return [dict(params, **window) for window in self._update_windows(params, count, since, until)]
+        if by == 'status':
+            values = params['status'].split(',') if params.get('status') else [status for status in DEAL_STATUSES if status != 'deleted']
+        elif params.get(by) is not None:
+            # listing already filtered by this field is not split further
+            return [params]
+        else:
+            values = [item['id'] for item in PipedriveResource(PARTITION_RESOURCES[by], self._restapi).iter_items(limit=500)]
+        return [dict(params, **{by: value}) for value in values]
+
+    def _update_windows(self, params, count, since, until):
+        since = since or params.get('updated_since')
+        until = until or params.get('updated_until')
+        if since is None:
+            oldest = next(iter(self._iter_pages(dict(params, sort_by='update_time', sort_direction='asc'), 1, dict)), None)
+            if oldest is None or not oldest.get('update_time'):
+                return [{}]
+            since = oldest['update_time']
+        start = self._datetime(since)
+        end = self._datetime(until) if until else datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        step = (end - start) / count
+        bounds = [_rfc3339(start + step * index) for index in range(1, count)]
+        # outer ranges are open, deals changed before since or while listing are not missed
+        lower = [params.get('updated_since')] + bounds
+        upper = bounds + [params.get('updated_until')]
+        return [{name: value for name, value in (('updated_since', low), ('updated_until', high)) if value is not None}
+            for low, high in zip(lower, upper) if low is None or high is None or low < high]
+
+    @staticmethod
+    def _datetime(value):
+        # naive UTC, as in updated_since
+        return datetime.datetime.strptime(_rfc3339(value), '%Y-%m-%dT%H:%M:%SZ')
+
+    def iter_deals_partitioned(self, params_dict = None, by = 'update_time', workers = DEFAULT_PARTITION_WORKERS,
+            limit = DEFAULT_PAGE_LIMIT, fields = None, count = DEFAULT_PARTITIONS, since = None, until = None):
+        """ Yield deals of params_dict walking partitions concurrently, order of deals is not kept
+
+        Every partition follows own cursor chain in one of workers threads, requests of all of them
+        share rate limiter of client. Deals are yielded once even when listings overlap, a deal
+        moved between partitions while listing can be missed, next updated_since pass picks it up.
+        """
+        if fields:
+            if 'id' not in fields:
+                raise ValueError("Partitioned listing needs id among fields to drop duplicates")
+            fields = tuple(fields)
+            factory = lambda item: {field: item.get(field) for field in fields}
+        else:
+            factory = dict
+        pending = queue.Queue()
+        for params in self.partitions(by, params_dict, count, since, until):
+            pending.put(params)
+        # bounded, at most few pages of each worker are held
+        results = queue.Queue(maxsize=workers * limit * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def walk():
+            try:
+                while not stop.is_set():
+                    try:
+                        params = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    for deal in self._iter_pages(params, limit, factory):
+                        if not put(deal):
+                            return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        threads = [threading.Thread(target=walk, name=f'deals-partition-{index}', daemon=True) for index in range(max(1, min(workers, pending.qsize())))]
+        for thread in threads:
+            thread.start()
+        seen = set()
+        running = len(threads)
+        try:
+            while running:
+                item = results.get()
+                if item is done:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                elif item['id'] not in seen:
+                    seen.add(item['id'])
+                    yield item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
     def add_deal(self, params_dict):
-        request = API_URI_V2 + "deals"
+        request = self._restapi.api_uri_v2 + "deals"
         data = json.dumps(params_dict)
-        request_code, request_content = PipedriveREST().post_request(request, data, 'oauth')
+        request_code, request_content = self._restapi.post_request(request, data, 'oauth')
         return request_code, request_content
 
-    def find_deal(self, params_dict):
-        request = API_URI_V2 + "deals"
+    def update_deal(self, deal_id, params_dict):
+        request = self._restapi.api_uri_v2 + f"deals/{deal_id}"
         data = json.dumps(params_dict)
-        request_code, request_content = PipedriveREST().post_request(request, data, 'oauth')
+        request_code, request_content = self._restapi.patch_request(request, data)
         return request_code, request_content
+
+    def find_deal(self, params_dict):
+        """ Search deals, params_dict takes term and optionally fields, exact_match, status, limit and cursor
+
+        Answer goes through ResponseCache like other GET requests, repeated searches are served
+        locally while fresh, TTL of them can be set with "deals/search" in response_cache_ttls.
+        """
+        request = self._restapi.api_uri_v2 + "deals/search"
+        request_code, request_content = self._restapi.get_request(request, params_dict)
+        return request_code, request_content
+
+    def search_deals(self, term, fields = None, exact_match = False, status = None, limit = DEFAULT_PAGE_LIMIT):
+        """ Yield deals found by term following cursor pagination of search answer
+        """
+        params = {"term": term, "limit": limit}
+        if fields:
+            params['fields'] = _csv_param(fields)
+        if exact_match:
+            params['exact_match'] = 'true'
+        if status:
+            params['status'] = status
+        while True:
+            request_code, request_content = self.find_deal(params)
+            if request_code != 200:
+                raise PipedriveAPIError(request_code, request_content)
+            answer = json.loads(request_content)
+            for found in (answer.get('data') or {}).get('items') or []:
+                yield found['item']
+            next_cursor = (answer.get('additional_data') or {}).get('next_cursor')
+            if not next_cursor:
+                break
+            params['cursor'] = next_cursor
@@ -0,0 +1,321 @@
+import json
+import base64
+import time
+import asyncio
+import logging
+import urllib.parse
+from collections import deque
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from modules.keyvault import KeyVaultStorage
+from modules.transport import DEFAULT_POOL_SIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from modules.ratelimit import RateLimiter
+from modules.retry import RetryPolicy
+from modules.metrics import Metrics, endpoint_name, body_size
+from modules.cache import ResponseCache
+from modules.models import Deal, JsonPage
+from modules.pipedriveapi import OAUTH_URI, API_URI_V1, API_URI_V2, DEFAULT_PAGE_LIMIT, DEFAULT_THROTTLED_RETRIES, DEFAULT_TOKEN_REFRESH_MARGIN, PipedriveAPIError
+
+__all__ = ['AsyncPipedriveREST','AsyncPipedriveUser','AsyncPipedriveDeals']
+
+# add_deal requests running at once in AsyncPipedriveDeals.add_deals
+DEFAULT_CONCURRENCY = 10
+
+
+class AsyncPipedriveREST:
+    """ asyncio counterpart of PipedriveREST, shares token and config files through KeyVaultStorage
+    """
+
+    def __init__(self):
+        if aiohttp is None:
+            raise ImportError("aiohttp is required for AsyncPipedriveREST, install it with 'pip install aiohttp'")
+        self._kv = KeyVaultStorage()
+        self._redirect_uri = self._kv.get_redirect_uri()
+        self._code = self._kv.get_code()
+        self._failed_auth_counter = 0
+        self._refresh_lock = asyncio.Lock()
+        self._token_autorefresh = ( self._config['token_autorefresh'] == 1 )
+        self._session = None
+        # same limiter as sync clients, so threads and tasks of process share one budget
+        self._limiter = RateLimiter.get_limiter(self._config)
+        self._retry_policy = RetryPolicy.get_policy(self._config)
+        self._metrics = Metrics.get_metrics()
+        self._cache = ResponseCache.get_cache(self._config)
+        self._token_refresh_margin = float(self._config.get('token_refresh_margin', DEFAULT_TOKEN_REFRESH_MARGIN))
+        self._throttled_retries = int(self._config.get('rate_limit_max_retries', DEFAULT_THROTTLED_RETRIES))
+        self.oauth_uri = self._config.get('oauth_uri', OAUTH_URI)
+        self.api_uri_v1 = self._config.get('api_uri_v1', API_URI_V1)
+        self.api_uri_v2 = self._config.get('api_uri_v2', API_URI_V2)
+
+    @property
+    def _config(self):
+        return self._kv.get_config()
+
+    @property
+    def _access_token(self):
+        return self._kv.get_access_token()
+
+    @property
+    def _refresh_token(self):
+        return self._kv.get_refresh_token()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        # session has to be created inside running event loop
+        if self._session is None or self._session.closed:
+            pool_size = int(self._config.get('http_pool_size', DEFAULT_POOL_SIZE))
+            connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+            timeout = aiohttp.ClientTimeout(
+                sock_connect=float(self._config.get('http_connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+                sock_read=float(self._config.get('http_read_timeout', DEFAULT_READ_TIMEOUT)))
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=True)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _get_token(self, code = None):
+        if code == None:
+            code = self._code
+        request = {"grant_type": "authorization_code",
+            "redirect_uri": self._redirect_uri,
+            "code": code}
+        return await self.post_request(self.oauth_uri, request, 'basic')
+
+    async def _do_token_refresh(self):
+        request = {"grant_type": "refresh_token",
+            "refresh_token": self._refresh_token}
+        return await self.post_request(self.oauth_uri, request, 'basic')
+
+    async def _auto_refresh_token(self):
+        code, content = await self._do_token_refresh()
+        if code == 200:
+            self._kv.update_token(json.loads(content))
+            self._failed_auth_counter = 0
+        else:
+            logging.error(f"Token autorefresh failed with code: {code} Error: {content}")
+            self._failed_auth_counter = None
+        self._metrics.record_refresh(self._failed_auth_counter == 0)
+        return self._failed_auth_counter == 0
+
+    async def _refresh_after_unauthorized(self, used_access_token):
+        """ Refresh token once for all tasks, threads and processes sharing token file, returns True when request should be sent again
+        """
+        async with self._refresh_lock:
+            # file lock can be held by other process, wait for it outside of event loop
+            lock_file = await asyncio.to_thread(self._kv.acquire_token_lock)
+            try:
+                if self._access_token != used_access_token:
+                    return True
+                if not self._autorefresh_is_enabled():
+                    return False
+                return await self._auto_refresh_token()
+            finally:
+                self._kv.release_token_lock(lock_file)
+
+    def _token_expires_soon(self):
+        expires_at, expires_in = self._kv.get_token_expiry()
+        if expires_at is None:
+            return False
+        return time.time() >= expires_at - min(self._token_refresh_margin, expires_in / 2)
+
+    async def _current_access_token(self):
+        access_token = self._access_token
+        if self._token_autorefresh and self._autorefresh_is_enabled() and self._token_expires_soon():
+            logging.debug('Access token is about to expire, refreshing it')
+            await self._refresh_after_unauthorized(access_token)
+            access_token = self._access_token
+        return access_token
+
+    @staticmethod
+    def _text(code, content):
+        # answers cached by sync client are kept as bytes
+        return (code, content.decode('utf-8') if isinstance(content, bytes) else content)
+
+    def _autorefresh_is_enabled(self):
+        return self._token_autorefresh and self._failed_auth_counter == 0
+
+    async def _send(self, method, uri, **kwargs):
+        session = self._get_session()
+        throttled = 0
+        attempt = 0
+        endpoint = endpoint_name(method, uri)
+        sent = body_size(kwargs.get('data'))
+        while True:
+            wait = self._limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._retry_policy.on_request()
+            start = time.perf_counter()
+            try:
+                async with session.request(method, uri, **kwargs) as response:
+                    code = response.status
+                    body = await response.read()
+                    headers = response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self._metrics.record_request(endpoint, None, time.perf_counter() - start, sent)
+                if not self._retry_policy.should_retry_exception(method, e, attempt):
+                    raise
+                delay = self._retry_policy.backoff(attempt)
+                attempt += 1
+                self._metrics.record_retry(endpoint, 'exception')
+                logging.warning(f'{method} {uri} failed with {e!r}, retry {attempt} in {delay:.2f}s')
+                await asyncio.sleep(delay)
+                continue
+            self._metrics.record_request(endpoint, code, time.perf_counter() - start, sent, len(body))
+            content = body.decode('utf-8')
+            if self._limiter.on_response(code, headers):
+                throttled += 1
+                if throttled > self._throttled_retries:
+                    logging.warning(f'Request to {uri} still throttled after {throttled} attempts')
+                    return (code, content, headers)
+                self._metrics.record_retry(endpoint, 'throttled')
+                logging.debug(f'Request to {uri} throttled, queued again')
+                continue
+            if self._retry_policy.should_retry_status(method, code, attempt):
+                delay = self._retry_policy.backoff(attempt)
+                attempt += 1
+                self._metrics.record_retry(endpoint, 'status')
+                logging.warning(f'{method} {uri} answered {code}, retry {attempt} in {delay:.2f}s')
+                await asyncio.sleep(delay)
+                continue
+            return (code, content, headers)
+
+    async def post_request(self, uri, data, auth, retry_unauthorized = True):
+        access_token = await self._current_access_token() if auth != 'basic' else None
+        if auth == 'basic':
+            credentials = base64.b64encode(f"{self._config['client_id']}:{self._config['client_secret']}".encode('utf-8')).decode('ascii')
+            kwargs = {"headers": {"Authorization": f"Basic {credentials}"}}
+        else:
+            kwargs = {"headers": {"Authorization": f"Bearer {access_token}", "Content-type": "application/json"}}
+        code, content, _ = await self._send('POST', uri, data = data, **kwargs)
+        if int(code) == 401 and auth != 'basic' and retry_unauthorized and self._token_autorefresh:
+            logging.debug(f'Possible token expiry, triggering  autorefresh')
+            if await self._refresh_after_unauthorized(access_token):
+                code, content = await self.post_request(uri, data, auth, retry_unauthorized = False)
+        if self._cache is not None and auth != 'basic':
+            self._cache.invalidate(uri)
+        return (code, content)
+
+    async def get_request(self, uri, get_params_dict = None, retry_unauthorized = True):
+        access_token = await self._current_access_token()
+        headers = {"Authorization": f"Bearer {access_token}"}
+        cache_key = entry = None
+        if self._cache is not None:
+            # params are part of uri in cache key, same as in sync client
+            cache_key = self._cache.key(uri + ("?" + urllib.parse.urlencode(get_params_dict) if get_params_dict else ""), access_token)
+            entry, fresh = self._cache.lookup(cache_key)
+            if fresh:
+                return self._text(*self._cache.hit(entry))
+            headers.update(self._cache.conditional_headers(entry))
+        code, content, response_headers = await self._send('GET', uri, headers=headers, params=get_params_dict)
+        if self._cache is not None:
+            code, content = self._text(*self._cache.answer(cache_key, uri, entry, code, content, response_headers))
+        if int(code) == 401 and retry_unauthorized and self._token_autorefresh:
+            logging.debug(f'Possible token expiry, triggering  autorefresh')
+            if await self._refresh_after_unauthorized(access_token):
+                code, content = await self.get_request(uri, get_params_dict, retry_unauthorized = False)
+        return (code, content)
+
+
+class AsyncPipedriveUser:
+
+    def __init__(self, restapi = None):
+        self._username = None
+        self._restapi = restapi or AsyncPipedriveREST()
+
+    async def whoami(self):
+        request = self._restapi.api_uri_v1 + "users/me"
+        return await self._restapi.get_request(request)
+
+
+class AsyncPipedriveDeals:
+
+    def __init__(self, restapi = None):
+        self._restapi = restapi or AsyncPipedriveREST()
+
+    async def get_all_deals(self, params_dict = None):
+        request = self._restapi.api_uri_v2 + "deals"
+        return await self._restapi.get_request(request, params_dict)
+
+    def iter_deals(self, params_dict = None, limit = DEFAULT_PAGE_LIMIT, fields = None):
+        """ Async generator of deal dicts following v2 cursor pagination, params as built by PipedriveDeals.query
+        """
+        if fields:
+            fields = tuple(fields)
+            return self._iter_pages(params_dict, limit, lambda item: {field: item.get(field) for field in fields})
+        return self._iter_pages(params_dict, limit, dict)
+
+    def iter_deal_models(self, params_dict = None, limit = DEFAULT_PAGE_LIMIT):
+        """ Async generator of compact Deal records
+        """
+        return self._iter_pages(params_dict, limit, Deal.from_dict)
+
+    async def _iter_pages(self, params_dict, limit, factory):
+        request = self._restapi.api_uri_v2 + "deals"
+        params = dict(params_dict or {})
+        params['limit'] = limit
+        backend = self._restapi._config.get('json_backend')
+        while True:
+            request_code, request_content = await self._restapi.get_request(request, params)
+            if request_code != 200:
+                raise PipedriveAPIError(request_code, request_content)
+            page = JsonPage(request_content, factory, backend)
+            del request_content
+            for deal in page:
+                yield deal
+            next_cursor = (page.fields.get('additional_data') or {}).get('next_cursor')
+            if not next_cursor:
+                break
+            params['cursor'] = next_cursor
+
+    async def find_deal(self, params_dict):
+        request = self._restapi.api_uri_v2 + "deals/search"
+        return await self._restapi.get_request(request, params_dict)
+
+    async def add_deal(self, params_dict):
+        request = self._restapi.api_uri_v2 + "deals"
+        data = json.dumps(params_dict)
+        return await self._restapi.post_request(request, data, 'oauth')
+
+    async def add_deals(self, records, concurrency = DEFAULT_CONCURRENCY):
+        """ Async generator of (record, result) pairs in input order, at most concurrency add_deal requests run at once
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def add_one(record):
+            async with semaphore:
+                try:
+                    return await self.add_deal(record)
+                except Exception as e:
+                    logging.debug(f"add_deal raised {e!r}", exc_info=True)
+                    return e
+
+        # bounded read-ahead keeps memory flat for big record streams
+        in_flight = deque()
+        try:
+            for record in records:
+                in_flight.append((record, asyncio.ensure_future(add_one(record))))
+                if len(in_flight) >= concurrency * 4:
+                    done_record, task = in_flight.popleft()
+                    yield done_record, await task
+            while in_flight:
+                done_record, task = in_flight.popleft()
+                yield done_record, await task
+        finally:
+            # consumer stopped early or records raised, requests not yet sent are dropped
+            for _, task in in_flight:
+                task.cancel()
+            if in_flight:
+                await asyncio.gather(*(task for _, task in in_flight), return_exceptions=True)
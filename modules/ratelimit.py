@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['RateLimiter','SharedRateLimiter']
+
+DEFAULT_RATE = 10.0
+DEFAULT_BURST = 20
+# requests kept in reserve from server side budget reported in headers
+DEFAULT_SAFETY_MARGIN = 2
+# rate is never lowered below this value after 429 answers
+MIN_RATE = 0.5
+# part of configured rate given back after every successful answer
+RATE_RECOVERY = 0.05
+DEFAULT_RETRY_AFTER = 2.0
+
+
+def _header_number(headers, name):
+    value = headers.get(name)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class RateLimiter:
+    """ Token bucket shared by all threads and tasks of the process
+
+    Callers reserve a slot before each request and sleep returned delay, so when budget is
+    exhausted requests queue up in order instead of failing. Bucket is adjusted from
+    x-ratelimit-remaining/x-ratelimit-reset headers and Retry-After of 429 answers.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, rate = DEFAULT_RATE, burst = DEFAULT_BURST, safety_margin = DEFAULT_SAFETY_MARGIN):
+        self._max_rate = float(rate)
+        self._rate = float(rate)
+        self._capacity = float(burst)
+        self._tokens = float(burst)
+        self._safety_margin = safety_margin
+        self._updated = self._clock()
+        self._blocked_until = 0.0
+        self._last_throttled = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _clock():
+        return time.monotonic()
+
+    def _locked(self):
+        """ Context of one bucket update, shared limiter loads and stores bucket state in it
+        """
+        return self._lock
+
+    @classmethod
+    def get_limiter(cls, config = None):
+        """ Return process wide limiter, creating it from config on first use
+
+        With rate_limit_shared_file in config bucket is shared by all processes using same file.
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    config = config or {}
+                    kwargs = dict(
+                        rate = float(config.get('rate_limit_per_second', DEFAULT_RATE)),
+                        burst = int(config.get('rate_limit_burst', DEFAULT_BURST)),
+                        safety_margin = int(config.get('rate_limit_safety_margin', DEFAULT_SAFETY_MARGIN)))
+                    if config.get('rate_limit_shared_file'):
+                        cls._instance = SharedRateLimiter(config['rate_limit_shared_file'], **kwargs)
+                    else:
+                        cls._instance = cls(**kwargs)
+        return cls._instance
+
+    @classmethod
+    def reset_limiter(cls):
+        with cls._instance_lock:
+            cls._instance = None
+
+    def _refill(self, now):
+        # during pause _updated points to its end, no tokens are produced before it
+        if now > self._updated:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+
+    def _pause(self, until):
+        self._blocked_until = max(self._blocked_until, until)
+        self._tokens = min(self._tokens, 0.0)
+        self._updated = max(self._updated, self._blocked_until)
+
+    def reserve(self):
+        """ Take one request slot, return number of seconds caller has to wait before sending
+        """
+        with self._locked():
+            now = self._clock()
+            self._refill(now)
+            # negative balance is a queue of already promised slots, spread at current rate
+            # from the end of pause so queued requests do not hit the API all at once
+            self._tokens -= 1
+            wait = max(0.0, self._blocked_until - now)
+            if self._tokens < 0:
+                wait += -self._tokens / self._rate
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_response(self, code, headers):
+        """ Adjust budget from answer, returns True when request was throttled and has to be sent again
+        """
+        throttled = int(code) == 429
+        remaining = _header_number(headers, 'x-ratelimit-remaining')
+        reset = _header_number(headers, 'x-ratelimit-reset')
+        retry_after = _header_number(headers, 'retry-after')
+        with self._locked():
+            now = self._clock()
+            self._refill(now)
+            if remaining is not None:
+                # never plan more requests than server still accepts in current window
+                self._tokens = min(self._tokens, max(0.0, remaining - self._safety_margin))
+                if remaining <= self._safety_margin and reset:
+                    self._pause(now + reset)
+            if throttled:
+                delay = retry_after or reset or DEFAULT_RETRY_AFTER
+                self._pause(now + delay)
+                # burst of 429 answers for requests sent together lowers rate only once
+                if now - self._last_throttled >= delay:
+                    self._rate = max(MIN_RATE, self._rate / 2)
+                self._last_throttled = now
+                logging.debug(f"Rate limited by API, pausing {delay}s, rate lowered to {self._rate}/s")
+            elif self._rate < self._max_rate:
+                # additive increase back to configured rate after throttling
+                self._rate = min(self._max_rate, self._rate + self._max_rate * RATE_RECOVERY)
+        return throttled
+
+
+class SharedRateLimiter(RateLimiter):
+    """ Token bucket kept in a file, shared by all processes on the host using the same file
+
+    Every reservation and answer updates bucket under exclusive lock of the file, so parallel
+    publish tasks together stay within one API budget. Wall clock is used, as monotonic clock
+    is not comparable between processes.
+    """
+
+    _STATE = ('_rate', '_tokens', '_updated', '_blocked_until', '_last_throttled')
+
+    def __init__(self, file_name, rate = DEFAULT_RATE, burst = DEFAULT_BURST, safety_margin = DEFAULT_SAFETY_MARGIN):
+        super().__init__(rate, burst, safety_margin)
+        self._file_name = file_name
+        fd = os.open(file_name, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, 'r+')
+
+    @staticmethod
+    def _clock():
+        return time.time()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                self._load()
+                yield
+                self._store()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _load(self):
+        self._file.seek(0)
+        content = self._file.read()
+        if not content:
+            # first process creates bucket with its own settings
+            return
+        try:
+            state = json.loads(content)
+        except ValueError:
+            logging.warning(f"Shared rate limit state {self._file_name} is damaged, starting with full bucket")
+            return
+        for name in self._STATE:
+            if name in state:
+                setattr(self, name, float(state[name]))
+        # rate changed by configuration is not overridden by stale shared state
+        self._rate = min(self._rate, self._max_rate)
+
+    def _store(self):
+        self._file.seek(0)
+        self._file.truncate()
+        self._file.write(json.dumps({name: getattr(self, name) for name in self._STATE}))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
@@ -0,0 +1,135 @@
+import sys
+import random
+import asyncio
+import logging
+import threading
+import requests
+from urllib3.exceptions import NewConnectionError
+
+__all__ = ['RetryPolicy']
+
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+# every request adds this part of a retry to the budget, so retries stay below 10% of traffic
+DEFAULT_BUDGET_RATIO = 0.1
+# retries available before any request was sent, covers failures at start of run
+DEFAULT_BUDGET_MIN = 10
+# budget saved from successful traffic is capped to its share of this many requests
+BUDGET_WINDOW = 1000
+RETRYABLE_STATUS_CODES = (500, 502, 503, 504)
+# methods which can be repeated without changing result, PATCH of deal sets the same fields again
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE', 'PATCH')
+
+# failure classes
+NOT_SENT = 'not_sent'
+AMBIGUOUS = 'ambiguous'
+
+
+def classify_exception(exc):
+    """ Return NOT_SENT when request surely did not reach server, AMBIGUOUS when it might have, None when not retryable
+    """
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return NOT_SENT
+    if isinstance(exc, requests.exceptions.ConnectionError):
+        reason = getattr(exc.args[0], 'reason', None) if exc.args else None
+        if isinstance(reason, NewConnectionError):
+            return NOT_SENT
+        return AMBIGUOUS
+    if isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError)):
+        return AMBIGUOUS
+    # aiohttp exceptions come only from async client, which has imported aiohttp already,
+    # so sync commands do not pay for importing it
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is not None:
+        if isinstance(exc, aiohttp.ClientConnectorError):
+            return NOT_SENT
+        if isinstance(exc, (aiohttp.ServerDisconnectedError, aiohttp.ServerTimeoutError, aiohttp.ClientOSError, aiohttp.ClientPayloadError)):
+            return AMBIGUOUS
+    if isinstance(exc, asyncio.TimeoutError):
+        return AMBIGUOUS
+    return None
+
+
+class RetryPolicy:
+    """ Decides which failed requests are sent again and how long to wait before it
+
+    Backoff is exponential with full jitter. Retries of the whole process are limited by
+    a budget refilled by sent requests, so an API outage does not multiply traffic.
+    Non idempotent requests are repeated only when they surely did not reach the server.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_retries = DEFAULT_MAX_RETRIES, backoff_base = DEFAULT_BACKOFF_BASE, backoff_max = DEFAULT_BACKOFF_MAX,
+            budget_ratio = DEFAULT_BUDGET_RATIO, budget_min = DEFAULT_BUDGET_MIN, retryable_status_codes = RETRYABLE_STATUS_CODES):
+        self.max_retries = int(max_retries)
+        self._backoff_base = float(backoff_base)
+        self._backoff_max = float(backoff_max)
+        self._budget_ratio = float(budget_ratio)
+        self._budget_max = float(budget_min) + self._budget_ratio * BUDGET_WINDOW
+        self._budget = float(budget_min)
+        self._retryable_status_codes = tuple(retryable_status_codes)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_policy(cls, config = None):
+        """ Return process wide policy, creating it from config on first use
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    config = config or {}
+                    cls._instance = cls(
+                        max_retries = int(config.get('retry_max_retries', DEFAULT_MAX_RETRIES)),
+                        backoff_base = float(config.get('retry_backoff_base', DEFAULT_BACKOFF_BASE)),
+                        backoff_max = float(config.get('retry_backoff_max', DEFAULT_BACKOFF_MAX)),
+                        budget_ratio = float(config.get('retry_budget_ratio', DEFAULT_BUDGET_RATIO)),
+                        budget_min = int(config.get('retry_budget_min', DEFAULT_BUDGET_MIN)),
+                        retryable_status_codes = config.get('retry_status_codes', RETRYABLE_STATUS_CODES))
+        return cls._instance
+
+    @classmethod
+    def reset_policy(cls):
+        with cls._instance_lock:
+            cls._instance = None
+
+    def is_idempotent(self, method):
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def backoff(self, attempt):
+        """ Seconds to wait before retry number attempt (counted from 0)
+        """
+        return random.uniform(0, min(self._backoff_max, self._backoff_base * (2 ** attempt)))
+
+    def on_request(self):
+        with self._lock:
+            self._budget = min(self._budget_max, self._budget + self._budget_ratio)
+
+    def _spend_budget(self):
+        with self._lock:
+            if self._budget < 1:
+                return False
+            self._budget -= 1
+            return True
+
+    def should_retry_status(self, method, code, attempt):
+        # 5xx of non idempotent request can mean it was processed, it is never repeated
+        if attempt >= self.max_retries or int(code) not in self._retryable_status_codes:
+            return False
+        if not self.is_idempotent(method):
+            return False
+        return self._spend_budget()
+
+    def should_retry_exception(self, method, exc, attempt):
+        if attempt >= self.max_retries:
+            return False
+        failure = classify_exception(exc)
+        if failure is None:
+            return False
+        if failure == AMBIGUOUS and not self.is_idempotent(method):
+            logging.warning(f"{method} request failed with {exc!r} after it may have reached server, not repeating it")
+            return False
+        return self._spend_budget()
+
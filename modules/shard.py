@@ -0,0 +1,49 @@
+import hashlib
+
+__all__ = ['ShardSource']
+
+
+def shard_of(value, shards):
+    """ Shard number of value, stable across processes and hosts unlike built-in hash()
+
+    Same as shard_condition computed by PostgreSQL: first 32 bits of md5 modulo shards.
+    """
+    digest = hashlib.md5(str(value).encode('utf-8')).hexdigest()
+    return int(digest[:8], 16) % shards
+
+
+def shard_condition(expression, shard, shards):
+    """ PostgreSQL WHERE condition selecting rows of shard, so every task reads only its own rows
+    """
+    return f"('x' || lpad(substr(md5(({expression})::text), 1, 8), 16, '0'))::bit(64)::bigint % {int(shards)} = {int(shard)}"
+
+
+def parse_shard(text):
+    """ Parse 'index/count' as (index, count), index counts from 0
+    """
+    try:
+        shard, shards = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise ValueError(f"shard '{text}' is not in index/count form, e.g. 0/4")
+    if not 0 <= shard < shards:
+        raise ValueError(f"shard index {shard} is out of 0..{shards - 1}")
+    return shard, shards
+
+
+class ShardSource:
+    """ Rows of source whose key column belongs to shard, row numbers of source are kept
+
+    Sharding by sync key keeps all rows of one deal in one shard, so parallel shards never
+    create the same deal twice.
+    """
+
+    def __init__(self, source, shard, shards, key = 'title'):
+        self._source = source
+        self._shard = shard
+        self._shards = shards
+        self._key = key
+
+    def __iter__(self):
+        for line_number, row in self._source:
+            if shard_of(row.get(self._key), self._shards) == self._shard:
+                yield line_number, row
@@ -0,0 +1,126 @@
+import json
+import hashlib
+import logging
+import threading
+
+from modules.pipedriveapi import DEAL_STATUSES
+
+__all__ = ['DealIndex','DealSync']
+
+DEFAULT_SYNC_KEY = 'title'
+DEFAULT_SYNC_FIELDS = ('title', 'status', 'value')
+
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+DUPLICATE = 'duplicate'
+FAILED = 'failed'
+
+
+def _normalize(value):
+    # csv gives strings, API gives numbers, both have to hash the same
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def deal_hash(deal, fields):
+    """ Content hash of deal fields that are synced
+    """
+    content = json.dumps([_normalize(deal.get(field)) for field in fields], sort_keys=True, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class DealIndex:
+    """ Local index of existing deals: natural key value -> (deal id, content hash)
+    """
+
+    def __init__(self, key = DEFAULT_SYNC_KEY, fields = DEFAULT_SYNC_FIELDS):
+        self.key = key
+        self.fields = tuple(fields)
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def key_of(self, deal):
+        return _normalize(deal.get(self.key))
+
+    def build(self, deals):
+        """ Fill index from stream of deals as returned by API
+        """
+        duplicates = 0
+        for deal in deals:
+            key = self.key_of(deal)
+            if key is None:
+                continue
+            if key in self._index:
+                duplicates += 1
+            self._index[key] = (deal['id'], deal_hash(deal, self.fields))
+        if duplicates:
+            logging.warning(f"{duplicates} existing deals share '{self.key}' value with other deal, last one is synced")
+        logging.info(f"Indexed {len(self._index)} existing deals by '{self.key}'")
+        return self
+
+    def get(self, key):
+        with self._lock:
+            return self._index.get(key)
+
+    def set(self, key, deal_id, content_hash):
+        with self._lock:
+            self._index[key] = (deal_id, content_hash)
+
+
+class DealSync:
+    """ Creates new deals, updates changed ones and skips unchanged ones using DealIndex built once per run
+    """
+
+    def __init__(self, deal_api, key = DEFAULT_SYNC_KEY, fields = DEFAULT_SYNC_FIELDS):
+        self._deal_api = deal_api
+        self.index = DealIndex(key, fields)
+        self._seen = set()
+        self._seen_lock = threading.Lock()
+
+    def build_index(self):
+        # compact records, index of big account is built without holding full deal dicts,
+        # deleted deals are listed only when asked for and returned orders are synced as deleted
+        self.index.build(self._deal_api.iter_deal_models(self._deal_api.query(status=DEAL_STATUSES)))
+        return self
+
+    def _first_occurrence(self, key):
+        with self._seen_lock:
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+            return True
+
+    def sync_record(self, record):
+        """ Bring one record to Pipedrive, returns (action, code, content), code and content are None when nothing was sent
+        """
+        key = self.index.key_of(record)
+        # rows sharing key within one run would race for the same deal
+        if not self._first_occurrence(key):
+            return DUPLICATE, None, None
+        content_hash = deal_hash(record, self.index.fields)
+        existing = self.index.get(key)
+        if existing is None:
+            code, content = self._deal_api.add_deal(record)
+            if code == 200:
+                self.index.set(key, json.loads(content)['data']['id'], content_hash)
+                return CREATED, code, content
+            return FAILED, code, content
+        deal_id, existing_hash = existing
+        if existing_hash == content_hash:
+            return UNCHANGED, None, None
+        code, content = self._deal_api.update_deal(deal_id, record)
+        if code == 200:
+            self.index.set(key, deal_id, content_hash)
+            return UPDATED, code, content
+        return FAILED, code, content
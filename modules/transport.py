@@ -0,0 +1,64 @@
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+__all__ = ['PipedriveTransport']
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 60
+
+
+class PipedriveTransport:
+    """ Keep-alive pooled HTTP transport, one instance is shared by all clients of the process
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, pool_size = DEFAULT_POOL_SIZE, connect_timeout = DEFAULT_CONNECT_TIMEOUT, read_timeout = DEFAULT_READ_TIMEOUT):
+        self._timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        # pool_block keeps number of open sockets per host at pool_size even with more threads
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+        self._session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+        logging.debug(f"HTTP transport created with pool size {pool_size} and timeouts {self._timeout}")
+
+    @classmethod
+    def get_transport(cls, config = None):
+        """ Return process wide transport, creating it from config on first use
+        """
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    config = config or {}
+                    cls._instance = cls(
+                        pool_size = int(config.get('http_pool_size', DEFAULT_POOL_SIZE)),
+                        connect_timeout = float(config.get('http_connect_timeout', DEFAULT_CONNECT_TIMEOUT)),
+                        read_timeout = float(config.get('http_read_timeout', DEFAULT_READ_TIMEOUT)))
+        return cls._instance
+
+    @classmethod
+    def reset_transport(cls):
+        """ Close shared transport, next get_transport call creates new one
+        """
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.close()
+            cls._instance = None
+
+    def request(self, method, uri, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        return self._session.request(method, uri, **kwargs)
+
+    def get(self, uri, **kwargs):
+        return self.request('GET', uri, **kwargs)
+
+    def post(self, uri, **kwargs):
+        return self.request('POST', uri, **kwargs)
+
+    def close(self):
+        self._session.close()
@@ -0,0 +1,383 @@
+import sys
+import hmac
+import json
+import time
+import queue
+import base64
+import sqlite3
+import hashlib
+import logging
+import argparse
+import datetime
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from argparse import RawTextHelpFormatter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from modules.keyvault import KeyVaultStorage
+
+__all__ = ['WebhookCLI','WebhookReceiver','WebhookStore']
+
+DEFAULT_WEBHOOK_STORE = 'webhooks.sqlite'
+DEFAULT_WEBHOOK_PATH = '/webhooks/pipedrive'
+DEFAULT_WEBHOOK_PORT = 8080
+# events are written in one transaction per batch, at latest after flush interval
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 0.5
+# keys of recent events kept in memory, older duplicates are caught by unique key in store
+DEFAULT_DEDUPE_WINDOW = 100000
+WEBHOOK_ENTITIES = ('deal',)
+
+
+def event_key(payload):
+    """ Identity of webhook event, same for every delivery attempt of one event
+    """
+    meta = payload.get('meta') or {}
+    if str(meta.get('version')) == '2.0' and meta.get('id'):
+        return str(meta['id'])
+    # v1 meta has no event id, retried deliveries differ only in retry counter
+    content = {name: value for name, value in payload.items() if name != 'retry'}
+    return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def normalize_event(payload):
+    """ Common fields of v1 and v2 webhook payloads: entity, action, entity_id, data, previous
+    """
+    meta = payload.get('meta') or {}
+    v2 = str(meta.get('version')) == '2.0'
+    data = payload.get('data') if v2 else payload.get('current')
+    entity_id = meta.get('entity_id') if v2 else meta.get('id')
+    if entity_id is None and data:
+        entity_id = data.get('id')
+    return {"entity": meta.get('entity') if v2 else meta.get('object'),
+        "action": meta.get('action'),
+        "entity_id": int(entity_id) if entity_id is not None else None,
+        "timestamp": meta.get('timestamp'),
+        "data": data,
+        "previous": payload.get('previous')}
+
+
+class WebhookStore:
+    """ SQLite store of received webhook events with positions of named consumers
+
+    Events are unique by event key, so redelivered events are stored once. Consumers read
+    events in receive order and their position moves only after a batch was processed.
+    """
+
+    def __init__(self, file_name = DEFAULT_WEBHOOK_STORE):
+        self._file_name = file_name
+        self._db = sqlite3.connect(file_name, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS webhook_events (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_key TEXT NOT NULL UNIQUE,
+            entity TEXT,
+            action TEXT,
+            entity_id INTEGER,
+            received_at TEXT NOT NULL,
+            payload TEXT NOT NULL)""")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS webhook_consumers (
+            consumer TEXT PRIMARY KEY,
+            position INTEGER NOT NULL)""")
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def add(self, payloads):
+        """ Store batch of payloads in one transaction, returns number of new events
+        """
+        received_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = []
+        for payload in payloads:
+            event = normalize_event(payload)
+            rows.append((event_key(payload), event['entity'], event['action'], event['entity_id'], received_at, json.dumps(payload)))
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany("""INSERT OR IGNORE INTO webhook_events (event_key, entity, action, entity_id, received_at, payload)
+                VALUES (?, ?, ?, ?, ?, ?)""", rows)
+            self._db.commit()
+            return self._db.total_changes - before
+
+    def count(self):
+        with self._lock:
+            return self._db.execute("SELECT count(*) FROM webhook_events").fetchone()[0]
+
+    def position(self, consumer):
+        with self._lock:
+            row = self._db.execute("SELECT position FROM webhook_consumers WHERE consumer = ?", (consumer,)).fetchone()
+        return row[0] if row else 0
+
+    def _commit_position(self, consumer, position):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO webhook_consumers (consumer, position) VALUES (?, ?)", (consumer, position))
+            self._db.commit()
+
+    def consume(self, consumer = 'default', batch_size = DEFAULT_BATCH_SIZE, follow = False, poll_interval = 1.0, stop = None):
+        """ Yield events not yet processed by consumer, oldest first
+
+        Position of consumer moves after whole batch was yielded, events of batch interrupted by
+        error are yielded again to next consume. With follow new events are awaited until stop is set.
+        """
+        position = self.position(consumer)
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT seq, event_key, received_at, payload FROM webhook_events WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (position, batch_size)).fetchall()
+            for seq, key, received_at, payload in rows:
+                event = normalize_event(json.loads(payload))
+                event.update(seq=seq, key=key, received_at=received_at)
+                yield event
+            if rows:
+                position = rows[-1][0]
+                self._commit_position(consumer, position)
+                continue
+            if not follow or (stop is not None and stop.is_set()):
+                break
+            if stop is not None:
+                stop.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # answer right away on kept-alive connection, otherwise delayed ACK holds every delivery
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug("Webhook receiver: " + format % args)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if self.path.split('?', 1)[0] != self.server.receiver.path:
+            code, answer = 404, {"success": False, "error": "unknown path"}
+        else:
+            code, answer = self.server.receiver.handle(self.headers, body)
+        data = json.dumps(answer).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class WebhookReceiver:
+    """ Local HTTP receiver of Pipedrive deal webhooks
+
+    Requests are checked against basic auth configured for webhook in Pipedrive, duplicates
+    of recent events are dropped in memory and accepted events are queued to writer thread,
+    which stores them in batches, so answer to Pipedrive does not wait for disk.
+    """
+
+    def __init__(self, store, host = '127.0.0.1', port = DEFAULT_WEBHOOK_PORT, user = None, password = None,
+            path = DEFAULT_WEBHOOK_PATH, batch_size = DEFAULT_BATCH_SIZE, flush_interval = DEFAULT_FLUSH_INTERVAL,
+            dedupe_window = DEFAULT_DEDUPE_WINDOW, record_file = None):
+        self._store = store
+        self.path = path
+        self._authorization = None
+        if user or password:
+            self._authorization = "Basic " + base64.b64encode(f"{user or ''}:{password or ''}".encode('utf-8')).decode()
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._dedupe_window = dedupe_window
+        self._recent = OrderedDict()
+        self._record_file = open(record_file, 'a') if record_file else None
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._writer = None
+        self._server = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self._server.daemon_threads = True
+        self._server.receiver = self
+        self._thread = None
+        self.stats = {"received": 0, "stored": 0, "duplicates": 0, "rejected": 0, "ignored": 0}
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def _count(self, name, value = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _is_duplicate(self, key):
+        with self._lock:
+            if key in self._recent:
+                return True
+            self._recent[key] = None
+            if len(self._recent) > self._dedupe_window:
+                self._recent.popitem(last=False)
+            return False
+
+    def handle(self, headers, body):
+        """ Check and queue one delivery, returns (code, answer) sent back to Pipedrive
+        """
+        self._count('received')
+        if self._authorization is not None and not hmac.compare_digest(headers.get('Authorization') or '', self._authorization):
+            self._count('rejected')
+            return 401, {"success": False, "error": "unauthorized"}
+        try:
+            payload = json.loads(body)
+            event = normalize_event(payload)
+        except (ValueError, TypeError, AttributeError):
+            self._count('rejected')
+            return 400, {"success": False, "error": "invalid payload"}
+        # other entities are acknowledged, so Pipedrive does not retry them
+        if event['entity'] not in WEBHOOK_ENTITIES:
+            self._count('ignored')
+            return 200, {"success": True}
+        if self._is_duplicate(event_key(payload)):
+            self._count('duplicates')
+            return 200, {"success": True}
+        self._queue.put(payload)
+        return 200, {"success": True}
+
+    def _write_loop(self):
+        running = True
+        while running:
+            batch = []
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                try:
+                    payload = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if payload is None:
+                    running = False
+                    break
+                batch.append(payload)
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        stored = self._store.add(batch)
+        self._count('stored', stored)
+        self._count('duplicates', len(batch) - stored)
+        if self._record_file is not None:
+            for payload in batch:
+                self._record_file.write(json.dumps(payload) + "\n")
+            self._record_file.flush()
+        logging.debug(f"Stored {stored} of {len(batch)} webhook events")
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write_loop, name='webhook-writer', daemon=True)
+        self._writer.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='webhook-receiver', daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._writer = threading.Thread(target=self._write_loop, name='webhook-writer', daemon=True)
+        self._writer.start()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._stop_writer()
+
+    def _stop_writer(self):
+        # queued events are written before writer exits
+        self._queue.put(None)
+        self._writer.join()
+        if self._record_file is not None:
+            self._record_file.close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._stop_writer()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+class WebhookCLI:
+    def __init__(self):
+        self._config = KeyVaultStorage().get_config()
+
+    def serve_webhooks(self):
+        """ Run webhook receiver
+        """
+
+        example = '''Example:
+        pipedrive.py serve_webhooks
+        pipedrive.py serve_webhooks --host 0.0.0.0 --port 8080 --store webhooks.sqlite --record recorded.ndjson
+                 '''
+        # command arguments
+        parser = argparse.ArgumentParser(description="Receive Pipedrive deal webhooks to local store", epilog=example, formatter_class=RawTextHelpFormatter)
+        parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+        parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+        parser.add_argument('--port', help='Port to listen on, webhook_port of config.json by default', type=int, default=None)
+        parser.add_argument('-s', '--store', help='SQLite file of events, webhook_store of config.json by default', default=None)
+        parser.add_argument('--record', help='Append received payloads to NDJSON file for replay', default=None)
+        args = parser.parse_args(sys.argv[2:])
+
+        store = WebhookStore(args.store or self._config.get('webhook_store', DEFAULT_WEBHOOK_STORE))
+        receiver = WebhookReceiver(store, args.host, args.port or self._config.get('webhook_port', DEFAULT_WEBHOOK_PORT),
+            self._config.get('webhook_user'), self._config.get('webhook_password'), record_file=args.record)
+        if not self._config.get('webhook_user'):
+            logging.warning("webhook_user is not set in config.json, requests are not authenticated")
+        logging.info(f"Receiving webhooks on {receiver.url}")
+        try:
+            receiver.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logging.info("Webhooks " + ", ".join(f"{name} {count}" for name, count in receiver.stats.items()))
+            store.close()
+
+    def replay_webhooks(self):
+        """ Replay recorded webhook payloads
+        """
+
+        example = '''Example:
+        pipedrive.py replay_webhooks recorded.ndjson
+        pipedrive.py replay_webhooks --url http://127.0.0.1:8080/webhooks/pipedrive recorded.ndjson
+                 '''
+        # command arguments
+        parser = argparse.ArgumentParser(description="Replay recorded payloads into store or to running receiver", epilog=example, formatter_class=RawTextHelpFormatter)
+        parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+        parser.add_argument('-s', '--store', help='SQLite file of events, webhook_store of config.json by default', default=None)
+        parser.add_argument('--url', help='Post payloads to receiver instead of writing store directly', default=None)
+        parser.add_argument('file', help='NDJSON file with one payload per line')
+        args = parser.parse_args(sys.argv[2:])
+
+        with open(args.file) as payload_file:
+            payloads = [json.loads(line) for line in payload_file if line.strip()]
+        if args.url:
+            codes = {}
+            for payload in payloads:
+                code = self._post(args.url, payload)
+                codes[code] = codes.get(code, 0) + 1
+            logging.info(f"Replayed {len(payloads)} payloads to {args.url}: " + ", ".join(f"{code}: {count}" for code, count in sorted(codes.items())))
+            return
+        with WebhookStore(args.store or self._config.get('webhook_store', DEFAULT_WEBHOOK_STORE)) as store:
+            events = [payload for payload in payloads if normalize_event(payload)['entity'] in WEBHOOK_ENTITIES]
+            stored = store.add(events)
+        logging.info(f"Replayed {len(payloads)} payloads, {stored} new events stored")
+
+    def _post(self, url, payload):
+        request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST',
+            headers={'Content-Type': 'application/json'})
+        if self._config.get('webhook_user'):
+            credentials = f"{self._config['webhook_user']}:{self._config.get('webhook_password', '')}"
+            request.add_header('Authorization', "Basic " + base64.b64encode(credentials.encode('utf-8')).decode())
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
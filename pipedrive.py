@@ -4,15 +4,30 @@ import argparse
 import sys
 import datetime
 import os
-
-from modules.pipedriveapi import PipedriveREST, PipedriveCLI
-from modules.keyvault import KeyVaultStorage
-from modules.file_import import FileLoad
+import importlib
 
 # logging format
 FORMAT = '%(asctime)-15s %(levelname)s %(message)s'
 home = os.path.expanduser('~')
 
+
+def dump_metrics(base_name):
+    """ Store request metrics of finished command next to its logfile and log summary
+    """
+    if 'modules.metrics' not in sys.modules:
+        # command did not load API client, nothing was requested
+        return
+    metrics = sys.modules['modules.metrics'].Metrics.get_metrics()
+    if not metrics.snapshot()['endpoints']:
+        return
+    with open(base_name + '.prom', 'w') as prom_file:
+        prom_file.write(metrics.to_prometheus())
+    with open(base_name + '.json', 'w') as json_file:
+        json_file.write(metrics.to_json())
+    for line in metrics.summary():
+        logging.info("Metrics %s" % line)
+    logging.info("Metrics: %s.prom %s.json" % (base_name, base_name))
+
 commands = """
 
 PipedriveCLI admin:
@@ -20,21 +35,145 @@ PipedriveCLI admin:
     refresh_token           request token refresh and store it
     whoami                  request information of token owner
     deals                   list all dealst
+    export                  refresh local deals snapshot
 
 KeyVaultStorage admin:
-    get_auth                Show auth related values
+    show_auth               Show auth related values
     set_auth                Set auth related values
 
+FileLoad:
+    load_file               Load csv file to Pipedrive
+
+WebhookCLI:
+    serve_webhooks          receive deal webhooks to local store
+    replay_webhooks         replay recorded webhook payloads
+
+Daemon:
+    daemon                  serve commands of this directory with warm client
+
 
 """
 
+# handler module is imported only when one of its commands runs, so commands not calling
+# API do not pay for importing requests and HTTP stack
 cmd_handlers = (
-    (('fetch_token', 'refresh_token', 'whoami', 'deals'), PipedriveCLI),
-    (('get_auth', 'set_auth'), KeyVaultStorage),
-    (('load_file'), FileLoad)
+    (('fetch_token', 'refresh_token', 'whoami', 'deals', 'export'), 'modules.pipedriveapi', 'PipedriveCLI'),
+    (('show_auth', 'set_auth'), 'modules.keyvault', 'KeyVaultStorage'),
+    (('load_file',), 'modules.file_import', 'FileLoad'),
+    (('serve_webhooks', 'replay_webhooks'), 'modules.webhooks', 'WebhookCLI')
 )
 
 
+def daemon():
+    """ Serve commands of this directory from one process, or stop daemon serving it
+    """
+    example = '''Example:
+        pipedrive.py daemon &
+        pipedrive.py daemon --stop
+                 '''
+    parser = argparse.ArgumentParser(description="Keep warm client serving pipedrive.py commands over Unix socket",
+        epilog=example, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-v', '--verbose', help='Debug level login to console', action='store_true', default=False)
+    parser.add_argument('--socket', help='Unix socket path, derived from working directory by default', default=None)
+    parser.add_argument('--stop', help='Stop running daemon', action='store_true', default=False)
+    args = parser.parse_args(sys.argv[2:])
+
+    from modules.daemon import CommandDaemon, stop_daemon
+    if args.stop:
+        if not stop_daemon(args.socket):
+            logging.warning("No daemon is running for this directory")
+        return 0
+
+    CommandDaemon(run_forwarded_command, args.socket).serve_forever()
+    return 0
+
+
+def run_forwarded_command(argv):
+    """ Run command sent to daemon, commands that need own process are refused
+    """
+    if argv[1:2] and argv[1] in local_commands:
+        print("Command '%s' runs only in own process" % argv[1])
+        return 1
+    return run_command(argv)
+
+
+# commands never forwarded to daemon
+local_commands = ('daemon', 'serve_webhooks', 'commands')
+
+
+def run_command(argv):
+    """ Run one command in this process, returns exit code
+    """
+    sys.argv = list(argv)
+    command = argv[1]
+
+    # setup logging
+    t = datetime.datetime.now()
+    t = t.strftime("%y%m%d_%H%M%S%f")
+
+    # logfile will be written to users home dir log dir, request metrics next to it
+    lb = '%s/log/%s_%s' % (home, command, t)
+    lf = lb + '.log'
+
+    # create log directory if it doesn't exist
+    if not os.path.exists(os.path.dirname(lf)):
+        os.makedirs(os.path.dirname(lf))
+
+    logFormatter = logging.Formatter(FORMAT)
+    rootLogger = logging.getLogger()
+
+    # to file
+    fileHandler = logging.FileHandler(lf)
+    fileHandler.setFormatter(logFormatter)
+    # into file everitying goes always on debug level
+    fileHandler.setLevel(logging.DEBUG)
+    rootLogger.addHandler(fileHandler)
+
+    # to console
+    consoleHandler = logging.StreamHandler()
+    consoleHandler.setFormatter(logFormatter)
+    # set loglevel for console
+    if '-v' in argv or '--verbose' in argv:
+        consoleHandler.setLevel(logging.DEBUG)
+    else:
+        consoleHandler.setLevel(logging.INFO)
+    rootLogger.addHandler(consoleHandler)
+    # handlers can have messages only if rootlogger has them
+    rootLogger.setLevel(5)
+
+    # run command
+    try:
+        if command == 'daemon':
+            return daemon()
+        c = None
+        command_list = ['daemon']
+        for cmd_names, module_name, class_name in cmd_handlers:
+            if command in cmd_names:
+                handler_class = getattr(importlib.import_module(module_name), class_name)
+                c = handler_class()
+                logging.info("Starting %s" % command)
+                logging.debug("Executed command: %s" % ' '.join(argv))
+                logging.info("Logfile: %s" % lf)
+                try:
+                    getattr(c, command)()
+                finally:
+                    dump_metrics(lb + '_metrics')
+                logging.info("Finished %s" % command)
+                break
+            command_list += cmd_names
+        if command == 'commands':
+            print((" ".join(command_list)))
+        elif not c:
+            print(("Unknown command '%s', use --help for help" % command))
+            return 1
+        return 0
+    finally:
+        # daemon runs many commands, each of them logs to own file
+        for handler in (fileHandler, consoleHandler):
+            rootLogger.removeHandler(handler)
+            handler.close()
+
+
 class PipeDrive(object):
 
     def __init__(self):
@@ -50,57 +189,15 @@ Available commands are:
 
         command = args.command
 
-        # setup logging
-        t = datetime.datetime.now()
-        t = t.strftime("%y%m%d_%H%M%S%f")
-
-        # logfile will be written to users home dir log dir
-        lf = '%s/log/%s_%s.log' % (home, command, t)
-
-        # create log directory if it doesn't exist
-        if not os.path.exists(os.path.dirname(lf)):
-            os.makedirs(os.path.dirname(lf))
-
-        logFormatter = logging.Formatter(FORMAT)
-        rootLogger = logging.getLogger()
-
-        # to file
-        fileHandler = logging.FileHandler(lf)
-        fileHandler.setFormatter(logFormatter)
-        # into file everitying goes always on debug level
-        fileHandler.setLevel(logging.DEBUG)
-        rootLogger.addHandler(fileHandler)
-
-        # to console
-        consoleHandler = logging.StreamHandler()
-        consoleHandler.setFormatter(logFormatter)
-        # set loglevel for console
-        if '-v' in sys.argv or '--verbose' in sys.argv:
-            consoleHandler.setLevel(logging.DEBUG)
-        else:
-            consoleHandler.setLevel(logging.INFO)
-        rootLogger.addHandler(consoleHandler)
-        # handlers can have messages only if rootlogger has them
-        rootLogger.setLevel(5)
-
-        # run command
-        c = None
-        command_list = []
-        for cmd_names, handler_class in cmd_handlers:
-            if command in cmd_names:
-                c = handler_class()
-                logging.info("Starting %s" % command)
-                logging.debug("Executed command: %s" % ' '.join(sys.argv))
-                logging.info("Logfile: %s" % lf)
-                getattr(c, command)()
-                logging.info("Finished %s" % command)
-                break
-            command_list += cmd_names
-        if command == 'commands':
-            print((" ".join(command_list)))
-        elif not c:
-            print(("Unknown command '%s', use --help for help" % command))
-            sys.exit(1)
+        code = None
+        # daemon of this directory runs command with warm client, PIPEDRIVE_NO_DAEMON=1 runs it here
+        if command not in local_commands and not os.environ.get('PIPEDRIVE_NO_DAEMON'):
+            from modules.daemon import forward
+            code = forward(sys.argv)
+        if code is None:
+            code = run_command(sys.argv)
+        if code:
+            sys.exit(code)
 
         return
 
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import keyvault
+from modules.transport import PipedriveTransport
+from modules.ratelimit import RateLimiter
+from modules.retry import RetryPolicy
+from modules.metrics import Metrics
+from modules.cache import ResponseCache
+from modules.mockserver import MockPipedriveServer
+
+CONFIG = {
+    "client_id": "client",
+    "client_secret": "secret",
+    "code": "code",
+    "redirect_uri": "http://localhost/callback",
+    "token_autorefresh": 1,
+    "rate_limit_per_second": 1000,
+    "rate_limit_burst": 1000,
+    "retry_backoff_base": 0.01,
+}
+
+TOKEN = {
+    "access_token": "access-1",
+    "api_domain": "",
+    "expires_in": 3600,
+    "refresh_token": "refresh-1",
+    "scope": "",
+    "token_type": "Bearer",
+}
+
+
+@pytest.fixture
+def vault_dir(tmp_path, monkeypatch):
+    """ Working directory with config.json and token.json, process wide singletons are reset
+    """
+    with open(tmp_path / 'config.json', 'w') as config_file:
+        json.dump(CONFIG, config_file)
+    with open(tmp_path / 'token.json', 'w') as token_file:
+        json.dump(TOKEN, token_file)
+    monkeypatch.chdir(tmp_path)
+    keyvault._file_cache.clear()
+    PipedriveTransport.reset_transport()
+    RateLimiter.reset_limiter()
+    RetryPolicy.reset_policy()
+    Metrics.reset_metrics()
+    ResponseCache.reset_cache()
+    yield tmp_path
+    keyvault._file_cache.clear()
+    PipedriveTransport.reset_transport()
+    RateLimiter.reset_limiter()
+    RetryPolicy.reset_policy()
+    Metrics.reset_metrics()
+    ResponseCache.reset_cache()
+
+
+@pytest.fixture
+def mock_server():
+    with MockPipedriveServer() as server:
+        yield server
+
+
+@pytest.fixture
+def mock_vault_dir(vault_dir, mock_server):
+    """ Working directory with clients configured against local mock server
+    """
+    with open(vault_dir / 'config.json', 'w') as config_file:
+        json.dump(dict(CONFIG, **mock_server.client_config()), config_file)
+    with open(vault_dir / 'token.json', 'w') as token_file:
+        json.dump(mock_server.client_token(), token_file)
+    keyvault._file_cache.clear()
+    return vault_dir
@@ -0,0 +1,65 @@
+import json
+
+from modules.cache import ResponseCache, resource_path
+from modules.pipedriveapi import PipedriveREST, PipedriveDeals, PipedriveUser
+
+
+def enable_cache(vault_dir, **config):
+    with open(vault_dir / 'config.json') as config_file:
+        content = json.load(config_file)
+    content.update(response_cache=1, **config)
+    with open(vault_dir / 'config.json', 'w') as config_file:
+        json.dump(content, config_file)
+
+
+def test_resource_path_strips_ids():
+    assert resource_path('http://host/api/v2/deals/42?x=1') == '/api/v2/deals'
+    assert resource_path('http://host/api/v2/deals') == '/api/v2/deals'
+
+
+def test_lru_evicts_oldest_entry():
+    cache = ResponseCache(max_entries=2)
+    for name in ('a', 'b', 'c'):
+        cache.store(name, f'http://host/{name}', name, {})
+    assert cache.lookup('a') == (None, False)
+    assert cache.lookup('c')[0]['content'] == 'c'
+
+
+def test_cache_is_off_by_default(mock_vault_dir, mock_server):
+    PipedriveUser().whoami()
+    PipedriveUser().whoami()
+    assert mock_server.stats['requests'] == 2
+
+
+def test_fresh_answer_is_served_from_cache(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir, response_cache_ttls={"users/me": 300})
+    restapi = PipedriveREST()
+    answers = [PipedriveUser(restapi).whoami() for _ in range(5)]
+    assert answers == [answers[0]] * 5
+    assert mock_server.stats['requests'] == 1
+
+
+def test_stale_answer_is_revalidated(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir, response_cache_ttl=0)
+    mock_server.seed_deals(3)
+    deals = PipedriveDeals()
+    first = deals.get_all_deals()
+    second = deals.get_all_deals()
+    assert second == first
+    assert mock_server.stats['not_modified'] == 1
+
+
+def test_write_invalidates_cached_collection(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir)
+    deals = PipedriveDeals()
+    assert json.loads(deals.get_all_deals()[1])['data'] == []
+    deals.add_deal({"title": "Order 1"})
+    assert len(json.loads(deals.get_all_deals()[1])['data']) == 1
+
+
+def test_disk_tier_survives_new_process_cache(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir, response_cache_file=str(mock_vault_dir / 'cache.sqlite'))
+    PipedriveUser().whoami()
+    ResponseCache.reset_cache()
+    PipedriveUser().whoami()
+    assert mock_server.stats['requests'] == 1
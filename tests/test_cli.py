@@ -0,0 +1,31 @@
+import os
+import sys
+import json
+import importlib
+import subprocess
+
+import modules
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_package_exports_match_submodules():
+    for submodule, names in modules._submodules.items():
+        assert importlib.import_module('modules.' + submodule).__all__ == names
+    assert modules.KeyVaultStorage is importlib.import_module('modules.keyvault').KeyVaultStorage
+
+
+def test_commands_do_not_import_http_stack(vault_dir):
+    code = ("import sys, runpy; sys.argv = ['pipedrive.py', 'show_auth', 'code']; "
+        f"runpy.run_path({os.path.join(REPO_DIR, 'pipedrive.py')!r}, run_name='__main__'); "
+        "print(json.dumps(sorted(name for name in ('requests', 'aiohttp', 'modules.pipedriveapi') if name in sys.modules)))")
+    result = subprocess.run([sys.executable, '-c', 'import json; ' + code], cwd=vault_dir, capture_output=True, text=True,
+        env=dict(os.environ, HOME=str(vault_dir), PYTHONPATH=REPO_DIR), check=True)
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+    assert 'code value : code' in result.stderr
+
+
+def test_sync_client_does_not_import_aiohttp():
+    code = "import sys, modules.file_import; print('aiohttp' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
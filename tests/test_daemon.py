@@ -0,0 +1,112 @@
+import io
+import os
+import json
+import stat
+import time
+import threading
+import pytest
+
+import pipedrive
+from modules.daemon import CommandDaemon, forward, stop_daemon, default_socket_path
+
+
+@pytest.fixture
+def command_daemon(mock_vault_dir, monkeypatch):
+    monkeypatch.setattr(pipedrive, 'home', str(mock_vault_dir))
+    command_daemon = CommandDaemon(pipedrive.run_forwarded_command, str(mock_vault_dir / 'daemon.sock')).start()
+    yield command_daemon
+    stop_daemon(command_daemon.socket_path)
+
+
+def run(command_daemon, *args):
+    out, err = io.StringIO(), io.StringIO()
+    code = forward(['pipedrive.py'] + list(args), command_daemon.socket_path, out, err)
+    return code, out.getvalue(), err.getvalue()
+
+
+def test_commands_share_warm_client(command_daemon, mock_server):
+    mock_server.seed_deals(3)
+    code, out, err = run(command_daemon, 'whoami')
+    assert code == 0 and 'Current user info' in err
+    code, out, err = run(command_daemon, 'deals', '--fields', 'id')
+    assert code == 0
+    assert [json.loads(line) for line in out.splitlines()] == [{"id": 1}, {"id": 2}, {"id": 3}]
+    # second command reused pooled connection of first one
+    assert mock_server.stats['connections'] == 1
+    assert command_daemon.commands == 2
+    # every command has own log and metrics files
+    assert len([name for name in os.listdir(command_daemon.workdir + '/log') if name.endswith('_metrics.json')]) == 2
+
+
+def test_errors_and_exit_codes(command_daemon):
+    code, out, err = run(command_daemon, 'deals', '--no-such-option')
+    assert code == 2 and 'unrecognized arguments' in err
+    code, out, err = run(command_daemon, 'no_such_command')
+    assert code == 1 and 'Unknown command' in out
+    code, out, err = run(command_daemon, 'daemon')
+    assert code == 1 and 'runs only in own process' in out
+
+
+def test_fallback_without_daemon(command_daemon, tmp_path, monkeypatch):
+    assert forward(['pipedrive.py', 'whoami'], str(tmp_path / 'missing.sock')) is None
+    # daemon serves only its own directory, config and token of other one are not its
+    other_dir = tmp_path / 'other'
+    other_dir.mkdir()
+    monkeypatch.chdir(other_dir)
+    assert forward(['pipedrive.py', 'whoami'], command_daemon.socket_path) is None
+    assert default_socket_path(str(other_dir)) != default_socket_path(command_daemon.workdir)
+
+
+def test_stop(command_daemon):
+    assert stop_daemon(command_daemon.socket_path)
+    for _ in range(100):
+        if not os.path.exists(command_daemon.socket_path):
+            break
+        time.sleep(0.01)
+    assert not os.path.exists(command_daemon.socket_path)
+    assert not stop_daemon(command_daemon.socket_path)
+
+
+def test_busy_daemon_sends_client_back_to_own_process(mock_vault_dir):
+    started, release = threading.Event(), threading.Event()
+
+    def slow_command(argv):
+        started.set()
+        release.wait(10)
+        print('done')
+
+    command_daemon = CommandDaemon(slow_command, str(mock_vault_dir / 'busy.sock')).start()
+    try:
+        results = []
+        first = threading.Thread(target=lambda: results.append(run(command_daemon, 'load_file', 'orders.csv')))
+        first.start()
+        assert started.wait(10)
+        # second client is answered right away instead of waiting for first command
+        assert forward(['pipedrive.py', 'whoami'], command_daemon.socket_path, io.StringIO(), io.StringIO()) is None
+        release.set()
+        first.join(10)
+        assert results == [(0, 'done\n', '')]
+        assert run(command_daemon, 'whoami')[0] == 0
+    finally:
+        release.set()
+        stop_daemon(command_daemon.socket_path)
+
+
+def test_default_socket_is_in_private_directory(mock_vault_dir, tmp_path, monkeypatch):
+    monkeypatch.delenv('PIPEDRIVE_DAEMON_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path / 'runtime'))
+    (tmp_path / 'runtime').mkdir()
+    command_daemon = CommandDaemon(lambda argv: 0).start()
+    try:
+        assert os.path.dirname(command_daemon.socket_path) == str(tmp_path / 'runtime' / 'pipedrive')
+        assert stat.S_IMODE(os.stat(os.path.dirname(command_daemon.socket_path)).st_mode) == 0o700
+        assert run(command_daemon, 'whoami')[0] == 0
+    finally:
+        stop_daemon(command_daemon.socket_path)
+
+
+def test_socket_of_other_user_is_not_used(command_daemon, monkeypatch):
+    monkeypatch.setattr(os, 'getuid', lambda: os.stat(command_daemon.socket_path).st_uid + 1)
+    assert forward(['pipedrive.py', 'whoami'], command_daemon.socket_path) is None
+    assert not stop_daemon(command_daemon.socket_path)
+    assert command_daemon.commands == 0
@@ -0,0 +1,52 @@
+import sys
+import json
+import datetime
+import pytest
+
+from modules.pipedriveapi import PipedriveDeals, PipedriveCLI
+
+
+def seed(mock_server):
+    mock_server.seed_deals(30)
+    for deal in mock_server.deals:
+        deal_id = deal['id']
+        deal.update(status=('open', 'won', 'lost')[deal_id % 3], owner_id=1 + deal_id % 2,
+            update_time=f"2024-09-{deal_id:02d}T00:00:00Z", custom_fields={"order_key": f"order-{deal_id}", "note": "x" * 100})
+
+
+def test_query_builds_params():
+    params = PipedriveDeals.query(status=['open', 'won'], owner_id='2',
+        updated_since=datetime.datetime(2024, 9, 1, 2, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=2))),
+        sort_by='update_time', sort_direction='desc', custom_fields=['order_key'])
+    assert params == {"status": "open,won", "owner_id": 2, "updated_since": "2024-09-01T00:00:00Z",
+        "sort_by": "update_time", "sort_direction": "desc", "custom_fields": "order_key"}
+    with pytest.raises(ValueError):
+        PipedriveDeals.query(status='closed')
+    with pytest.raises(ValueError):
+        PipedriveDeals.query(sort_by='title')
+
+
+def test_filters_and_projection_reach_server(mock_vault_dir, mock_server):
+    seed(mock_server)
+    params = PipedriveDeals.query(status='won', owner_id=2, updated_since='2024-09-10T00:00:00Z',
+        sort_by='update_time', sort_direction='desc', custom_fields='order_key')
+    deals = list(PipedriveDeals().iter_deals(params, limit=2, fields=['id', 'status', 'custom_fields']))
+    assert deals == [{"id": deal_id, "status": "won", "custom_fields": {"order_key": f"order-{deal_id}"}} for deal_id in (25, 19, 13)]
+
+
+def test_cli_deals_options(mock_vault_dir, mock_server, monkeypatch):
+    seed(mock_server)
+    output = mock_vault_dir / 'deals.ndjson'
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'deals', '--status', 'open,lost', '--updated-until', '2024-09-07T00:00:00Z',
+        '--fields', 'id,title', '--output', str(output)])
+    PipedriveCLI().deals()
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert lines == [{"id": deal_id, "title": f"Deal {deal_id}"} for deal_id in (2, 3, 5, 6)]
+
+
+def test_deleted_deals_are_listed_only_by_status(mock_vault_dir, mock_server):
+    mock_server.seed_deals(3)
+    mock_server.deals[1]['status'] = 'deleted'
+    deals = PipedriveDeals()
+    assert [deal['id'] for deal in deals.iter_deals()] == [1, 3]
+    assert [deal['id'] for deal in deals.iter_deals(deals.query(status='deleted'))] == [2]
@@ -0,0 +1,69 @@
+import sys
+import json
+import pytest
+
+from modules.pipedriveapi import PipedriveDeals, PipedriveResource, PipedriveCLI
+from modules.enrich import DealEnricher
+
+
+def seed(mock_server, deals = 250):
+    mock_server.seed_deals(deals)
+    mock_server.seed_entities('persons', 150)
+    mock_server.seed_entities('organizations', 10)
+    mock_server.seed_entities('users', 2)
+    for deal in mock_server.deals:
+        deal.update(person_id=deal['id'] % 150 + 1, org_id=deal['id'] % 10 + 1, owner_id=deal['id'] % 3 + 1,
+            stage_id=deal['id'] % 3 + 1)
+    # points to person that does not exist
+    mock_server.deals[0]['person_id'] = 999
+
+
+def test_resource_pagination_and_ids(mock_vault_dir, mock_server):
+    seed(mock_server)
+    persons = PipedriveResource('persons')
+    assert [person['id'] for person in persons.iter_items(limit=40)] == list(range(1, 151))
+    requests_before = mock_server.stats['requests']
+    assert sorted(person['id'] for person in persons.iter_by_ids(range(1, 131))) == list(range(1, 131))
+    # 100 ids per request
+    assert mock_server.stats['requests'] - requests_before == 2
+    # v1 users follow start pagination
+    assert [user['id'] for user in PipedriveResource('users').iter_items(limit=2)] == [1, 2, 3]
+    with pytest.raises(ValueError):
+        list(PipedriveResource('stages').iter_by_ids([1]))
+    with pytest.raises(ValueError):
+        PipedriveResource('notes')
+
+
+def test_enricher_batches_requests(mock_vault_dir, mock_server):
+    seed(mock_server)
+    enricher = DealEnricher(batch_size=100, fields=('id', 'name'))
+    requests_before = mock_server.stats['requests']
+    deals = list(enricher.enrich(PipedriveDeals().iter_deal_models(limit=500)))
+    # deals page, person ids of first two batches, organizations once, users, stages and pipelines listed once,
+    # instead of 1000 requests of one entity per request
+    assert mock_server.stats['requests'] - requests_before == 7
+    assert len(deals) == 250
+    deal = deals[4]
+    assert deal['person'] == {"id": 6, "name": "Person 6"}
+    assert deal['organization'] == {"id": 6, "name": "Organization 6"}
+    assert deal['owner'] == {"id": 3, "name": "User 3"}
+    assert deal['stage'] == {"id": 3, "name": "Stage 3"}
+    assert deal['pipeline'] == {"id": 1, "name": "Pipeline 1"}
+    assert deals[0]['person'] is None and deals[0]['organization']['id'] == 2
+
+
+def test_enricher_cache_is_bounded(mock_vault_dir, mock_server):
+    seed(mock_server)
+    enricher = DealEnricher(batch_size=50, cache_size=20, relations={'person_id': ('persons', 'person')})
+    deals = list(enricher.enrich(PipedriveDeals().iter_deals(limit=500)))
+    assert all(deal['person']['id'] == deal['person_id'] for deal in deals[1:])
+    assert len(enricher._cache['persons']) == 20
+
+
+def test_cli_deals_enrich(mock_vault_dir, mock_server, monkeypatch):
+    seed(mock_server, deals=3)
+    output = mock_vault_dir / 'deals.ndjson'
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'deals', '--enrich', '--fields', 'id,person,stage', '--output', str(output)])
+    PipedriveCLI().deals()
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert lines[1] == {"id": 2, "person": {"id": 3, "name": "Person 3"}, "stage": {"id": 3, "name": "Stage 3", "pipeline_id": 1}}
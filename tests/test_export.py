@@ -0,0 +1,59 @@
+import sys
+import json
+
+from modules.pipedriveapi import PipedriveDeals, PipedriveCLI
+from modules.export import DealExport
+
+
+def test_export_fetches_only_changed_deals(mock_vault_dir, mock_server):
+    mock_server.seed_deals(30)
+    for deal in mock_server.deals:
+        deal['update_time'] = f"2024-09-{deal['id']:02d}T00:00:00Z"
+    deals = PipedriveDeals()
+    with DealExport(deals, str(mock_vault_dir / 'export.sqlite')) as export:
+        assert export.run() == {"fetched": 30, "new": 30, "changed": 0}
+        watermark = export.watermark
+        assert watermark == '2024-09-30T00:00:00Z'
+
+        deals.update_deal(7, {"value": 700})
+        deals.add_deal({"title": "Deal new"})
+        counts = export.run()
+        assert counts["new"] == 1 and counts["changed"] == 1
+        # deal of boundary second is requested again, but not counted as changed
+        assert counts["fetched"] == 3
+        assert export.watermark > watermark
+        stored = {deal['id']: deal for deal in export.deals()}
+        assert len(stored) == 31 and stored[7]['value'] == 700
+
+
+def test_failed_export_keeps_watermark(mock_vault_dir, mock_server):
+    mock_server.seed_deals(5)
+    with DealExport(PipedriveDeals(), str(mock_vault_dir / 'export.sqlite'), account='acme') as export:
+        export.run()
+        mock_server.error_rate, mock_server.error_code = 1.0, 400
+        deal = mock_server.deals[0]
+        deal['update_time'] = '2024-09-01T00:00:00Z'
+        try:
+            export.run()
+        except Exception:
+            pass
+        assert export.watermark == '2024-08-29T00:00:00Z'
+
+
+def test_compact_purges_deleted(mock_vault_dir, mock_server):
+    mock_server.seed_deals(10)
+    for deal in mock_server.deals[:3]:
+        deal.update(status='deleted', update_time='2024-09-01T00:00:00Z')
+    with DealExport(PipedriveDeals(), str(mock_vault_dir / 'export.sqlite')) as export:
+        export.run()
+        assert export.count() == 10 and len(list(export.deals())) == 7
+        assert export.compact(purge_deleted=True) == 3
+        assert export.count() == 7
+
+
+def test_cli_export(mock_vault_dir, mock_server, monkeypatch):
+    mock_server.seed_deals(4)
+    store, output = mock_vault_dir / 'deals.sqlite', mock_vault_dir / 'deals.ndjson'
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'export', '--store', str(store), '--compact', '--output', str(output)])
+    PipedriveCLI().export()
+    assert [json.loads(line)['id'] for line in output.read_text().splitlines()] == [1, 2, 3, 4]
@@ -0,0 +1,97 @@
+import io
+import sqlite3
+import pytest
+
+from modules.ingest import CsvSource, CursorSource, DealSchema, DealIngest
+from modules.file_import import FileLoad
+
+
+def test_quoted_titles_and_line_endings(tmp_path):
+    path = tmp_path / 'orders.csv'
+    path.write_bytes(b'"Doe, John",open,100\r\nSmith Anna,won,20.5\r\n')
+    records = list(DealIngest().records(CsvSource(str(path))))
+    assert records == [
+        {"title": "Doe, John", "status": "open", "value": 100},
+        {"title": "Smith Anna", "status": "won", "value": 20.5},
+    ]
+
+
+@pytest.mark.parametrize("line, error", [
+    (',open,1', 'title is empty'),
+    ('A,closed,1', "status 'closed'"),
+    ('A,open,ten', "value 'ten' is not a number"),
+    ('A,open', 'expected 3 fields, got 2'),
+])
+def test_invalid_rows_are_rejected(line, error):
+    ingest = DealIngest()
+    records = list(ingest.records(CsvSource(file_in=io.StringIO(line + '\nB,open,2\n'))))
+    assert records == [{"title": "B", "status": "open", "value": 2}]
+    assert ingest.rejected == 1
+    line_number, row, errors = ingest.rejects[0]
+    assert line_number == 1
+    assert error in '; '.join(errors)
+
+
+def test_empty_value_is_allowed():
+    record, errors = DealSchema().validate({"title": "A", "status": "open", "value": ""})
+    assert record == {"title": "A", "status": "open", "value": None}
+
+
+def test_header_defines_columns():
+    source = CsvSource(file_in=io.StringIO('value,title,status\n5,A,lost\n'), header=True)
+    assert list(DealIngest().records(source)) == [{"title": "A", "status": "lost", "value": 5}]
+
+
+def test_rejected_rows_are_not_sent(mock_vault_dir, mock_server, tmp_path):
+    path = tmp_path / 'orders.csv'
+    path.write_text('A,open,1\nB,unknown,2\n"C, D",won,3\n')
+    loader = FileLoad()
+    assert loader.load_records(loader.read_file(str(path))) == (2, 0)
+    assert [deal['title'] for deal in mock_server.deals] == ['A', 'C, D']
+    assert mock_server.deals[1]['value'] == 3
+
+
+class CountingCursor:
+    """ sqlite cursor recording fetchmany sizes
+    """
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.fetches = []
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchmany(self, size):
+        rows = self._cursor.fetchmany(size)
+        self.fetches.append(len(rows))
+        return rows
+
+
+@pytest.fixture
+def orders_db():
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE orders (order_id INTEGER, title TEXT, status TEXT, value REAL)")
+    db.executemany("INSERT INTO orders VALUES (?, ?, ?, ?)",
+        [(i, f"Order {i}", 'open', i * 1.5) for i in range(1, 8)] + [(8, None, 'open', 1)])
+    yield db
+    db.close()
+
+
+def test_cursor_source_streams_in_batches(orders_db):
+    cursor = CountingCursor(orders_db.cursor())
+    ingest = DealIngest()
+    query = "SELECT title, status, value FROM orders ORDER BY order_id"
+    records = list(ingest.records(CursorSource(cursor, query, batch_size=3)))
+    assert cursor.fetches == [3, 3, 2, 0]
+    assert records[:2] == [{"title": "Order 1", "status": "open", "value": 1.5}, {"title": "Order 2", "status": "open", "value": 3}]
+    assert len(records) == 7
+    assert ingest.rejected == 1
+    assert ingest.rejects[0][0] == 8
+
+
+def test_cursor_source_loads_through_file_load(orders_db, mock_vault_dir, mock_server):
+    loader = FileLoad()
+    records = loader.read_cursor(orders_db.cursor(), "SELECT title, status, value FROM orders WHERE order_id <= ?", (5,), batch_size=2)
+    assert loader.load_records(records, workers=2) == (5, 0)
+    assert sorted(deal['title'] for deal in mock_server.deals) == [f"Order {i}" for i in range(1, 6)]
+
@@ -0,0 +1,53 @@
+from modules.journal import LoadJournal, file_checksum
+from modules.file_import import FileLoad
+
+
+def test_watermark_follows_contiguous_acknowledged_rows(tmp_path):
+    with LoadJournal(str(tmp_path / 'journal.sqlite')).start('input', checksum='abc') as journal:
+        journal.acknowledge(0, 10)
+        journal.acknowledge(2, 12)
+        assert journal.watermark == 1
+        assert journal.is_acknowledged(2)
+        assert not journal.is_acknowledged(1)
+        journal.acknowledge(1, 11)
+        assert journal.watermark == 3
+        assert journal.deal_id(1) == 11
+
+
+def test_journal_survives_reopen(tmp_path):
+    path = str(tmp_path / 'journal.sqlite')
+    with LoadJournal(path).start('input', checksum='abc') as journal:
+        journal.acknowledge(0)
+        journal.acknowledge(1)
+    with LoadJournal(path).start('input', checksum='abc') as journal:
+        assert journal.watermark == 2
+    with LoadJournal(path).start('input', checksum='other') as journal:
+        assert journal.watermark == 0
+
+
+def test_checksum_depends_on_content(tmp_path):
+    (tmp_path / 'a.csv').write_text('a,open,1\n')
+    (tmp_path / 'b.csv').write_text('b,open,1\n')
+    assert file_checksum(str(tmp_path / 'a.csv')) != file_checksum(str(tmp_path / 'b.csv'))
+
+
+def test_rerun_resumes_after_published_rows(mock_vault_dir, mock_server):
+    records = [{"title": f"Order {i}", "status": "open", "value": str(i)} for i in range(10)]
+    handle = mock_server.handle
+
+    def failing_after_six(method, path, *args):
+        if method == 'POST' and path == '/api/v2/deals' and mock_server.stats['deals_created'] >= 6:
+            return 400, {"success": False, "error": "rejected"}, {}
+        return handle(method, path, *args)
+    mock_server.handle = failing_after_six
+
+    with LoadJournal('journal.sqlite').start('orders.csv', checksum='orders') as journal:
+        assert FileLoad().load_records(records, workers=1, journal=journal) == (6, 4)
+        assert journal.watermark == 6
+
+    mock_server.handle = handle
+    with LoadJournal('journal.sqlite').start('orders.csv', checksum='orders') as journal:
+        assert FileLoad().load_records(records, workers=4, journal=journal) == (4, 0)
+        assert journal.watermark == 10
+    assert mock_server.stats['deals_created'] == 10
+    assert sorted(deal['title'] for deal in mock_server.deals) == sorted(record['title'] for record in records)
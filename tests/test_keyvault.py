@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import pytest
+
+from modules.keyvault import KeyVaultStorage
+
+
+def test_files_are_parsed_once(vault_dir):
+    before = KeyVaultStorage.cache_stats()
+    for _ in range(100):
+        kv = KeyVaultStorage()
+        kv.get_access_token()
+        kv.get_client_id()
+    after = KeyVaultStorage.cache_stats()
+    assert after['reads'] - before['reads'] == 2
+
+
+def test_changed_file_is_read_again(vault_dir):
+    kv = KeyVaultStorage()
+    assert kv.get_access_token() == 'access-1'
+    with open('token.json') as token_file:
+        token = json.load(token_file)
+    token['access_token'] = 'access-changed'
+    with open('token.json', 'w') as token_file:
+        json.dump(token, token_file)
+    stat = os.stat('token.json')
+    # make sure change is visible even on coarse mtime resolution
+    os.utime('token.json', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert kv.get_access_token() == 'access-changed'
+
+
+def test_update_token_invalidates_cache(vault_dir):
+    kv = KeyVaultStorage()
+    other = KeyVaultStorage()
+    kv.update_token({"access_token": "access-2", "refresh_token": "refresh-2"})
+    assert other.get_access_token() == 'access-2'
+
+
+def test_cached_content_is_not_shared_mutable(vault_dir):
+    kv = KeyVaultStorage()
+    config = kv.get_config()
+    config['client_id'] = 'changed'
+    assert KeyVaultStorage().get_client_id() == 'client'
+    with pytest.raises(TypeError):
+        kv._config['client_id'] = 'changed'
+
+
+def test_update_token_is_atomic_and_stores_expiry(vault_dir):
+    kv = KeyVaultStorage()
+    before = time.time()
+    kv.update_token({"access_token": "access-2", "refresh_token": "refresh-2", "expires_in": 3600})
+    expires_at, expires_in = kv.get_token_expiry()
+    assert expires_in == 3600
+    assert before + 3600 <= expires_at <= time.time() + 3600
+    # temporary file is renamed over token.json, nothing is left behind
+    assert sorted(os.listdir(vault_dir)) == ['config.json', 'token.json']
@@ -0,0 +1,61 @@
+import json
+
+from modules.pipedriveapi import PipedriveDeals
+from modules.lookup import DealLookupIndex
+
+from test_cache import enable_cache
+
+
+def seed(mock_server):
+    mock_server.seed_deals(20)
+    for deal in mock_server.deals:
+        deal.update(update_time=f"2024-09-{deal['id']:02d}T00:00:00Z", custom_fields={"order_key": f"order-{deal['id'] % 10}"})
+
+
+def test_find_deal_searches_instead_of_creating(mock_vault_dir, mock_server):
+    seed(mock_server)
+    deals = PipedriveDeals()
+    code, content = deals.find_deal({"term": "Deal 7", "exact_match": "true"})
+    assert code == 200
+    assert [item['item']['id'] for item in json.loads(content)['data']['items']] == [7]
+    assert mock_server.stats['deals_created'] == 0
+    assert sorted(deal['id'] for deal in deals.search_deals('order-3', fields='custom_fields', limit=1)) == [3, 13]
+
+
+def test_repeated_search_is_cached(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir)
+    seed(mock_server)
+    deals = PipedriveDeals()
+    requests_before = mock_server.stats['requests']
+    assert deals.find_deal({"term": "Deal 1"}) == deals.find_deal({"term": "Deal 1"})
+    assert mock_server.stats['requests'] - requests_before == 1
+    # write to deals drops cached searches
+    deals.update_deal(1, {"title": "Renamed"})
+    code, content = deals.find_deal({"term": "Deal 1"})
+    assert 1 not in [item['item']['id'] for item in json.loads(content)['data']['items']]
+
+
+def test_index_lookups_and_incremental_refresh(mock_vault_dir, mock_server):
+    seed(mock_server)
+    deals = PipedriveDeals()
+    index = DealLookupIndex(deals, keys=('title', 'order_key')).load()
+    assert len(index) == 20
+    assert index.get(4).title == 'Deal 4'
+    assert index.find_one('title', 'Deal 9').id == 9
+    assert [deal.id for deal in index.find('order_key', 'order-2')] == [2, 12]
+    assert index.find('id', 5)[0].title == 'Deal 5'
+    assert index.updated_since == '2024-09-20T00:00:00Z'
+
+    deals.update_deal(2, {"title": "Deal two", "custom_fields": {"order_key": "order-x"}})
+    deals.add_deal({"title": "Deal 21"})
+    mock_server.deals[11].update(status='deleted', update_time='2024-09-25T00:00:00Z')
+    requests_before = mock_server.stats['requests']
+    # boundary deal is fetched again along with three changed ones
+    assert index.refresh() == 4
+    assert mock_server.stats['requests'] - requests_before == 1
+    assert index.find('title', 'Deal 2') == []
+    assert index.find_one('title', 'Deal two').id == 2
+    assert index.find('order_key', 'order-2') == []
+    assert index.find_one('order_key', 'order-x').id == 2
+    assert index.find_one('title', 'Deal 21') is not None
+    assert 12 not in index and len(index) == 20
@@ -0,0 +1,39 @@
+from modules.metrics import Metrics, endpoint_name
+from modules.pipedriveapi import PipedriveDeals, PipedriveUser
+from test_retry import fail_first
+
+
+def test_endpoint_name_folds_ids_and_query():
+    assert endpoint_name('PATCH', 'https://api.pipedrive.com/api/v2/deals/42') == 'PATCH /api/v2/deals/{id}'
+    assert endpoint_name('GET', 'http://127.0.0.1:1/api/v2/deals?limit=100&cursor=200') == 'GET /api/v2/deals'
+
+
+def test_histogram_quantiles():
+    metrics = Metrics()
+    for seconds in [0.001] * 98 + [0.3, 3.0]:
+        metrics.record_request('GET /x', 200, seconds)
+    stats = metrics.snapshot()['endpoints']['GET /x']
+    assert stats['p50'] == 0.005
+    assert stats['p99'] == 0.5
+    assert sum(stats['latency_buckets']) == 100
+
+
+def test_requests_retries_and_refreshes_are_recorded(mock_vault_dir, mock_server):
+    mock_server.seed_deals(10)
+    fail_first(mock_server, 1)
+    assert len(list(PipedriveDeals().iter_deals(limit=5))) == 10
+    mock_server.rotate_access_token()
+    assert PipedriveUser().whoami()[0] == 200
+
+    snapshot = Metrics.get_metrics().snapshot()
+    deals = snapshot['endpoints']['GET /api/v2/deals']
+    assert deals['requests'] == 3
+    assert deals['statuses'] == {'2xx': 2, '5xx': 1}
+    assert deals['retries'] == {'status': 1}
+    assert deals['bytes_received'] > 0
+    assert snapshot['endpoints']['GET /api/v1/users/me']['statuses'] == {'2xx': 1, '4xx': 1}
+    assert snapshot['token_refreshes'] == {'ok': 1, 'failed': 0}
+
+    text = Metrics.get_metrics().to_prometheus()
+    assert 'pipedrive_requests_total{endpoint="GET /api/v2/deals",status="5xx"} 1' in text
+    assert 'pipedrive_request_duration_seconds_count{endpoint="GET /api/v2/deals"} 3' in text
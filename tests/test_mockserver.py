@@ -0,0 +1,36 @@
+import time
+import requests
+
+from modules.mockserver import MockPipedriveServer
+from modules.pipedriveapi import PipedriveDeals
+
+
+def test_rate_limit_answers_429_with_headers():
+    with MockPipedriveServer(rate_limit=2, rate_window=60) as server:
+        uri = server.base_uri + "api/v1/users/me"
+        headers = {"Authorization": f"Bearer {server.access_token}"}
+        answers = [requests.get(uri, headers=headers) for _ in range(3)]
+    assert [answer.status_code for answer in answers] == [200, 200, 429]
+    assert answers[1].headers['x-ratelimit-remaining'] == '0'
+    assert float(answers[2].headers['Retry-After']) > 0
+
+
+def test_token_ttl_expires_access_token():
+    with MockPipedriveServer(token_ttl=0.05) as server:
+        uri = server.base_uri + "api/v1/users/me"
+        headers = {"Authorization": f"Bearer {server.access_token}"}
+        assert requests.get(uri, headers=headers).status_code == 200
+        time.sleep(0.1)
+        assert requests.get(uri, headers=headers).status_code == 401
+
+
+def test_client_rides_out_injected_faults(mock_vault_dir, mock_server):
+    mock_server.seed_deals(300)
+    mock_server.error_rate = 0.3
+    mock_server.rate_limit = 5
+    mock_server.rate_window = 0.2
+    deals = list(PipedriveDeals().iter_deals(limit=20))
+    assert [deal['id'] for deal in deals] == list(range(1, 301))
+    assert mock_server.stats['errors'] > 0
+    # limiter follows x-ratelimit headers, so window is rarely overrun
+    assert mock_server.stats['throttled'] <= 2
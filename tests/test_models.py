@@ -0,0 +1,69 @@
+import json
+import pytest
+from collections.abc import Mapping
+
+from modules import models
+from modules.models import Deal, JsonPage
+from modules.pipedriveapi import PipedriveDeals
+
+BACKENDS = ['json'] + (['orjson'] if models.orjson is not None else [])
+
+PAGE = json.dumps({"success": True,
+    "data": [{"id": 1, "title": "A", "status": "open", "value": 5, "probability": 50, "custom_fields": {"abc": "order-1"}},
+        {"id": 2, "title": "B \u00e9 [x], {y}", "status": "won", "value": None}],
+    "additional_data": {"next_cursor": "abc"}}, indent=2).encode('utf-8')
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_page_items_are_parsed_one_by_one(backend):
+    page = JsonPage(PAGE, Deal.from_dict, backend)
+    deals = list(page)
+    assert [deal.id for deal in deals] == [1, 2]
+    assert deals[1].title == "B \u00e9 [x], {y}"
+    assert page.fields == {"success": True, "additional_data": {"next_cursor": "abc"}}
+
+
+@pytest.mark.parametrize("body", [b'{"success": true, "data": []}', b'{"success": false, "data": null}', b'{}'])
+def test_empty_pages(body):
+    assert list(JsonPage(body, backend='json')) == []
+
+
+def test_broken_page_raises_value_error():
+    with pytest.raises(ValueError):
+        list(JsonPage(b'{"data": [{"id": 1} {"id": 2}]}', backend='json'))
+
+
+def test_deal_keeps_only_slotted_fields():
+    deal = list(JsonPage(PAGE, Deal.from_dict, 'json'))[0]
+    assert not hasattr(deal, '__dict__')
+    assert deal['title'] == 'A'
+    assert deal.get('abc') == 'order-1'
+    assert deal.get('probability') is None
+    with pytest.raises(KeyError):
+        deal['probability']
+    assert Deal.from_dict(deal.to_dict()) == deal
+
+
+def test_deal_is_mapping_with_slot_fields_always_present():
+    deal = list(JsonPage(PAGE, Deal.from_dict, 'json'))[1]
+    assert isinstance(deal, Mapping)
+    # missing slot field is None like in API answer, not missing key
+    assert deal['value'] is None and deal.get('value', 0) is None
+    assert 'owner_id' in deal and 'probability' not in deal
+    assert dict(deal) == deal.to_dict()
+    deal = Deal(id=1, custom_fields={"abc": "order-1"})
+    assert 'abc' in deal and list(deal)[-1] == 'abc'
+    assert len(deal) == len(Deal.__slots__) + 1
+
+
+def test_stdlib_backend_is_default():
+    page = JsonPage(PAGE, Deal.from_dict)
+    assert page._backend == 'json'
+
+
+def test_iter_deal_models_against_mock(mock_vault_dir, mock_server):
+    mock_server.seed_deals(25)
+    deals = list(PipedriveDeals().iter_deal_models(limit=10))
+    assert [deal.id for deal in deals] == list(range(1, 26))
+    assert all(isinstance(deal, Deal) for deal in deals)
+    assert list(PipedriveDeals().iter_deals(limit=10)) == mock_server.deals
@@ -0,0 +1,92 @@
+import sys
+import json
+import threading
+import pytest
+
+from modules.pipedriveapi import PipedriveDeals, PipedriveCLI, PipedriveAPIError
+
+
+def seed(mock_server, count = 60):
+    mock_server.seed_deals(count)
+    for deal in mock_server.deals:
+        deal_id = deal['id']
+        deal.update(status=('open', 'won', 'lost')[deal_id % 3], owner_id=1 + deal_id % 2, stage_id=1 + deal_id % 3,
+            update_time=f"2024-09-{1 + deal_id % 28:02d}T{deal_id % 24:02d}:00:00Z")
+    mock_server.seed_entities('users', 1)
+
+
+def test_update_time_ranges_cover_listing(mock_vault_dir, mock_server):
+    seed(mock_server)
+    partitions = PipedriveDeals().partitions('update_time', count=4, since='2024-09-01T00:00:00Z', until='2024-09-29T00:00:00Z')
+    assert partitions == [
+        {"updated_until": "2024-09-08T00:00:00Z"},
+        {"updated_since": "2024-09-08T00:00:00Z", "updated_until": "2024-09-15T00:00:00Z"},
+        {"updated_since": "2024-09-15T00:00:00Z", "updated_until": "2024-09-22T00:00:00Z"},
+        {"updated_since": "2024-09-22T00:00:00Z"}]
+    # ranges start at oldest update_time by default
+    deals = list(PipedriveDeals().iter_deals_partitioned(by='update_time', count=4, limit=5, workers=3))
+    assert sorted(deal['id'] for deal in deals) == list(range(1, 61))
+
+
+@pytest.mark.parametrize('by', ['status', 'owner_id', 'stage_id', 'pipeline_id'])
+def test_value_partitions(mock_vault_dir, mock_server, by):
+    seed(mock_server)
+    deals = PipedriveDeals()
+    assert sorted(deal['id'] for deal in deals.iter_deals_partitioned(by=by, limit=7)) == list(range(1, 61))
+    # filters of listing are kept in every partition
+    won = deals.iter_deals_partitioned(deals.query(status='won'), by=by, fields=['id', 'status'])
+    assert sorted(deal['id'] for deal in won) == list(range(1, 61))[0::3]
+
+
+def test_partitions_run_concurrently(mock_vault_dir, mock_server):
+    seed(mock_server)
+    mock_server.latency = 0.05
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    handle = mock_server.handle
+
+    def counting_handle(*args):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            return handle(*args)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    mock_server.handle = counting_handle
+    deals = list(PipedriveDeals().iter_deals_partitioned(by='status', workers=3, limit=5))
+    assert len(deals) == 60
+    assert peak[0] == 3
+
+
+def test_overlapping_partitions_are_deduplicated(mock_vault_dir, mock_server):
+    seed(mock_server)
+    deals = PipedriveDeals()
+    deals.partitions = lambda *args: [{}, {"status": "open"}, {}]
+    assert sorted(deal['id'] for deal in deals.iter_deals_partitioned(limit=9)) == list(range(1, 61))
+
+
+def test_errors_and_early_close(mock_vault_dir, mock_server):
+    seed(mock_server)
+    deals = PipedriveDeals()
+    with pytest.raises(ValueError):
+        list(deals.iter_deals_partitioned(by='title'))
+    with pytest.raises(ValueError):
+        list(deals.iter_deals_partitioned(fields=['title']))
+    stream = deals.iter_deals_partitioned(by='status', limit=2)
+    next(stream)
+    stream.close()
+    mock_server.error_rate, mock_server.error_code = 1.0, 400
+    with pytest.raises(PipedriveAPIError):
+        list(deals.iter_deals_partitioned(by='status'))
+
+
+def test_cli_partitioned_deals(mock_vault_dir, mock_server, monkeypatch):
+    seed(mock_server)
+    output = mock_vault_dir / 'deals.ndjson'
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'deals', '--partition-by', 'update_time', '--partitions', '5',
+        '--fields', 'id', '--output', str(output)])
+    PipedriveCLI().deals()
+    assert sorted(json.loads(line)['id'] for line in output.read_text().splitlines()) == list(range(1, 61))
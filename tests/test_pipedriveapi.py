@@ -0,0 +1,86 @@
+import os
+import sys
+import time
+import json
+import threading
+import subprocess
+
+from modules.pipedriveapi import PipedriveREST, PipedriveDeals, PipedriveUser, PipedriveCLI
+from modules.keyvault import KeyVaultStorage
+from modules.file_import import FileLoad
+
+# one client process, each of them sees 401 on first request and refreshes token
+CLIENT_PROCESS = '''
+import os
+import sys
+import time
+sys.path.insert(0, sys.argv[1])
+from modules.pipedriveapi import PipedriveUser
+sys.exit(0 if PipedriveUser().whoami()[0] == 200 else 1)
+'''
+
+
+def test_whoami_against_mock(mock_vault_dir, mock_server):
+    code, content = PipedriveUser().whoami()
+    assert code == 200
+    assert json.loads(content)['data']['name'] == 'Mock User'
+
+
+def test_expired_token_is_refreshed_once_for_all_workers(mock_vault_dir, mock_server):
+    mock_server.rotate_access_token()
+    records = ({"title": f"Order {i}", "status": "open", "value": i} for i in range(200))
+    loaded, failed = FileLoad().load_records(records, workers=8)
+    assert (loaded, failed) == (200, 0)
+    assert mock_server.stats['token_refreshes'] == 1
+    assert mock_server.stats['deals_created'] == 200
+
+
+def test_failed_refresh_returns_unauthorized(mock_vault_dir, mock_server):
+    mock_server.rotate_access_token()
+    mock_server.refresh_token = 'rotated-elsewhere'
+    restapi = PipedriveREST()
+    code, content = PipedriveDeals(restapi).add_deal({"title": "Order"})
+    assert code == 401
+    # refresh is not attempted again once it failed
+    code, content = PipedriveDeals(restapi).add_deal({"title": "Order"})
+    assert code == 401
+    assert mock_server.stats['deals_created'] == 0
+
+
+def test_token_is_refreshed_before_expiry(mock_vault_dir, mock_server):
+    token = dict(mock_server.client_token(), expires_at=time.time() + 10)
+    KeyVaultStorage().update_token(token)
+    code, content = PipedriveUser().whoami()
+    assert code == 200
+    assert mock_server.stats['token_refreshes'] == 1
+    assert mock_server.stats['unauthorized'] == 0
+
+
+def test_expired_token_is_refreshed_once_for_all_processes(mock_vault_dir, mock_server):
+    mock_server.rotate_access_token()
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    processes = [subprocess.Popen([sys.executable, '-c', CLIENT_PROCESS, repo_dir], cwd=mock_vault_dir) for _ in range(6)]
+    assert [process.wait(timeout=60) for process in processes] == [0] * 6
+    assert mock_server.stats['token_refreshes'] == 1
+
+
+def test_manual_refresh_is_skipped_when_token_was_rotated_meanwhile(mock_vault_dir, mock_server):
+    restapi = PipedriveREST()
+    used_access_token = restapi._access_token
+    # other client refreshed token after this one read it
+    assert restapi._refresh_token_locked(used_access_token)[0] == 200
+    assert restapi._refresh_token_locked(used_access_token) is None
+    assert mock_server.stats['token_refreshes'] == 1
+
+
+def test_concurrent_manual_refreshes_keep_valid_token(mock_vault_dir, mock_server, monkeypatch, caplog):
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'refresh_token'])
+    threads = [threading.Thread(target=PipedriveCLI().refresh_token) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # every refresh used refresh token stored by previous one, so none of them was rejected
+    assert not [record for record in caplog.records if record.levelname == 'ERROR']
+    assert KeyVaultStorage().get_refresh_token() == mock_server.refresh_token
+    assert PipedriveUser().whoami()[0] == 200
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+pytest.importorskip('aiohttp')
+
+from modules.pipedriveapi_async import AsyncPipedriveREST, AsyncPipedriveDeals, AsyncPipedriveUser
+from test_cache import enable_cache
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_whoami_against_mock(mock_vault_dir, mock_server):
+    async def whoami():
+        async with AsyncPipedriveREST() as restapi:
+            return await AsyncPipedriveUser(restapi).whoami()
+    code, content = run(whoami())
+    assert code == 200
+
+
+def test_iter_deals_follows_cursor(mock_vault_dir, mock_server):
+    mock_server.seed_deals(250)
+
+    async def list_ids():
+        async with AsyncPipedriveREST() as restapi:
+            return [deal['id'] async for deal in AsyncPipedriveDeals(restapi).iter_deals(limit=100)]
+    assert run(list_ids()) == list(range(1, 251))
+
+
+def test_add_deals_refreshes_token_once(mock_vault_dir, mock_server):
+    mock_server.rotate_access_token()
+
+    async def add_all():
+        async with AsyncPipedriveREST() as restapi:
+            records = ({"title": f"Order {i}"} for i in range(100))
+            return [result async for record, result in AsyncPipedriveDeals(restapi).add_deals(records, concurrency=8)]
+    results = run(add_all())
+    assert [code for code, content in results] == [200] * 100
+    assert mock_server.stats['token_refreshes'] == 1
+
+
+def test_add_deals_results_are_in_input_order(mock_vault_dir, mock_server):
+    async def add_all():
+        async with AsyncPipedriveREST() as restapi:
+            records = [{"title": f"Order {i}"} for i in range(50)]
+            return [(record['title'], result) async for record, result in AsyncPipedriveDeals(restapi).add_deals(records, concurrency=8)]
+    for title, (code, content) in run(add_all()):
+        assert title in content
+
+
+def test_add_deals_cancels_pending_requests_on_early_exit(mock_vault_dir, mock_server):
+    async def add_first():
+        async with AsyncPipedriveREST() as restapi:
+            results = AsyncPipedriveDeals(restapi).add_deals(({"title": f"Order {i}"} for i in range(1000)), concurrency=2)
+            async for record, result in results:
+                break
+            await results.aclose()
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            created = mock_server.stats['deals_created']
+            await asyncio.sleep(0.2)
+            return pending, created
+    pending, created = run(add_first())
+    assert pending == []
+    assert mock_server.stats['deals_created'] == created
+    assert created < 1000
+
+
+def test_get_request_uses_response_cache(mock_vault_dir, mock_server):
+    enable_cache(mock_vault_dir, response_cache_ttl=0)
+    mock_server.seed_deals(3)
+
+    async def list_twice():
+        async with AsyncPipedriveREST() as restapi:
+            deals = AsyncPipedriveDeals(restapi)
+            return [await deals.get_all_deals({"limit": 10}) for _ in range(2)]
+    first, second = run(list_twice())
+    assert first == second
+    assert mock_server.stats['not_modified'] == 1
+
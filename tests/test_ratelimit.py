@@ -0,0 +1,51 @@
+import pytest
+
+from modules.ratelimit import RateLimiter, MIN_RATE
+
+
+def test_remaining_header_clamps_bucket():
+    limiter = RateLimiter(rate=10, burst=20, safety_margin=2)
+    limiter.on_response(200, {'x-ratelimit-remaining': '5'})
+    waits = [limiter.reserve() for _ in range(4)]
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert waits[3] > 0
+
+
+def test_exhausted_budget_pauses_until_reset():
+    limiter = RateLimiter(rate=10, burst=20, safety_margin=2)
+    limiter.on_response(200, {'x-ratelimit-remaining': '1', 'x-ratelimit-reset': '2'})
+    assert limiter.reserve() == pytest.approx(2.1, abs=0.05)
+
+
+def test_retry_after_pauses_and_reports_throttled():
+    limiter = RateLimiter(rate=10, burst=20)
+    assert limiter.on_response(429, {'retry-after': '1'}) is True
+    assert limiter.reserve() >= 1.0
+    assert limiter.on_response(200, {}) is False
+
+
+def test_throttling_lowers_rate_once_per_burst_and_recovers():
+    limiter = RateLimiter(rate=10, burst=20)
+    limiter.on_response(429, {'retry-after': '1'})
+    limiter.on_response(429, {'retry-after': '1'})
+    assert limiter._rate == 5
+    for _ in range(100):
+        limiter.on_response(200, {})
+    assert limiter._rate == 10
+
+
+def test_rate_never_drops_below_minimum():
+    limiter = RateLimiter(rate=1, burst=1)
+    limiter._rate = MIN_RATE
+    limiter.on_response(429, {'retry-after': '0'})
+    assert limiter._rate == MIN_RATE
+
+
+def test_queued_requests_are_paced_after_pause():
+    limiter = RateLimiter(rate=10, burst=20)
+    limiter.on_response(429, {'retry-after': '1'})
+    waits = [limiter.reserve() for _ in range(10)]
+    # rate is halved to 5/s, so slots are 0.2s apart after the 1s pause
+    assert waits[0] == pytest.approx(1.2, abs=0.05)
+    for earlier, later in zip(waits, waits[1:]):
+        assert later - earlier == pytest.approx(0.2, abs=0.01)
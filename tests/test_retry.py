@@ -0,0 +1,87 @@
+import socket
+import pytest
+import requests
+
+from modules.retry import RetryPolicy, classify_exception, NOT_SENT, AMBIGUOUS
+from modules.pipedriveapi import PipedriveREST, PipedriveDeals, PipedriveUser
+
+
+def fail_first(mock_server, count, code = 503):
+    """ Make mock server answer first count requests with code
+    """
+    handle = mock_server.handle
+    calls = {"count": 0}
+
+    def failing_handle(*args):
+        calls["count"] += 1
+        if calls["count"] <= count:
+            return code, {"success": False}, {}
+        return handle(*args)
+    mock_server.handle = failing_handle
+    return calls
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = RetryPolicy(backoff_base=1, backoff_max=5)
+    for attempt in range(10):
+        assert 0 <= policy.backoff(attempt) <= min(5, 2 ** attempt)
+
+
+def test_budget_limits_retries():
+    policy = RetryPolicy(max_retries=100, budget_ratio=0.1, budget_min=2)
+    assert policy.should_retry_status('GET', 503, 0)
+    assert policy.should_retry_status('GET', 503, 0)
+    assert not policy.should_retry_status('GET', 503, 0)
+    for _ in range(11):
+        policy.on_request()
+    assert policy.should_retry_status('GET', 503, 0)
+
+
+def test_post_is_not_retried_on_server_error():
+    policy = RetryPolicy()
+    assert not policy.should_retry_status('POST', 503, 0)
+    assert policy.should_retry_status('GET', 503, 0)
+    assert not policy.should_retry_status('GET', 400, 0)
+    assert not policy.should_retry_status('GET', 503, policy.max_retries)
+
+
+def test_exception_classification():
+    assert classify_exception(requests.exceptions.ConnectTimeout()) == NOT_SENT
+    assert classify_exception(requests.exceptions.ReadTimeout()) == AMBIGUOUS
+    assert classify_exception(requests.exceptions.ConnectionError("Connection aborted")) == AMBIGUOUS
+    assert classify_exception(ValueError()) is None
+    policy = RetryPolicy()
+    assert not policy.should_retry_exception('POST', requests.exceptions.ReadTimeout(), 0)
+    assert policy.should_retry_exception('POST', requests.exceptions.ConnectTimeout(), 0)
+
+
+def test_get_is_retried_after_server_error(mock_vault_dir, mock_server):
+    calls = fail_first(mock_server, 2)
+    code, content = PipedriveUser().whoami()
+    assert code == 200
+    assert calls["count"] == 3
+
+
+def test_add_deal_is_not_duplicated_after_server_error(mock_vault_dir, mock_server):
+    calls = fail_first(mock_server, 1, 502)
+    code, content = PipedriveDeals().add_deal({"title": "Order"})
+    assert code == 502
+    assert calls["count"] == 1
+
+
+def test_add_deal_is_retried_when_connection_was_not_established(mock_vault_dir, mock_server):
+    with socket.socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        port = closed.getsockname()[1]
+    restapi = PipedriveREST()
+    restapi.api_uri_v2 = f"http://127.0.0.1:{port}/api/v2/"
+    attempts = []
+    should_retry_exception = restapi._retry_policy.should_retry_exception
+
+    def recording_should_retry(method, e, attempt):
+        attempts.append(attempt)
+        return should_retry_exception(method, e, attempt)
+    restapi._retry_policy.should_retry_exception = recording_should_retry
+    with pytest.raises(requests.exceptions.ConnectionError):
+        PipedriveDeals(restapi).add_deal({"title": "Order"})
+    assert attempts == [0, 1, 2, 3]
@@ -0,0 +1,84 @@
+import os
+import sys
+import subprocess
+import pytest
+
+from modules.shard import ShardSource, shard_of, parse_shard
+from modules.ratelimit import RateLimiter, SharedRateLimiter
+from modules.ingest import CsvSource
+from modules.file_import import FileLoad
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# reserves slots of shared bucket in separate process, prints total wait
+RESERVE_PROCESS = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+from modules.ratelimit import SharedRateLimiter
+limiter = SharedRateLimiter(sys.argv[2], rate=10, burst=5)
+print(sum(limiter.reserve() for _ in range(int(sys.argv[3]))))
+'''
+
+
+def test_shard_of_is_stable_and_spread():
+    # md5 based, does not change with PYTHONHASHSEED
+    assert [shard_of(f"Order {i}", 4) for i in range(8)] == [1, 0, 1, 2, 1, 1, 3, 3]
+    counts = [0] * 4
+    for i in range(4000):
+        counts[shard_of(f"Order {i}", 4)] += 1
+    assert min(counts) > 900
+
+
+def test_parse_shard():
+    assert parse_shard('1/4') == (1, 4)
+    with pytest.raises(ValueError):
+        parse_shard('4/4')
+
+
+def test_shards_partition_source(tmp_path):
+    path = tmp_path / 'orders.csv'
+    path.write_text("".join(f"Order {i % 50},open,{i}\n" for i in range(200)))
+    shards = [list(ShardSource(CsvSource(str(path)), shard, 3)) for shard in range(3)]
+    line_numbers = sorted(line_number for rows in shards for line_number, row in rows)
+    assert line_numbers == list(range(1, 201))
+    # all rows with same key are in one shard
+    titles = [set(row['title'] for _, row in rows) for rows in shards]
+    assert not titles[0] & titles[1] and not titles[1] & titles[2] and not titles[0] & titles[2]
+
+
+def test_shared_limiter_budget_spans_processes(tmp_path):
+    state = str(tmp_path / 'rate.json')
+    processes = [subprocess.Popen([sys.executable, '-c', RESERVE_PROCESS, REPO_DIR, state, '10'], stdout=subprocess.PIPE, text=True)
+        for _ in range(3)]
+    waits = [float(process.communicate(timeout=60)[0]) for process in processes]
+    # 30 slots from one bucket of 5 at 10/s wait about 32s in total, with own buckets processes would wait 4.5s
+    limiter = SharedRateLimiter(state, rate=10, burst=5)
+    assert limiter.reserve() > 1.0
+    assert sum(waits) > 10
+    limiter.close()
+
+
+def test_config_selects_shared_limiter(tmp_path):
+    RateLimiter.reset_limiter()
+    try:
+        limiter = RateLimiter.get_limiter({"rate_limit_shared_file": str(tmp_path / 'rate.json')})
+        assert isinstance(limiter, SharedRateLimiter)
+    finally:
+        RateLimiter.reset_limiter()
+
+
+def test_sharded_load_file_keeps_failures(mock_vault_dir, mock_server, monkeypatch):
+    (mock_vault_dir / 'orders.csv').write_text("".join(f"Order {i},open,{i}\n" for i in range(40)))
+    created = []
+    for shard in range(2):
+        monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'load_file', '--shard', f'{shard}/2',
+            '--journal', f'shard_{shard}.sqlite', str(mock_vault_dir / 'orders.csv')])
+        FileLoad().load_file()
+        created.append(mock_server.stats['deals_created'])
+    assert created[1] == 40 and 0 < created[0] < 40
+
+    mock_server.access_token = 'revoked'
+    mock_server.refresh_token = 'revoked'
+    loader = FileLoad()
+    assert loader.load_records([{"title": "Order", "status": "open", "value": 1}]) == (0, 1)
+    assert loader.failures[0][0] == 'Order'
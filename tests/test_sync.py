@@ -0,0 +1,57 @@
+from modules.sync import DealIndex, deal_hash, CREATED, UPDATED, UNCHANGED, DUPLICATE, FAILED
+from modules.file_import import FileLoad
+from modules.journal import LoadJournal
+
+
+def test_hash_ignores_csv_and_api_type_differences():
+    fields = ('title', 'status', 'value')
+    assert deal_hash({"title": "A", "status": "open", "value": "100\n"}, fields) == deal_hash({"title": "A", "status": "open", "value": 100}, fields)
+    assert deal_hash({"title": "A", "status": "open", "value": 100}, fields) != deal_hash({"title": "A", "status": "won", "value": 100}, fields)
+
+
+def test_index_is_keyed_by_configured_field():
+    index = DealIndex(key='title').build([{"id": 1, "title": "A", "value": 1}, {"id": 2, "title": "B", "value": 2}])
+    assert len(index) == 2
+    assert index.get("A")[0] == 1
+
+
+def test_sync_creates_updates_and_skips(mock_vault_dir, mock_server):
+    mock_server.seed_deals(3)
+    records = [
+        {"title": "Deal 1", "status": "open", "value": "1"},
+        {"title": "Deal 2", "status": "won", "value": "2"},
+        {"title": "Deal 4", "status": "open", "value": "4"},
+        {"title": "Deal 4", "status": "open", "value": "5"},
+    ]
+    requests_before = mock_server.stats['requests']
+    counts = FileLoad().sync_records(records, workers=4)
+    assert counts == {CREATED: 1, UPDATED: 1, UNCHANGED: 1, DUPLICATE: 1, FAILED: 0}
+    # one listing page, one create and one update
+    assert mock_server.stats['requests'] - requests_before == 3
+    assert mock_server.deals[1]['status'] == 'won'
+    assert mock_server.deals[3]['title'] == 'Deal 4'
+
+
+def test_second_run_without_changes_sends_nothing(mock_vault_dir, mock_server):
+    records = [{"title": f"Order {i}", "status": "open", "value": str(i)} for i in range(20)]
+    FileLoad().sync_records(records)
+    requests_before = mock_server.stats['requests']
+    counts = FileLoad().sync_records(records)
+    assert counts[UNCHANGED] == 20
+    assert mock_server.stats['requests'] - requests_before == 1
+
+
+def test_deleted_rows_are_not_created_again(mock_vault_dir, mock_server):
+    records = [{"title": "Returned order", "status": "deleted", "value": "10"}, {"title": "Open order", "status": "open", "value": "20"}]
+    assert FileLoad().sync_records(records)[CREATED] == 2
+    counts = FileLoad().sync_records(records)
+    assert counts[UNCHANGED] == 2 and counts[CREATED] == 0
+    assert mock_server.stats['deals_created'] == 2
+
+
+def test_duplicate_rows_are_acknowledged_in_journal(mock_vault_dir, mock_server):
+    records = [{"title": "Smith John", "status": "open", "value": str(i)} for i in range(3)]
+    with LoadJournal('journal.sqlite').start('orders.csv', checksum='orders') as journal:
+        counts = FileLoad().sync_records(records, workers=1, journal=journal)
+        assert counts[CREATED] == 1 and counts[DUPLICATE] == 2
+        assert journal.watermark == 3
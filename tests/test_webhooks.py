@@ -0,0 +1,119 @@
+import sys
+import json
+import time
+import base64
+import threading
+import urllib.error
+import urllib.request
+
+from modules import keyvault
+from modules.webhooks import WebhookCLI, WebhookReceiver, WebhookStore, event_key, normalize_event
+
+
+def v2_event(event_id, deal_id, title = 'Deal', action = 'change'):
+    return {"meta": {"action": action, "entity": "deal", "entity_id": str(deal_id), "id": event_id, "version": "2.0",
+        "timestamp": "2024-09-01T00:00:00Z"}, "data": {"id": deal_id, "title": title}, "previous": None}
+
+
+def v1_event(deal_id, retry = 0):
+    return {"meta": {"action": "updated", "object": "deal", "id": deal_id, "v": 1, "timestamp": 1725148800},
+        "current": {"id": deal_id, "title": "Deal"}, "previous": {"id": deal_id, "title": "Old"}, "event": "updated.deal", "retry": retry}
+
+
+def post(url, payload, user = 'hook', password = 'secret'):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), method='POST')
+    request.add_header('Authorization', "Basic " + base64.b64encode(f"{user}:{password}".encode()).decode())
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_event_key_and_normalize():
+    assert event_key(v2_event('e-1', 5)) == 'e-1'
+    # retried v1 delivery is the same event
+    assert event_key(v1_event(5)) == event_key(v1_event(5, retry=2))
+    assert event_key(v1_event(5)) != event_key(v1_event(6))
+    event = normalize_event(v1_event(5))
+    assert (event['entity'], event['action'], event['entity_id'], event['data']['title']) == ('deal', 'updated', 5, 'Deal')
+    assert normalize_event(v2_event('e-1', 7))['entity_id'] == 7
+
+
+def test_receiver_authenticates_dedupes_and_batches(tmp_path):
+    with WebhookStore(str(tmp_path / 'webhooks.sqlite')) as store:
+        with WebhookReceiver(store, port=0, user='hook', password='secret', flush_interval=0.05,
+                record_file=str(tmp_path / 'recorded.ndjson')) as receiver:
+            assert post(receiver.url, v2_event('e-1', 1)) == 200
+            assert post(receiver.url, v2_event('e-1', 1)) == 200
+            assert post(receiver.url, v1_event(2)) == 200
+            assert post(receiver.url, v1_event(2, retry=1)) == 200
+            assert post(receiver.url, v2_event('e-2', 3), password='wrong') == 401
+            assert post(receiver.url, {"meta": {"entity": "person", "version": "2.0", "id": "p-1"}}) == 200
+            request = urllib.request.Request(receiver.url, data=b'not json', method='POST',
+                headers={'Authorization': "Basic " + base64.b64encode(b"hook:secret").decode()})
+            try:
+                urllib.request.urlopen(request)
+            except urllib.error.HTTPError as e:
+                assert e.code == 400
+        assert receiver.stats == {"received": 7, "stored": 2, "duplicates": 2, "rejected": 2, "ignored": 1}
+        assert store.count() == 2
+    assert len((tmp_path / 'recorded.ndjson').read_text().splitlines()) == 2
+
+
+def test_consumer_positions(tmp_path):
+    with WebhookStore(str(tmp_path / 'webhooks.sqlite')) as store:
+        assert store.add([v2_event(f'e-{i}', i) for i in range(1, 6)] + [v2_event('e-1', 1)]) == 5
+        first = store.consume('reports', batch_size=2)
+        assert [event['entity_id'] for event in first] == [1, 2, 3, 4, 5]
+        assert store.position('reports') == 5
+        # interrupted batch is delivered again
+        store.add([v2_event('e-6', 6), v2_event('e-7', 7)])
+        events = store.consume('reports', batch_size=2)
+        assert next(events)['entity_id'] == 6
+        events.close()
+        assert [event['entity_id'] for event in store.consume('reports')] == [6, 7]
+        # other consumer has own position
+        assert len(list(store.consume('audit'))) == 7
+
+
+def test_consume_follows_new_events(tmp_path):
+    with WebhookStore(str(tmp_path / 'webhooks.sqlite')) as store:
+        stop = threading.Event()
+        seen = []
+
+        def consumer():
+            for event in store.consume(follow=True, poll_interval=0.01, stop=stop):
+                seen.append(event['entity_id'])
+
+        thread = threading.Thread(target=consumer)
+        thread.start()
+        store.add([v2_event('e-1', 1)])
+        deadline = time.monotonic() + 5
+        while not seen and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stop.set()
+        thread.join(5)
+        assert seen == [1]
+
+
+def test_cli_replay(vault_dir, monkeypatch):
+    recorded = vault_dir / 'recorded.ndjson'
+    recorded.write_text("\n".join(json.dumps(payload) for payload in
+        (v2_event('e-1', 1), v1_event(2), v1_event(2, retry=1), {"meta": {"object": "person", "id": 1}})) + "\n")
+    monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'replay_webhooks', '--store', 'events.sqlite', str(recorded)])
+    WebhookCLI().replay_webhooks()
+    with WebhookStore('events.sqlite') as store:
+        assert [event['entity_id'] for event in store.consume()] == [1, 2]
+
+    # same payloads posted to running receiver
+    with open('config.json') as config_file:
+        config = json.load(config_file)
+    with open('config.json', 'w') as config_file:
+        json.dump(dict(config, webhook_user='hook', webhook_password='secret'), config_file)
+    keyvault._file_cache.clear()
+    with WebhookStore('received.sqlite') as store:
+        with WebhookReceiver(store, port=0, user='hook', password='secret', flush_interval=0.05) as receiver:
+            monkeypatch.setattr(sys, 'argv', ['pipedrive.py', 'replay_webhooks', '--url', receiver.url, str(recorded)])
+            WebhookCLI().replay_webhooks()
+        assert store.count() == 2